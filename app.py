@@ -2,77 +2,314 @@
 import os
 from aws_cdk import core as cdk
 
-from stacks.back_end.vpc_stack import VpcStack
-from stacks.back_end.eks_cluster_stacks.eks_cluster_stack import EksClusterStack
-from stacks.back_end.s3_stack.s3_stack import S3Stack
-from stacks.back_end.eks_cluster_stacks.eks_ssm_daemonset_stack.eks_ssm_daemonset_stack import EksSsmDaemonSetStack
-from stacks.back_end.eks_cluster_stacks.eks_metrics_server_stack import EksMetricsServerStack
-from stacks.back_end.emr_on_eks_stack.emr_on_eks_stack import EmrOnEksStack
+# The stack modules are imported by their builders, only for the stacks being synthesized
+from stacks.cdk_utils.stack_registry import StackRegistry
+from stacks.cdk_utils.synth_cache import record_synth_fingerprint
+from stacks.back_end.eks_cluster_stacks.storage_profiles import SPILL_STORAGE_CLASS
+from stacks.back_end.eks_cluster_stacks.node_profiles import root_volume_size
+from stacks.back_end.eks_cluster_stacks.cache_profiles import cache_tier_config, alluxio_spark_conf
+from stacks.back_end.eks_cluster_stacks.log_shipping_profiles import log_shipping_config
+from stacks.back_end.emr_on_eks_stack.emr_config_profiles import get_config_profile, CONFIG_PROFILE_CONTEXT_KEY
+from stacks.fleet.fleet_spec import load_fleet_spec, stack_names, build_routing_table
 
 
 app = cdk.App()
 
-stack_uniqueness = f"11"
 
-# VPC Stack for hosting Secure workloads & Other resources
-vpc_stack = VpcStack(
-    app,
-    # f"{app.node.try_get_context('project')}-vpc-stack",
-    f"eks-cluster-vpc-stack{stack_uniqueness}",
-    stack_log_level="INFO",
-    description="Miztiik Automation: Custom Multi-AZ VPC"
-)
+def _context_flag(key: str) -> bool:
+    # `-c key=true` on the cli comes in as a string, cdk.json gives us a bool
+    return str(app.node.try_get_context(key)).lower() in ("true", "1", "yes")
 
 
-# EKS Cluster to process event processor
-eks_cluster_stack = EksClusterStack(
-    app,
-    f"eks-cluster-stack{stack_uniqueness}",
-    stack_log_level="INFO",
-    stack_uniqueness=stack_uniqueness,
-    vpc=vpc_stack.vpc,
-    description="Miztiik Automation: EKS Cluster to process event processor"
-)
+# Fleet of clusters, one per region/account. Defaults to the single cluster setup.
+# Ex: cdk synth -c fleet_spec=stacks/fleet/sample_fleet.yaml
+fleet = load_fleet_spec(app)
+dataset_routing = build_routing_table(fleet)
 
-# Bootstrap EKS Nodes with SSM Agents
-ssm_agent_installer_daemonset = EksSsmDaemonSetStack(
-    app,
-    f"ssm-agent-installer-daemonset-stack{stack_uniqueness}",
-    stack_log_level="INFO",
-    eks_cluster=eks_cluster_stack.eks_cluster_1,
-    description="Miztiik Automation: Bootstrap EKS Nodes with SSM Agents"
-)
+# Schedule Spark drivers on a Fargate profile in the EMR namespace
+spark_drivers_on_fargate = _context_flag("spark_drivers_on_fargate")
+
+# Kubelet reservations, eviction thresholds & sysctls for the node groups, Ex: "spark_tuned"
+node_profile = app.node.try_get_context("node_profile")
+
+# EBS CSI driver with gp3 StorageClasses, optionally used by executors for spill volumes
+enable_ebs_csi = _context_flag("ebs_csi")
+executor_spill_pvc = _context_flag("executor_spill_pvc")
+if executor_spill_pvc and not enable_ebs_csi:
+    raise ValueError("`executor_spill_pvc` needs the `ebs_csi` context set to true")
+
+# Graviton(ARM64) node group size, 0 to skip it. Also adds arch pinned pod & job templates.
+graviton_nodes = int(app.node.try_get_context("graviton_nodes") or 0)
+
+# Metrics Server stack, fetches the upstream manifest at synth
+metrics_server = _context_flag("metrics_server")
+
+# Spot node group size, 0 to skip it
+spot_nodes = int(app.node.try_get_context("spot_nodes") or 0)
 
-# Add Metrics Server to EKS Cluster
-# k8s_metrics_server_stack = EksMetricsServerStack(
-#     app,
-#     f"k8s-metrics-server-stack{stack_uniqueness}",
-#     stack_log_level="INFO",
-#     eks_cluster=eks_cluster_stack.eks_cluster_1,
-#     description="Miztiik Automation: Add Metrics Server to EKS Cluster"
-# )
-
-# S3 Bucket to hold our EMR Job Artifacts
-emr_artifacts_bkt_stack = S3Stack(
-    app,
-    # f"{app.node.try_get_context('project')}-sales-events-bkt-stack",
-    f"emr-artifacts-bkt-stack",
-    stack_log_level="INFO",
-    description="Miztiik Automation: S3 Bucket to hold our EMR Job Artifacts"
+# Node termination handler draining interrupted nodes, with Spark executor decommissioning
+# enabled in the job templates so the executors migrate their blocks before the node goes away
+node_termination_handler = _context_flag("node_termination_handler")
+
+# Alluxio cache tier for hot S3 datasets, `true` for the defaults or a dict of overrides,
+# Ex: {"cache_size": "200Gi", "host_path": "/mnt/nvme/alluxio", "dedicated_volume": true, "eviction_policy": "LRFU"}
+alluxio_cache = cache_tier_config(
+    app.node.try_get_context("alluxio_cache"),
+    node_root_volume_size=root_volume_size(node_profile)
 )
 
-# Deploy EMR on EKS
-emr_on_eks_stack = EmrOnEksStack(
-    app,
-    f"emr-on-eks-stack{stack_uniqueness}",
-    stack_log_level="INFO",
-    stack_uniqueness=stack_uniqueness,
-    eks_cluster=eks_cluster_stack.eks_cluster_1,
-    clust_oidc_provider_arn=eks_cluster_stack.clust_oidc_provider_arn,
-    clust_oidc_issuer=eks_cluster_stack.clust_oidc_issuer,
-    description="Miztiik Automation: Deploy EMR on EKS"
+# Fluent Bit agents shipping the driver & executor logs to S3 & CloudWatch, `true` for the
+# defaults or a dict of overrides, Ex: {"flush_interval": 10, "cloudwatch": false, "disk_budget": "1Gi"}
+log_shipping = log_shipping_config(
+    app.node.try_get_context("log_shipping"),
+    node_root_volume_size=root_volume_size(node_profile)
 )
 
+# API Priority & Fairness for the EMR namespace, with fewer executor pod API calls from the drivers
+api_flow_control = _context_flag("api_flow_control")
+
+# Versioned EMR release & spark confs of the job templates, `<name>@<version>`, Ex: "spark3@2"
+emr_config_profile = get_config_profile(
+    app.node.try_get_context(CONFIG_PROFILE_CONTEXT_KEY))
+
+# Every tenant gets a S3 access point & prefix on the artifacts bucket.
+# The first tenant owns the EMR namespace & virtual cluster of this app.
+emr_tenants = app.node.try_get_context("emr_tenants") or ["red-shirts"]
+
+
+def register_fleet_member(registry: StackRegistry, fleet_member: dict):
+    stack_uniqueness = fleet_member["name"]
+    _stack_names = stack_names(fleet_member)
+
+    # Co-locate all the stacks of a fleet member in the same account/region
+    member_env = None
+    if fleet_member.get("region"):
+        member_env = cdk.Environment(
+            account=fleet_member.get("account"),
+            region=fleet_member["region"]
+        )
+
+    # VPC Stack for hosting Secure workloads & Other resources
+    def vpc_stack():
+        from stacks.back_end.vpc_stack import VpcStack
+        return VpcStack(
+            app,
+            # f"{app.node.try_get_context('project')}-vpc-stack",
+            _stack_names["vpc"],
+            stack_log_level="INFO",
+            env=member_env,
+            description="Miztiik Automation: Custom Multi-AZ VPC"
+        )
+    registry.register(_stack_names["vpc"], vpc_stack)
+
+    # kubectl/helm provider layer shared by all clusters in the environment
+    def shared_assets_stack():
+        from stacks.back_end.shared_assets_stack.shared_assets_stack import SharedAssetsStack
+        return SharedAssetsStack.for_env(
+            app,
+            env=member_env,
+            stack_log_level="INFO"
+        )
+    if _stack_names["shared_assets"] not in registry:
+        registry.register(_stack_names["shared_assets"], shared_assets_stack)
+
+    # EKS Cluster to process event processor
+    def eks_cluster_stack():
+        from stacks.back_end.eks_cluster_stacks.eks_cluster_stack import EksClusterStack
+        spark_driver_fargate_ns = None
+        if spark_drivers_on_fargate:
+            from stacks.back_end.emr_on_eks_stack.emr_on_eks_stack import EmrOnEksStack
+            spark_driver_fargate_ns = EmrOnEksStack.EMR_01_NS_NAME
+        return EksClusterStack(
+            app,
+            _stack_names["eks_cluster"],
+            stack_log_level="INFO",
+            stack_uniqueness=stack_uniqueness,
+            vpc=registry.get(_stack_names["vpc"]).vpc,
+            kubectl_layer=registry.get(
+                _stack_names["shared_assets"]).kubectl_layer,
+            spark_driver_fargate_ns=spark_driver_fargate_ns,
+            node_profile=node_profile,
+            enable_ebs_csi=enable_ebs_csi,
+            graviton_nodes=graviton_nodes,
+            spot_nodes=spot_nodes,
+            env=member_env,
+            description="Miztiik Automation: EKS Cluster to process event processor"
+        )
+    registry.register(
+        _stack_names["eks_cluster"],
+        eks_cluster_stack,
+        depends_on=[_stack_names["vpc"], _stack_names["shared_assets"]]
+    )
+
+    # Bootstrap EKS Nodes with SSM Agents
+    def ssm_agent_installer_daemonset():
+        from stacks.back_end.eks_cluster_stacks.eks_ssm_daemonset_stack.eks_ssm_daemonset_stack import EksSsmDaemonSetStack
+        return EksSsmDaemonSetStack(
+            app,
+            _stack_names["ssm_daemonset"],
+            stack_log_level="INFO",
+            eks_cluster=registry.get(_stack_names["eks_cluster"]).eks_cluster_1,
+            env=member_env,
+            description="Miztiik Automation: Bootstrap EKS Nodes with SSM Agents"
+        )
+    registry.register(
+        _stack_names["ssm_daemonset"],
+        ssm_agent_installer_daemonset,
+        depends_on=[_stack_names["eks_cluster"]]
+    )
+
+    # Drain nodes on spot interruption, rebalance & scheduled maintenance notices
+    def node_termination_handler_stack():
+        from stacks.back_end.eks_cluster_stacks.eks_node_termination_handler_stack.eks_node_termination_handler_stack import EksNodeTerminationHandlerStack
+        eks = registry.get(_stack_names["eks_cluster"])
+        return EksNodeTerminationHandlerStack(
+            app,
+            _stack_names["node_termination_handler"],
+            stack_log_level="INFO",
+            eks_cluster=eks.eks_cluster_1,
+            clust_oidc_provider_arn=eks.clust_oidc_provider_arn,
+            clust_oidc_issuer=eks.clust_oidc_issuer,
+            env=member_env,
+            description="Miztiik Automation: Drain EKS Nodes on Spot Interruption"
+        )
+    if node_termination_handler:
+        registry.register(
+            _stack_names["node_termination_handler"],
+            node_termination_handler_stack,
+            depends_on=[_stack_names["eks_cluster"]]
+        )
+
+    # Add Metrics Server to EKS Cluster
+    def k8s_metrics_server_stack():
+        from stacks.back_end.eks_cluster_stacks.eks_metrics_server_stack import EksMetricsServerStack
+        return EksMetricsServerStack(
+            app,
+            _stack_names["metrics_server"],
+            stack_log_level="INFO",
+            eks_cluster=registry.get(_stack_names["eks_cluster"]).eks_cluster_1,
+            env=member_env,
+            description="Miztiik Automation: Add Metrics Server to EKS Cluster"
+        )
+    if metrics_server:
+        registry.register(
+            _stack_names["metrics_server"],
+            k8s_metrics_server_stack,
+            depends_on=[_stack_names["eks_cluster"]]
+        )
+
+    # S3 Bucket to hold our EMR Job Artifacts
+    def emr_artifacts_bkt_stack():
+        from stacks.back_end.s3_stack.s3_stack import S3Stack
+        return S3Stack(
+            app,
+            # f"{app.node.try_get_context('project')}-sales-events-bkt-stack",
+            _stack_names["artifacts_bkt"],
+            stack_log_level="INFO",
+            tenants=emr_tenants,
+            env=member_env,
+            description="Miztiik Automation: S3 Bucket to hold our EMR Job Artifacts"
+        )
+    registry.register(_stack_names["artifacts_bkt"], emr_artifacts_bkt_stack)
+
+    # In-cluster cache tier, with the prefix of the EMR namespace tenant as the under-store
+    def alluxio_cache_stack():
+        from stacks.back_end.eks_cluster_stacks.eks_alluxio_cache_stack.eks_alluxio_cache_stack import EksAlluxioCacheStack
+        eks = registry.get(_stack_names["eks_cluster"])
+        artifacts_bkt = registry.get(_stack_names["artifacts_bkt"])
+        return EksAlluxioCacheStack(
+            app,
+            _stack_names["alluxio_cache"],
+            stack_log_level="INFO",
+            eks_cluster=eks.eks_cluster_1,
+            clust_oidc_provider_arn=eks.clust_oidc_provider_arn,
+            clust_oidc_issuer=eks.clust_oidc_issuer,
+            artifacts_bkt=artifacts_bkt.data_bkt,
+            tenant_prefix=artifacts_bkt.tenant_access_points[emr_tenants[0]]["prefix"],
+            cache_config=alluxio_cache,
+            env=member_env,
+            description="Miztiik Automation: Alluxio Cache Tier for hot S3 datasets"
+        )
+    if alluxio_cache:
+        registry.register(
+            _stack_names["alluxio_cache"],
+            alluxio_cache_stack,
+            depends_on=[_stack_names["eks_cluster"],
+                        _stack_names["artifacts_bkt"]]
+        )
+
+    # Spark logs of the EMR namespace, under the logs prefix of its tenant
+    def log_shipping_stack():
+        from stacks.back_end.eks_cluster_stacks.eks_log_shipping_stack.eks_log_shipping_stack import EksLogShippingStack
+        from stacks.back_end.emr_on_eks_stack.emr_on_eks_stack import EmrOnEksStack
+        eks = registry.get(_stack_names["eks_cluster"])
+        artifacts_bkt = registry.get(_stack_names["artifacts_bkt"])
+        return EksLogShippingStack(
+            app,
+            _stack_names["log_shipping"],
+            stack_log_level="INFO",
+            eks_cluster=eks.eks_cluster_1,
+            clust_oidc_provider_arn=eks.clust_oidc_provider_arn,
+            clust_oidc_issuer=eks.clust_oidc_issuer,
+            artifacts_bkt=artifacts_bkt.data_bkt,
+            log_shipping_config=log_shipping,
+            spark_namespaces=[EmrOnEksStack.EMR_01_NS_NAME],
+            logs_prefix=f"{artifacts_bkt.tenant_access_points[emr_tenants[0]]['prefix']}logs/spark/",
+            fargate_pod_execution_role=eks.spark_driver_fargate_profile.pod_execution_role if spark_drivers_on_fargate else None,
+            env=member_env,
+            description="Miztiik Automation: Ship Spark driver & executor logs to S3 & CloudWatch"
+        )
+    if log_shipping:
+        registry.register(
+            _stack_names["log_shipping"],
+            log_shipping_stack,
+            depends_on=[_stack_names["eks_cluster"],
+                        _stack_names["artifacts_bkt"]]
+        )
+
+    # Deploy EMR on EKS
+    def emr_on_eks_stack():
+        from stacks.back_end.emr_on_eks_stack.emr_on_eks_stack import EmrOnEksStack
+        eks = registry.get(_stack_names["eks_cluster"])
+        artifacts_bkt = registry.get(_stack_names["artifacts_bkt"])
+        return EmrOnEksStack(
+            app,
+            _stack_names["emr_on_eks"],
+            stack_log_level="INFO",
+            stack_uniqueness=stack_uniqueness,
+            eks_cluster=eks.eks_cluster_1,
+            clust_oidc_provider_arn=eks.clust_oidc_provider_arn,
+            clust_oidc_issuer=eks.clust_oidc_issuer,
+            dataset_routing=dataset_routing,
+            artifacts_bkt=artifacts_bkt.data_bkt,
+            drivers_on_fargate=spark_drivers_on_fargate,
+            tenant=emr_tenants[0],
+            tenant_access_point=artifacts_bkt.tenant_access_points[emr_tenants[0]],
+            executor_spill_storage_class=SPILL_STORAGE_CLASS if executor_spill_pvc else None,
+            node_archs=["amd64", "arm64"] if graviton_nodes else None,
+            executor_decommission=node_termination_handler,
+            cache_tier_spark_conf=alluxio_spark_conf(
+                alluxio_cache) if alluxio_cache else None,
+            config_profile=emr_config_profile,
+            api_flow_control=api_flow_control,
+            env=member_env,
+            description="Miztiik Automation: Deploy EMR on EKS"
+        )
+    registry.register(
+        _stack_names["emr_on_eks"],
+        emr_on_eks_stack,
+        depends_on=[_stack_names["eks_cluster"], _stack_names["artifacts_bkt"]]
+    )
+
+
+registry = StackRegistry(app)
+for fleet_member in fleet["members"]:
+    register_fleet_member(registry, fleet_member)
+
+# Build only the stacks in the `stacks` context & their dependencies, all of them by default,
+# Ex: cdk synth -c stacks=emr-artifacts-bkt-stack
+registry.build_from_context()
+
 
 # Stack Level Tagging
 _tags_lst = app.node.try_get_context("tags")
@@ -84,3 +321,6 @@ if _tags_lst:
                 k, v, apply_to_launched_instances=True, priority=300)
 
 app.synth()
+
+# Stamp the cloud assembly with the inputs & context it came from, so synth_cache can tell if it is current
+record_synth_fingerprint(app.outdir)
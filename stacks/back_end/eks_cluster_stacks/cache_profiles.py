@@ -0,0 +1,177 @@
+"""
+Alluxio cache tier settings.
+
+The workers keep the hot part of the tenant prefix of the artifacts bucket on the local
+disk of the executor nodes. Spark reads `alluxio://` paths, the first read goes through to
+S3 and the following reads are served from the cache instead of crossing the NAT again.
+"""
+
+import hashlib
+
+from stacks.k8s_utils.kube_api import parse_memory
+from stacks.back_end.eks_cluster_stacks.node_profiles import DEFAULT_ROOT_VOLUME_SIZE
+
+
+ALLUXIO_NS = "alluxio"
+ALLUXIO_RELEASE = "alluxio"
+ALLUXIO_MASTER_RPC_PORT = 19998
+
+# Alluxio 2.x block annotators, they decide which blocks get evicted first
+EVICTION_POLICIES = {
+    "LRU": "alluxio.worker.block.annotator.LRUAnnotator",
+    "LRFU": "alluxio.worker.block.annotator.LRFUAnnotator",
+}
+
+# The workers & the pin job run the amd64 Alluxio image, they stay off the Graviton nodes
+ALLUXIO_NODE_SELECTOR = {"compute_provider": "ec2", "kubernetes.io/arch": "amd64"}
+
+ALLUXIO_CLIENT_JAR_URL = "https://repo1.maven.org/maven2/org/alluxio/alluxio-shaded-client/{version}/alluxio-shaded-client-{version}.jar"
+
+# Share of the node root volume the cache may take. The images, container logs & executor
+# scratch space live there too, and the kubelet evicts pods below 15% free(nodefs).
+MAX_ROOT_VOLUME_CACHE_SHARE = 0.25
+
+# Override any of these with a dict in the `alluxio_cache` context
+DEFAULT_CACHE_TIER = {
+    "version": "2.9.3",
+    # Per worker cache size, fits the default 20GiB node root volume. Set `dedicated_volume` for more.
+    "cache_size": "4Gi",
+    # Host directory of the cache, point it at the mounted NVMe instance store where there is one
+    "host_path": "/mnt/alluxio",
+    # `host_path` is a volume of its own(NVMe instance store, extra EBS volume), not on the node root volume
+    "dedicated_volume": False,
+    # SSD for NVMe/EBS, MEM for a ramdisk
+    "medium": "SSD",
+    "eviction_policy": "LRU",
+    # Eviction starts above the high watermark and frees space down to the low watermark
+    "high_watermark": 0.95,
+    "low_watermark": 0.7,
+    # Alluxio paths(= prefixes under the tenant prefix) pinned & pre-loaded into the cache, Ex: ["/dims"]
+    "pinned_datasets": [],
+    # Alluxio client jar for Spark, Ex: "s3://<bkt>/jars/alluxio-shaded-client-2.9.3.jar" or a
+    # "local://" path in a custom image. Defaults to the jar of `version` on Maven Central.
+    "client_jar": None,
+}
+
+
+def cache_tier_config(ctx_value, node_root_volume_size=DEFAULT_ROOT_VOLUME_SIZE):
+    """
+    Cache tier settings from the `alluxio_cache` context, `None` when the tier is disabled.
+    `true` deploys it with the defaults, a dict overrides them. Without a dedicated volume,
+    the cache has to fit its share of the `node_root_volume_size`(GiB) root volume.
+    """
+    if not ctx_value or str(ctx_value).lower() in ("false", "0", "no"):
+        return None
+    cfg = dict(DEFAULT_CACHE_TIER)
+    if isinstance(ctx_value, dict):
+        unknown = set(ctx_value) - set(DEFAULT_CACHE_TIER)
+        if unknown:
+            raise ValueError(
+                f"Unknown alluxio_cache settings: {sorted(unknown)}")
+        cfg.update(ctx_value)
+    if cfg["eviction_policy"] not in EVICTION_POLICIES:
+        raise ValueError(
+            f"Unknown eviction_policy '{cfg['eviction_policy']}', choose one of {list(EVICTION_POLICIES)}")
+    if not 0 < cfg["low_watermark"] < cfg["high_watermark"] <= 1:
+        raise ValueError("Cache watermarks need 0 < low_watermark < high_watermark <= 1")
+    max_cache_size = node_root_volume_size * 2 ** 30 * MAX_ROOT_VOLUME_CACHE_SHARE
+    if not cfg["dedicated_volume"] and parse_memory(cfg["cache_size"]) > max_cache_size:
+        raise ValueError(
+            f"cache_size {cfg['cache_size']} is more than {MAX_ROOT_VOLUME_CACHE_SHARE:.0%} of the "
+            f"{node_root_volume_size}GiB node root volume, it would get the executors evicted. "
+            f"Point host_path at a dedicated volume & set dedicated_volume, or lower cache_size")
+    return cfg
+
+
+def alluxio_master_address(namespace=ALLUXIO_NS):
+    return f"{ALLUXIO_RELEASE}-master-0.{namespace}.svc.cluster.local:{ALLUXIO_MASTER_RPC_PORT}"
+
+
+def alluxio_properties(cfg, ufs_uri):
+    """
+    Alluxio site properties, mounting `ufs_uri` as the root of the namespace
+    """
+    return {
+        "alluxio.master.mount.table.root.ufs": ufs_uri,
+        "alluxio.master.mount.table.root.readonly": "true",
+        # The role can only read the tenant prefix, no bucket ACL lookups
+        "alluxio.underfs.s3.inherit.acl": "false",
+        "alluxio.worker.block.annotator.class": EVICTION_POLICIES[cfg["eviction_policy"]],
+        "alluxio.user.file.readtype.default": "CACHE",
+        "alluxio.user.file.passive.cache.enabled": "true",
+    }
+
+
+def alluxio_tieredstore(cfg):
+    return {
+        "levels": [
+            {
+                "level": 0,
+                "alias": cfg["medium"],
+                "mediumtype": cfg["medium"],
+                "path": cfg["host_path"],
+                "type": "hostPath",
+                "quota": cfg["cache_size"],
+                "high": cfg["high_watermark"],
+                "low": cfg["low_watermark"],
+            }
+        ]
+    }
+
+
+def pin_job_manifest(cfg, namespace=ALLUXIO_NS):
+    """
+    One-off Job pinning & loading the pinned datasets. Jobs are immutable, so the name
+    changes with the pinned list to get a new Job on every change.
+    """
+    paths = cfg["pinned_datasets"]
+    digest = hashlib.sha1(",".join(paths).encode("utf-8")).hexdigest()[:8]
+    cmds = [
+        f"alluxio fs pin {p} {cfg['medium']} && alluxio fs distributedLoad {p}" for p in paths
+    ]
+    return {
+        "apiVersion": "batch/v1",
+        "kind": "Job",
+        "metadata": {"name": f"alluxio-pin-{digest}", "namespace": namespace},
+        "spec": {
+            # Retries while the master & workers come up
+            "backoffLimit": 10,
+            "template": {
+                "spec": {
+                    "restartPolicy": "OnFailure",
+                    "nodeSelector": ALLUXIO_NODE_SELECTOR,
+                    "containers": [
+                        {
+                            "name": "alluxio-pin",
+                            "image": f"alluxio/alluxio:{cfg['version']}",
+                            "command": ["/bin/sh", "-c", " && ".join(cmds)],
+                            "env": [
+                                {
+                                    "name": "ALLUXIO_JAVA_OPTS",
+                                    "value": f"-Dalluxio.master.hostname={ALLUXIO_RELEASE}-master-0.{namespace}.svc.cluster.local"
+                                }
+                            ]
+                        }
+                    ]
+                }
+            }
+        }
+    }
+
+
+def alluxio_spark_conf(cfg, namespace=ALLUXIO_NS):
+    """
+    spark-defaults properties for reading `alluxio://` paths. The EMR images do not ship the
+    client jar, it is added through `spark.jars`, so the `--packages` of a job still resolve
+    alongside it. A job passing its own `--jars` replaces `spark.jars` & has to list the client jar.
+    """
+    return {
+        "spark.jars": cfg["client_jar"] or ALLUXIO_CLIENT_JAR_URL.format(version=cfg["version"]),
+        # The job user cannot write its home directory in the EMR images, `--packages` resolve in /tmp
+        "spark.jars.ivy": "/tmp/.ivy2",
+        "spark.hadoop.fs.alluxio.impl": "alluxio.hadoop.FileSystem",
+        "spark.hadoop.alluxio.master.rpc.addresses": alluxio_master_address(namespace),
+        "spark.hadoop.alluxio.user.file.readtype.default": "CACHE",
+        # Prefer the worker on the executor's own node
+        "spark.hadoop.alluxio.user.ufs.block.read.location.policy": "alluxio.client.block.policy.LocalFirstPolicy",
+    }
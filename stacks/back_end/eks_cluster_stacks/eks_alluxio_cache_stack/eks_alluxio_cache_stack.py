@@ -0,0 +1,161 @@
+from aws_cdk import aws_eks as _eks
+from aws_cdk import aws_iam as _iam
+from aws_cdk import core as cdk
+
+from stacks.miztiik_global_args import GlobalArgs
+from stacks.k8s_utils.irsa import create_irsa_role, service_account_manifest
+from stacks.back_end.eks_cluster_stacks.cache_profiles import (
+    ALLUXIO_NODE_SELECTOR,
+    ALLUXIO_NS,
+    ALLUXIO_RELEASE,
+    alluxio_master_address,
+    alluxio_properties,
+    alluxio_tieredstore,
+    pin_job_manifest,
+)
+
+
+class EksAlluxioCacheStack(cdk.Stack):
+    def __init__(
+        self,
+        scope: cdk.Construct,
+        construct_id: str,
+        stack_log_level: str,
+        eks_cluster,
+        clust_oidc_provider_arn,
+        clust_oidc_issuer,
+        artifacts_bkt,
+        tenant_prefix: str,
+        cache_config: dict,
+        sa_name: str = "alluxio",
+        **kwargs
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        # Add your stack resources below):
+
+        ######################################
+        #######                        #######
+        #######   Alluxio Cache Tier   #######
+        #######                        #######
+        ######################################
+
+        # Ref: https://docs.alluxio.io/os/user/stable/en/kubernetes/Running-Alluxio-On-Kubernetes.html
+
+        alluxio_ns = _eks.KubernetesManifest(
+            self,
+            "alluxioNs",
+            cluster=eks_cluster,
+            manifest=[
+                {
+                    "apiVersion": "v1",
+                    "kind": "Namespace",
+                    "metadata": {
+                        "name": ALLUXIO_NS,
+                        "labels": {
+                            "name": ALLUXIO_NS,
+                            "owner": "miztiik-automation"
+                        }
+                    }
+                }
+            ]
+        )
+
+        # The under-store is the prefix of the tenant owning the EMR namespace, read only.
+        # The cache tier never writes back, nor sees the prefixes of the other tenants.
+        alluxio_role = create_irsa_role(
+            self,
+            "alluxioRole",
+            oidc_provider_arn=clust_oidc_provider_arn,
+            oidc_issuer=clust_oidc_issuer,
+            namespace=ALLUXIO_NS,
+            sa_name=sa_name
+        )
+        alluxio_role.add_to_policy(
+            _iam.PolicyStatement(
+                effect=_iam.Effect.ALLOW,
+                actions=["s3:GetObject"],
+                resources=[artifacts_bkt.arn_for_objects(f"{tenant_prefix}*")]
+            )
+        )
+        alluxio_role.add_to_policy(
+            _iam.PolicyStatement(
+                effect=_iam.Effect.ALLOW,
+                actions=["s3:ListBucket"],
+                resources=[artifacts_bkt.bucket_arn],
+                conditions={
+                    "StringLike": {
+                        "s3:prefix": [f"{tenant_prefix}*", tenant_prefix.rstrip("/")]
+                    }
+                }
+            )
+        )
+
+        alluxio_sa = _eks.KubernetesManifest(
+            self,
+            "alluxioSa",
+            cluster=eks_cluster,
+            manifest=[
+                service_account_manifest(
+                    sa_name, ALLUXIO_NS, alluxio_role.role_arn)
+            ]
+        )
+        alluxio_sa.node.add_dependency(alluxio_ns)
+
+        alluxio_chart = _eks.HelmChart(
+            self,
+            "alluxioChart",
+            cluster=eks_cluster,
+            chart="alluxio",
+            repository=f"https://alluxio-charts.storage.googleapis.com/openSource/{cache_config['version']}",
+            release=ALLUXIO_RELEASE,
+            namespace=ALLUXIO_NS,
+            values={
+                "serviceAccount": sa_name,
+                "properties": alluxio_properties(
+                    cache_config, f"s3://{artifacts_bkt.bucket_name}/{tenant_prefix}"),
+                # Workers cache on the local disk of the EC2 nodes, where the executors run
+                "tieredstore": alluxio_tieredstore(cache_config),
+                "nodeSelector": ALLUXIO_NODE_SELECTOR,
+                # Metadata is rebuilt from the bucket on restart, no journal volume needed for a read cache
+                "journal": {
+                    "type": "UFS",
+                    "ufsType": "local",
+                    "folder": "/journal",
+                    "volumeType": "emptyDir",
+                    "medium": ""
+                },
+                "shortCircuit": {"enabled": False},
+                "fuse": {"enabled": False}
+            }
+        )
+        alluxio_chart.node.add_dependency(alluxio_sa)
+
+        # Keep the hot datasets(Ex: dimension tables) in the cache, safe from eviction
+        if cache_config["pinned_datasets"]:
+            pin_job = _eks.KubernetesManifest(
+                self,
+                "alluxioPinJob",
+                cluster=eks_cluster,
+                manifest=[
+                    pin_job_manifest(cache_config)
+                ]
+            )
+            pin_job.node.add_dependency(alluxio_chart)
+
+        ###########################################
+        ################# OUTPUTS #################
+        ###########################################
+        output_0 = cdk.CfnOutput(
+            self,
+            "AutomationFrom",
+            value=f"{GlobalArgs.SOURCE_INFO}",
+            description="To know more about this automation stack, check out our github page."
+        )
+
+        output_1 = cdk.CfnOutput(
+            self,
+            "AlluxioMasterAddress",
+            value=alluxio_master_address(),
+            description="Alluxio master rpc address, read the tenant prefix of the artifacts bucket as alluxio:///<key under the prefix>"
+        )
@@ -7,6 +7,23 @@ import yaml
 import requests
 
 from stacks.miztiik_global_args import GlobalArgs
+from stacks.k8s_utils.pod_templates import SPARK_DRIVER_ROLE_LABELS, FARGATE_DRIVER_LABELS, ARM64_NODE_TAINT
+from stacks.back_end.eks_cluster_stacks.node_profiles import DEFAULT_ROOT_VOLUME_SIZE, get_node_profile, node_user_data, nodegroup_node_labels
+from stacks.back_end.eks_cluster_stacks.storage_profiles import EBS_CSI_CHART_VERSION, GP3_STORAGE_CLASSES, gp3_storage_class_manifest
+from stacks.k8s_utils.irsa import create_irsa_role, service_account_manifest
+
+
+KUBERNETES_VERSION = _eks.KubernetesVersion.V1_20
+
+# EKS AMIs per cpu architecture, keyed by the `kubernetes.io/arch` label value
+NODE_AMI_TYPES = {
+    "amd64": _eks.NodegroupAmiType.AL2_X86_64,
+    "arm64": _eks.NodegroupAmiType.AL2_ARM_64,
+}
+NODE_CPU_ARCHS = {
+    "amd64": _eks.CpuArch.X86_64,
+    "arm64": _eks.CpuArch.ARM_64,
+}
 
 
 class EksClusterStack(cdk.Stack):
@@ -17,6 +34,13 @@ class EksClusterStack(cdk.Stack):
         stack_log_level,
         stack_uniqueness: str,
         vpc,
+        kubectl_layer=None,
+        spark_driver_fargate_ns: str = None,
+        node_profile: str = None,
+        enable_ebs_csi: bool = False,
+        gp3_storage_classes: dict = None,
+        graviton_nodes: int = 0,
+        spot_nodes: int = 0,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -111,7 +135,7 @@ class EksClusterStack(cdk.Stack):
             self,
             f"{clust_name}",
             cluster_name=f"{clust_name}",
-            version=_eks.KubernetesVersion.V1_20,
+            version=KUBERNETES_VERSION,
             vpc=vpc,
             vpc_subnets=[
                 _ec2.SubnetSelection(
@@ -123,8 +147,10 @@ class EksClusterStack(cdk.Stack):
             masters_role=c_admin_role,
             role=self._eks_cluster_svc_role,
             security_group=self.eks_cluster_sg,
-            endpoint_access=_eks.EndpointAccess.PUBLIC
+            endpoint_access=_eks.EndpointAccess.PUBLIC,
             # endpoint_access=_eks.EndpointAccess.PUBLIC_AND_PRIVATE
+            # Reuse the kubectl layer shared across the environment, instead of bundling one per cluster
+            kubectl_layer=kubectl_layer
         )
 
         # Setup OIDC Provider
@@ -153,10 +179,25 @@ class EksClusterStack(cdk.Stack):
             emr_svc_role, groups=[], username="emr-containers")
 
         # Adding Node groups
-        self.add_on_demand_ng(clust_name, desired_no=3)
-        # self.add_spot_ng(clust_name,desired_no=2)
+        # `node_profile` applies a tuned kubelet/sysctl bootstrap profile, Ex: "spark_tuned"
+        self.add_on_demand_ng(clust_name, desired_no=3,
+                              node_profile=node_profile)
+        # Spot nodes, pair with EksNodeTerminationHandlerStack to drain them gracefully on interruption
+        if spot_nodes:
+            self.add_spot_ng(
+                clust_name, desired_no=spot_nodes, node_profile=node_profile)
+        # ARM64 node group, for Spark jobs pinned to Graviton with the arm64 pod templates
+        if graviton_nodes:
+            self.add_graviton_ng(
+                clust_name, desired_no=graviton_nodes, node_profile=node_profile)
         # self.add_fargate_profile(clust_name, fargate_ns_name="fargate-ns-01", create_fargate_ns=True)
 
+        # Run Spark drivers on Fargate, so they do not wait for executors to free up node capacity
+        self.spark_driver_fargate_profile = None
+        if spark_driver_fargate_ns:
+            self.spark_driver_fargate_profile = self.add_spark_driver_fargate_profile(
+                clust_name, spark_driver_fargate_ns)
+
         # We like to use the Kubernetes Dashboard
         # self.enable_dashboard_with_helm()
         # self.enable_dashboard_with_yaml()
@@ -166,6 +207,12 @@ class EksClusterStack(cdk.Stack):
         # OIDC Provider ARN
         self.clust_oidc_provider_arn = clust_oidc_provider.open_id_connect_provider_arn
 
+        # EBS CSI Driver & gp3 StorageClasses for dynamically provisioned executor spill volumes
+        if enable_ebs_csi:
+            ebs_csi_chart = self.add_ebs_csi_driver()
+            self.add_gp3_storage_classes(
+                ebs_csi_chart, gp3_storage_classes or GP3_STORAGE_CLASSES)
+
         ###########################################
         ################# OUTPUTS #################
         ###########################################
@@ -203,7 +250,11 @@ class EksClusterStack(cdk.Stack):
             description="EKS Cluster OIDC Issuer Url"
         )
 
-    def add_on_demand_ng(self, clust_name, desired_no=2):
+    def add_on_demand_ng(self, clust_name, desired_no=2, node_profile: str = None):
+        ng_labels = {"app": "miztiik_on_demand_ng",
+                     "lifecycle": "on_demand",
+                     "compute_provider": "ec2"
+                     }
         on_demand_n_g_1 = self.eks_cluster_1.add_nodegroup_capacity(
             f"on_demand_n_g_1_{clust_name}",
             nodegroup_name=f"on_demand_n_g_1_{clust_name}",
@@ -212,24 +263,23 @@ class EksClusterStack(cdk.Stack):
                 # _ec2.InstanceType("t3.large"),
                 _ec2.InstanceType("m5.xlarge"),
             ],
-            disk_size=20,
             min_size=1,
             max_size=6,
             desired_size=desired_no,
-            labels={"app": "miztiik_on_demand_ng",
-                    "lifecycle": "on_demand",
-                    "compute_provider": "ec2"
-                    },
+            labels=ng_labels,
             subnets=_ec2.SubnetSelection(
                 subnet_type=_ec2.SubnetType.PUBLIC),
-            ami_type=_eks.NodegroupAmiType.AL2_X86_64,
             # remote_access=_eks.NodegroupRemoteAccess(ssh_key_name="eks-ssh-keypair"),
             capacity_type=_eks.CapacityType.ON_DEMAND,
-            node_role=self._eks_node_role
-            # bootstrap_options={"kubelet_extra_args": "--node-labels=node.kubernetes.io/lifecycle=spot,daemonset=active,app=general --eviction-hard imagefs.available<15% --feature-gates=CSINodeInfo=true,CSIDriverRegistry=true,CSIBlockVolume=true,ExpandCSIVolumes=true"}
+            node_role=self._eks_node_role,
+            **self.node_image_opts(f"on_demand_n_g_1_{clust_name}", ng_labels, node_profile)
         )
 
-    def add_spot_ng(self, clust_name, desired_no=1):
+    def add_spot_ng(self, clust_name, desired_no=1, node_profile: str = None):
+        ng_labels = {"app": "miztiik_spot_ng",
+                     "lifecycle": "spot",
+                     "compute_provider": "ec2"
+                     }
         spot_n_g_1 = self.eks_cluster_1.add_nodegroup_capacity(
             f"spot_n_g_1_{clust_name}",
             nodegroup_name=f"spot_n_g_1_{clust_name}",
@@ -237,23 +287,113 @@ class EksClusterStack(cdk.Stack):
                 _ec2.InstanceType("t3.medium"),
                 _ec2.InstanceType("t3.large")
             ],
-            disk_size=20,
             min_size=1,
             max_size=6,
             desired_size=desired_no,
-            labels={"app": "miztiik_spot_ng",
-                    "lifecycle": "spot",
-                    "compute_provider": "ec2"
-                    },
+            labels=ng_labels,
             subnets=_ec2.SubnetSelection(
                 subnet_type=_ec2.SubnetType.PUBLIC),
-            ami_type=_eks.NodegroupAmiType.AL2_X86_64,
             capacity_type=_eks.CapacityType.SPOT,
-            node_role=self._eks_node_role
-            # bootstrap_options={"kubelet_extra_args": "--node-labels=node.kubernetes.io/lifecycle=spot,daemonset=active,app=general --eviction-hard imagefs.available<15% --feature-gates=CSINodeInfo=true,CSIDriverRegistry=true,CSIBlockVolume=true,ExpandCSIVolumes=true"}
+            node_role=self._eks_node_role,
+            **self.node_image_opts(f"spot_n_g_1_{clust_name}", ng_labels, node_profile, capacity_type="SPOT")
+        )
+
+    def add_graviton_ng(self, clust_name, desired_no=2, node_profile: str = None):
+        # ARM64(Graviton) nodes, `kubernetes.io/arch=arm64` is set by the kubelet.
+        # Tainted, only the pods pinned to arm64 & the multi-arch DaemonSets land here.
+        ng_labels = {"app": "miztiik_graviton_ng",
+                     "lifecycle": "on_demand",
+                     "compute_provider": "ec2"
+                     }
+        graviton_n_g_1 = self.eks_cluster_1.add_nodegroup_capacity(
+            f"graviton_n_g_1_{clust_name}",
+            nodegroup_name=f"graviton_n_g_1_{clust_name}",
+            instance_types=[
+                _ec2.InstanceType("m6g.xlarge"),
+            ],
+            min_size=0,
+            max_size=6,
+            desired_size=desired_no,
+            labels=ng_labels,
+            taints=[
+                _eks.TaintSpec(
+                    key=ARM64_NODE_TAINT["key"],
+                    value=ARM64_NODE_TAINT["value"],
+                    effect=_eks.TaintEffect.NO_SCHEDULE
+                )
+            ],
+            subnets=_ec2.SubnetSelection(
+                subnet_type=_ec2.SubnetType.PUBLIC),
+            capacity_type=_eks.CapacityType.ON_DEMAND,
+            node_role=self._eks_node_role,
+            # The profile launch template skips the EKS bootstrap, its kubelet registers the taint itself
+            **self.node_image_opts(f"graviton_n_g_1_{clust_name}", ng_labels, node_profile, arch="arm64", ng_taints=[ARM64_NODE_TAINT])
         )
 
-    def add_fargate_profile(self, clust_name, fargate_ns_name="fargate-ns-01", create_fargate_ns: bool = True):
+    def node_image_opts(self, ng_id, ng_labels, node_profile: str = None, arch: str = "amd64", ng_taints: list = None, capacity_type: str = "ON_DEMAND"):
+        """
+        Node group image settings. Without a profile, nodes use the EKS AMI with the default kubelet settings,
+        otherwise a launch template bootstraps them with the kubelet settings & sysctls of the profile.
+        `ng_id` is also the node group name.
+        """
+        if not node_profile:
+            return {
+                "disk_size": DEFAULT_ROOT_VOLUME_SIZE,
+                "ami_type": NODE_AMI_TYPES[arch]
+            }
+        return {
+            "launch_template_spec": self.add_node_launch_template(
+                ng_id, nodegroup_node_labels(ng_labels, ng_id, capacity_type), node_profile, arch, ng_taints)
+        }
+
+    def add_node_launch_template(self, ng_id, ng_labels, node_profile: str, arch: str = "amd64", ng_taints: list = None):
+        profile = get_node_profile(node_profile)
+
+        # With a custom image id in the launch template, EKS hands the bootstrap over to our user data
+        node_img = _eks.EksOptimizedImage(
+            kubernetes_version=KUBERNETES_VERSION.version,
+            node_type=_eks.NodeType.STANDARD,
+            cpu_arch=NODE_CPU_ARCHS[arch]
+        ).get_image(self)
+
+        user_data = node_user_data(
+            profile,
+            cluster_name=self.eks_cluster_1.cluster_name,
+            cluster_endpoint=self.eks_cluster_1.cluster_endpoint,
+            cluster_ca=self.eks_cluster_1.cluster_certificate_authority_data,
+            node_labels=ng_labels,
+            node_taints=ng_taints
+        )
+
+        node_lt = _ec2.CfnLaunchTemplate(
+            self,
+            f"{ng_id}_lt",
+            launch_template_data=_ec2.CfnLaunchTemplate.LaunchTemplateDataProperty(
+                image_id=node_img.image_id,
+                user_data=cdk.Fn.base64(user_data),
+                block_device_mappings=[
+                    _ec2.CfnLaunchTemplate.BlockDeviceMappingProperty(
+                        device_name="/dev/xvda",
+                        ebs=_ec2.CfnLaunchTemplate.EbsProperty(
+                            volume_size=profile["root_volume_size"],
+                            volume_type="gp3",
+                            delete_on_termination=True
+                        )
+                    )
+                ],
+                # IMDSv2 only
+                metadata_options=_ec2.CfnLaunchTemplate.MetadataOptionsProperty(
+                    http_tokens="required",
+                    http_put_response_hop_limit=2
+                )
+            )
+        )
+        return _eks.LaunchTemplateSpec(
+            id=node_lt.ref,
+            version=node_lt.attr_latest_version_number
+        )
+
+    def add_fargate_profile(self, clust_name, fargate_ns_name="fargate-ns-01", create_fargate_ns: bool = True, selector_labels: dict = None, profile_id: str = "fargate_profile_01"):
 
         if create_fargate_ns:
             _eks.KubernetesManifest(
@@ -273,22 +413,41 @@ class EksClusterStack(cdk.Stack):
             )
 
         # This code block will provision worker nodes with Fargate Profile configuration
+        if selector_labels is None:
+            selector_labels = {
+                "owner": "miztiik_automation",
+                "compute_provider": "fargate",
+                # "run_on_fargate": "true"
+            }
+
         fargate_profile_1 = self.eks_cluster_1.add_fargate_profile(
-            f"fargate_profile_01_{clust_name}",
+            f"{profile_id}_{clust_name}",
             # fargate_profile_name=f"fargate_profile_01_{clust_name}",
             # FARGATE PRFOFILES ARE IMMUTABLE, TO ALLOW FOR UPDATES,
             # LET US NOT SPECIFY A NAMD AND LET CFN DO ITS JOB
             selectors=[
                 _eks.Selector(
                     namespace=f"{fargate_ns_name}",
-                    labels={
-                        "owner": "miztiik_automation",
-                        "compute_provider": "fargate",
-                        # "run_on_fargate": "true"
-                    }
+                    labels=selector_labels
                 )
             ]
         )
+        return fargate_profile_1
+
+    def add_spark_driver_fargate_profile(self, clust_name, emr_ns_name):
+        # The namespace is owned by the EMR on EKS stack.
+        # Only driver pods using the fargate driver pod template match the selector,
+        # executors & other drivers keep running on the node groups.
+        return self.add_fargate_profile(
+            clust_name,
+            fargate_ns_name=emr_ns_name,
+            create_fargate_ns=False,
+            selector_labels={
+                **SPARK_DRIVER_ROLE_LABELS,
+                **FARGATE_DRIVER_LABELS
+            },
+            profile_id="spark_driver_fargate_profile"
+        )
 
     """
     # https://github.com/adamjkeller/cdk-eks-demo/blob/f9181a1362af9a28854fd1631f965884a9b04577/eks_cluster/alb_ingress.py
@@ -325,6 +484,57 @@ class EksClusterStack(cdk.Stack):
 
     """
 
+    def add_ebs_csi_driver(self, sa_name="ebs-csi-controller-sa", namespace="kube-system"):
+        # Ref: https://docs.aws.amazon.com/eks/latest/userguide/ebs-csi.html
+        ebs_csi_role = create_irsa_role(
+            self,
+            "ebsCsiDriverRole",
+            oidc_provider_arn=self.clust_oidc_provider_arn,
+            oidc_issuer=self.clust_oidc_issuer,
+            namespace=namespace,
+            sa_name=sa_name
+        )
+        ebs_csi_role.add_managed_policy(
+            _iam.ManagedPolicy.from_aws_managed_policy_name(
+                "service-role/AmazonEBSCSIDriverPolicy"
+            )
+        )
+        ebs_csi_sa = self.eks_cluster_1.add_manifest(
+            "ebsCsiControllerSa",
+            service_account_manifest(
+                sa_name, namespace, ebs_csi_role.role_arn)
+        )
+
+        ebs_csi_chart = self.eks_cluster_1.add_helm_chart(
+            "awsEbsCsiDriver",
+            chart="aws-ebs-csi-driver",
+            repository="https://kubernetes-sigs.github.io/aws-ebs-csi-driver",
+            version=EBS_CSI_CHART_VERSION,
+            release="aws-ebs-csi-driver",
+            namespace=namespace,
+            values={
+                "controller": {
+                    "serviceAccount": {
+                        "create": False,
+                        "name": sa_name
+                    }
+                }
+            }
+        )
+        ebs_csi_chart.node.add_dependency(ebs_csi_sa)
+        return ebs_csi_chart
+
+    def add_gp3_storage_classes(self, ebs_csi_chart, storage_classes: dict):
+        sc_manifest = self.eks_cluster_1.add_manifest(
+            "gp3StorageClasses",
+            *[
+                gp3_storage_class_manifest(
+                    name, iops=sc["iops"], throughput=sc["throughput"])
+                for name, sc in storage_classes.items()
+            ]
+        )
+        sc_manifest.node.add_dependency(ebs_csi_chart)
+
     def add_cluster_admin(self, name="eks-admin"):
         # Add admin privileges so we can sign in to the dashboard as the service account
         sa = self.eks_cluster_1.add_manifest(
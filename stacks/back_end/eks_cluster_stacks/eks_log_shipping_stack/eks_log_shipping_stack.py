@@ -0,0 +1,333 @@
+from aws_cdk import aws_eks as _eks
+from aws_cdk import aws_iam as _iam
+from aws_cdk import aws_logs as _logs
+from aws_cdk import core as cdk
+
+from stacks.miztiik_global_args import GlobalArgs
+from stacks.k8s_utils.irsa import create_irsa_role, service_account_manifest
+from stacks.back_end.eks_cluster_stacks.log_shipping_profiles import (
+    FARGATE_LOGGING_CONFIG_MAP,
+    FARGATE_LOGGING_NS,
+    FLUENT_BIT_NAME,
+    FLUENT_BIT_STATE_DIR,
+    LOG_SHIPPING_NS,
+    config_checksum,
+    fargate_logging_conf,
+    fluent_bit_conf,
+)
+
+
+class EksLogShippingStack(cdk.Stack):
+    def __init__(
+        self,
+        scope: cdk.Construct,
+        construct_id: str,
+        stack_log_level: str,
+        eks_cluster,
+        clust_oidc_provider_arn,
+        clust_oidc_issuer,
+        artifacts_bkt,
+        log_shipping_config: dict,
+        spark_namespaces: list,
+        logs_prefix: str,
+        sa_name: str = FLUENT_BIT_NAME,
+        fargate_pod_execution_role=None,
+        **kwargs
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        # Add your stack resources below):
+
+        ######################################
+        #######                        #######
+        #######   Spark Log Shipping   #######
+        #######                        #######
+        ######################################
+
+        # Ref: https://docs.fluentbit.io/manual/pipeline/outputs/s3
+        # Ref: https://docs.fluentbit.io/manual/administration/buffering-and-storage
+
+        if fargate_pod_execution_role and not log_shipping_config["cloudwatch"]:
+            raise ValueError(
+                "Spark drivers on Fargate log through the Fargate log router, it needs the log_shipping cloudwatch output")
+
+        log_ns = _eks.KubernetesManifest(
+            self,
+            "logShippingNs",
+            cluster=eks_cluster,
+            manifest=[
+                {
+                    "apiVersion": "v1",
+                    "kind": "Namespace",
+                    "metadata": {
+                        "name": LOG_SHIPPING_NS,
+                        "labels": {
+                            "name": LOG_SHIPPING_NS,
+                            "owner": "miztiik-automation"
+                        }
+                    }
+                }
+            ]
+        )
+
+        # Write only, under the logs prefix
+        fluent_bit_role = create_irsa_role(
+            self,
+            "fluentBitRole",
+            oidc_provider_arn=clust_oidc_provider_arn,
+            oidc_issuer=clust_oidc_issuer,
+            namespace=LOG_SHIPPING_NS,
+            sa_name=sa_name
+        )
+        if log_shipping_config["s3"]:
+            artifacts_bkt.grant_put(fluent_bit_role, f"{logs_prefix}*")
+
+        log_group_name = None
+        if log_shipping_config["cloudwatch"]:
+            # The retention is a number of days in the settings, the L2 construct wants an enum member
+            spark_log_group = _logs.CfnLogGroup(
+                self,
+                "sparkLogGroup",
+                log_group_name=f"/emr-on-eks/{construct_id}/spark",
+                retention_in_days=log_shipping_config["log_retention_days"]
+            )
+            spark_log_group.apply_removal_policy(cdk.RemovalPolicy.DESTROY)
+            log_group_name = spark_log_group.ref
+            fluent_bit_role.add_to_policy(
+                _iam.PolicyStatement(
+                    effect=_iam.Effect.ALLOW,
+                    actions=[
+                        "logs:CreateLogStream",
+                        "logs:DescribeLogStreams",
+                        "logs:PutLogEvents"
+                    ],
+                    # `arn:...:log-group:<name>:*`, the group & its streams
+                    resources=[spark_log_group.attr_arn]
+                )
+            )
+
+        if fargate_pod_execution_role:
+            # The Fargate log router writes with the pod execution role of the profile
+            _iam.Policy(
+                self,
+                "fargateLogRouterPolicy",
+                roles=[fargate_pod_execution_role],
+                statements=[
+                    _iam.PolicyStatement(
+                        effect=_iam.Effect.ALLOW,
+                        actions=[
+                            "logs:CreateLogStream",
+                            "logs:DescribeLogStreams",
+                            "logs:PutLogEvents"
+                        ],
+                        resources=[spark_log_group.attr_arn]
+                    )
+                ]
+            )
+            _eks.KubernetesManifest(
+                self,
+                "fargateLogRouterConfig",
+                cluster=eks_cluster,
+                manifest=[
+                    {
+                        "apiVersion": "v1",
+                        "kind": "Namespace",
+                        "metadata": {
+                            "name": FARGATE_LOGGING_NS,
+                            "labels": {
+                                "aws-observability": "enabled",
+                                "owner": "miztiik-automation"
+                            }
+                        }
+                    },
+                    {
+                        "apiVersion": "v1",
+                        "kind": "ConfigMap",
+                        "metadata": {"name": FARGATE_LOGGING_CONFIG_MAP, "namespace": FARGATE_LOGGING_NS},
+                        "data": fargate_logging_conf(
+                            log_shipping_config,
+                            spark_namespaces,
+                            region=self.region,
+                            log_group_name=log_group_name
+                        )
+                    }
+                ]
+            )
+
+        fluent_bit_sa = _eks.KubernetesManifest(
+            self,
+            "fluentBitSa",
+            cluster=eks_cluster,
+            manifest=[
+                service_account_manifest(
+                    sa_name, LOG_SHIPPING_NS, fluent_bit_role.role_arn),
+                # Pod metadata comes from the kubelet of the node, `nodes/proxy` allows that
+                {
+                    "apiVersion": "rbac.authorization.k8s.io/v1",
+                    "kind": "ClusterRole",
+                    "metadata": {"name": FLUENT_BIT_NAME},
+                    "rules": [
+                        {
+                            "apiGroups": [""],
+                            "resources": ["namespaces", "pods", "nodes", "nodes/proxy"],
+                            "verbs": ["get", "list", "watch"]
+                        }
+                    ]
+                },
+                {
+                    "apiVersion": "rbac.authorization.k8s.io/v1",
+                    "kind": "ClusterRoleBinding",
+                    "metadata": {"name": FLUENT_BIT_NAME},
+                    "roleRef": {
+                        "apiGroup": "rbac.authorization.k8s.io",
+                        "kind": "ClusterRole",
+                        "name": FLUENT_BIT_NAME
+                    },
+                    "subjects": [
+                        {
+                            "kind": "ServiceAccount",
+                            "name": sa_name,
+                            "namespace": LOG_SHIPPING_NS
+                        }
+                    ]
+                }
+            ]
+        )
+        fluent_bit_sa.node.add_dependency(log_ns)
+
+        fluent_bit_label = {"k8s-app": FLUENT_BIT_NAME}
+        fluent_bit_agent = _eks.KubernetesManifest(
+            self,
+            "fluentBitAgent",
+            cluster=eks_cluster,
+            manifest=[
+                {
+                    "apiVersion": "v1",
+                    "kind": "ConfigMap",
+                    "metadata": {"name": f"{FLUENT_BIT_NAME}-config", "namespace": LOG_SHIPPING_NS},
+                    "data": {
+                        "fluent-bit.conf": fluent_bit_conf(
+                            log_shipping_config,
+                            spark_namespaces,
+                            region=self.region,
+                            bucket_name=artifacts_bkt.bucket_name,
+                            s3_prefix=logs_prefix,
+                            log_group_name=log_group_name
+                        )
+                    }
+                },
+                {
+                    "apiVersion": "apps/v1",
+                    "kind": "DaemonSet",
+                    "metadata": {"name": FLUENT_BIT_NAME, "namespace": LOG_SHIPPING_NS},
+                    "spec": {
+                        "selector": {"matchLabels": fluent_bit_label},
+                        "updateStrategy": {"type": "RollingUpdate"},
+                        "template": {
+                            "metadata": {
+                                "labels": fluent_bit_label,
+                                "annotations": {
+                                    "checksum/config": config_checksum(
+                                        log_shipping_config, spark_namespaces)
+                                }
+                            },
+                            "spec": {
+                                "serviceAccountName": sa_name,
+                                # The kubelet is reached on the node address
+                                "hostNetwork": True,
+                                "dnsPolicy": "ClusterFirstWithHostNet",
+                                # Let the last batches out when the node drains
+                                "terminationGracePeriodSeconds": 30,
+                                # DaemonSets do not run on Fargate, the `aws-logging` ConfigMap above covers the drivers there
+                                "affinity": {
+                                    "nodeAffinity": {
+                                        "requiredDuringSchedulingIgnoredDuringExecution": {
+                                            "nodeSelectorTerms": [
+                                                {
+                                                    "matchExpressions": [
+                                                        {
+                                                            "key": "eks.amazonaws.com/compute-type",
+                                                            "operator": "NotIn",
+                                                            "values": ["fargate"]
+                                                        }
+                                                    ]
+                                                }
+                                            ]
+                                        }
+                                    }
+                                },
+                                "tolerations": [{"operator": "Exists", "effect": "NoSchedule"}],
+                                "containers": [
+                                    {
+                                        "name": FLUENT_BIT_NAME,
+                                        "image": log_shipping_config["image"],
+                                        "env": [
+                                            {
+                                                "name": "NODE_IP",
+                                                "valueFrom": {"fieldRef": {"fieldPath": "status.hostIP"}}
+                                            }
+                                        ],
+                                        "resources": {
+                                            "requests": {
+                                                "cpu": log_shipping_config["cpu_request"],
+                                                "memory": log_shipping_config["memory_request"]
+                                            },
+                                            "limits": {
+                                                "cpu": log_shipping_config["cpu_limit"],
+                                                "memory": log_shipping_config["memory_limit"]
+                                            }
+                                        },
+                                        "ports": [{"name": "metrics", "containerPort": 2020}],
+                                        "livenessProbe": {
+                                            "httpGet": {"path": "/", "port": 2020}
+                                        },
+                                        "volumeMounts": [
+                                            {"name": "config", "mountPath": "/fluent-bit/etc/"},
+                                            {"name": "varlog", "mountPath": "/var/log", "readOnly": True},
+                                            {"name": "state", "mountPath": FLUENT_BIT_STATE_DIR}
+                                        ]
+                                    }
+                                ],
+                                "volumes": [
+                                    {"name": "config", "configMap": {"name": f"{FLUENT_BIT_NAME}-config"}},
+                                    # /var/log/containers links into /var/log/pods
+                                    {"name": "varlog", "hostPath": {"path": "/var/log"}},
+                                    # Buffered chunks & tail offsets survive an agent restart
+                                    {
+                                        "name": "state",
+                                        "hostPath": {"path": FLUENT_BIT_STATE_DIR, "type": "DirectoryOrCreate"}
+                                    }
+                                ]
+                            }
+                        }
+                    }
+                }
+            ]
+        )
+        fluent_bit_agent.node.add_dependency(fluent_bit_sa)
+
+        ###########################################
+        ################# OUTPUTS #################
+        ###########################################
+        output_0 = cdk.CfnOutput(
+            self,
+            "AutomationFrom",
+            value=f"{GlobalArgs.SOURCE_INFO}",
+            description="To know more about this automation stack, check out our github page."
+        )
+
+        if log_shipping_config["s3"]:
+            output_1 = cdk.CfnOutput(
+                self,
+                "SparkLogsS3Uri",
+                value=f"s3://{artifacts_bkt.bucket_name}/{logs_prefix}",
+                description="Gzip compressed driver & executor logs, <yyyy>/<mm>/<dd>/<pod>_<namespace>_<container>-<id>/"
+            )
+
+        if log_group_name:
+            output_2 = cdk.CfnOutput(
+                self,
+                "SparkLogGroup",
+                value=log_group_name,
+                description="CloudWatch log group of the driver & executor logs, one stream per container"
+            )
@@ -0,0 +1,165 @@
+from aws_cdk import aws_eks as _eks
+from aws_cdk import aws_events as _events
+from aws_cdk import aws_events_targets as _events_targets
+from aws_cdk import aws_iam as _iam
+from aws_cdk import aws_sqs as _sqs
+from aws_cdk import core as cdk
+
+from stacks.miztiik_global_args import GlobalArgs
+from stacks.k8s_utils.irsa import create_irsa_role, service_account_manifest
+
+
+# aws-node-termination-handler chart release(NTH v1.14.0), queue processor mode on Kubernetes 1.20.
+# The value names below(Ex: `checkASGTagBeforeDraining`) change in later releases.
+NTH_CHART_VERSION = "0.16.0"
+
+# EC2 events that mean a node is about to go away
+# Ref: https://github.com/aws/aws-node-termination-handler#queue-processor
+NODE_INTERRUPTION_EVENT_PATTERNS = {
+    "SpotInterruption": _events.EventPattern(
+        source=["aws.ec2"],
+        detail_type=["EC2 Spot Instance Interruption Warning"]
+    ),
+    "RebalanceRecommendation": _events.EventPattern(
+        source=["aws.ec2"],
+        detail_type=["EC2 Instance Rebalance Recommendation"]
+    ),
+    "InstanceStateChange": _events.EventPattern(
+        source=["aws.ec2"],
+        detail_type=["EC2 Instance State-change Notification"]
+    ),
+    "ScheduledChange": _events.EventPattern(
+        source=["aws.health"],
+        detail_type=["AWS Health Event"],
+        detail={"service": ["EC2"], "eventTypeCategory": ["scheduledChange"]}
+    ),
+}
+
+
+class EksNodeTerminationHandlerStack(cdk.Stack):
+    def __init__(
+        self,
+        scope: cdk.Construct,
+        construct_id: str,
+        stack_log_level: str,
+        eks_cluster,
+        clust_oidc_provider_arn,
+        clust_oidc_issuer,
+        namespace: str = "kube-system",
+        sa_name: str = "aws-node-termination-handler",
+        **kwargs
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        # Add your stack resources below):
+
+        ##############################################
+        #######                              #######
+        #######   Node Termination Handler   #######
+        #######                              #######
+        ##############################################
+
+        # Queue processor mode: EventBridge forwards the interruption notices to SQS and a single
+        # handler deployment cordons & drains the node. The drain sends SIGTERM to the executors,
+        # which with Spark decommissioning enabled migrate their shuffle & RDD blocks to the
+        # surviving executors within the two minute spot notice.
+        # Ref: https://github.com/aws/aws-node-termination-handler
+
+        nth_queue = _sqs.Queue(
+            self,
+            "nodeTerminationHandlerQueue",
+            # Stale notices are useless, the node is gone by then
+            # No KMS managed key, EventBridge can not send to queues encrypted with aws/sqs
+            retention_period=cdk.Duration.minutes(5)
+        )
+        nth_queue.add_to_resource_policy(
+            _iam.PolicyStatement(
+                principals=[
+                    _iam.ServicePrincipal("events.amazonaws.com"),
+                    _iam.ServicePrincipal("sqs.amazonaws.com")
+                ],
+                actions=["sqs:SendMessage"],
+                resources=[nth_queue.queue_arn]
+            )
+        )
+
+        for rule_name, event_pattern in NODE_INTERRUPTION_EVENT_PATTERNS.items():
+            _events.Rule(
+                self,
+                f"nth{rule_name}Rule",
+                event_pattern=event_pattern,
+                targets=[_events_targets.SqsQueue(nth_queue)]
+            )
+
+        nth_role = create_irsa_role(
+            self,
+            "nodeTerminationHandlerRole",
+            oidc_provider_arn=clust_oidc_provider_arn,
+            oidc_issuer=clust_oidc_issuer,
+            namespace=namespace,
+            sa_name=sa_name
+        )
+        nth_queue.grant_consume_messages(nth_role)
+        nth_role.add_to_policy(
+            _iam.PolicyStatement(
+                actions=[
+                    "autoscaling:CompleteLifecycleAction",
+                    "autoscaling:DescribeAutoScalingInstances",
+                    "autoscaling:DescribeTags",
+                    "ec2:DescribeInstances"
+                ],
+                resources=["*"]
+            )
+        )
+
+        # Scoped to this stack, `eks_cluster.add_manifest` would put them in the cluster stack
+        nth_sa = _eks.KubernetesManifest(
+            self,
+            "nodeTerminationHandlerSa",
+            cluster=eks_cluster,
+            manifest=[
+                service_account_manifest(sa_name, namespace, nth_role.role_arn)
+            ]
+        )
+
+        nth_chart = _eks.HelmChart(
+            self,
+            "awsNodeTerminationHandler",
+            cluster=eks_cluster,
+            chart="aws-node-termination-handler",
+            repository="https://aws.github.io/eks-charts",
+            version=NTH_CHART_VERSION,
+            release="aws-node-termination-handler",
+            namespace=namespace,
+            values={
+                "enableSqsTerminationDraining": True,
+                "queueURL": nth_queue.queue_url,
+                "awsRegion": self.region,
+                # Managed node group ASGs do not carry the NTH tag, handle every node of the cluster
+                "checkASGTagBeforeDraining": False,
+                # -1 keeps the pod's own grace period, the executors need it to migrate their blocks
+                "podTerminationGracePeriod": -1,
+                "serviceAccount": {
+                    "create": False,
+                    "name": sa_name
+                }
+            }
+        )
+        nth_chart.node.add_dependency(nth_sa)
+
+        ###########################################
+        ################# OUTPUTS #################
+        ###########################################
+        output_0 = cdk.CfnOutput(
+            self,
+            "AutomationFrom",
+            value=f"{GlobalArgs.SOURCE_INFO}",
+            description="To know more about this automation stack, check out our github page."
+        )
+
+        output_1 = cdk.CfnOutput(
+            self,
+            "NodeTerminationHandlerQueueUrl",
+            value=f"{nth_queue.queue_url}",
+            description="Queue with the node interruption notices"
+        )
@@ -2,6 +2,7 @@ from aws_cdk import aws_eks as _eks
 from aws_cdk import core as cdk
 
 from stacks.miztiik_global_args import GlobalArgs
+from stacks.k8s_utils.pod_templates import arch_tolerations
 
 
 class EksSsmDaemonSetStack(cdk.Stack):
@@ -42,11 +43,13 @@ class EksSsmDaemonSetStack(cdk.Stack):
                         "containers": [
                             {
                                 "name": f"{app_grp_name}",
-                                "image": "amazonlinux",
+                                # Multi-arch image, runs on x86_64 & Graviton nodes
+                                "image": "public.ecr.aws/amazonlinux/amazonlinux:2",
                                 "command": ["/bin/bash"],
                                 "args": [
                                     "-c",
-                                    "echo '* * * * * root yum install -y https://s3.amazonaws.com/ec2-downloads-windows/SSMAgent/latest/linux_amd64/amazon-ssm-agent.rpm & cat >>/var/log/miztiik.log <<< `date`:ssm_installation_success;rm -rf /etc/cron.d/ssmstart' > /etc/cron.d/ssmstart && /bin/sleep 60m"
+                                    # The SSM Agent rpm is per cpu architecture, the container runs on the node arch
+                                    "SSM_ARCH=$(uname -m | sed -e 's/x86_64/amd64/' -e 's/aarch64/arm64/') && echo \"* * * * * root yum install -y https://s3.amazonaws.com/ec2-downloads-windows/SSMAgent/latest/linux_${SSM_ARCH}/amazon-ssm-agent.rpm & cat >>/var/log/miztiik.log <<< \\`date\\`:ssm_installation_success;rm -rf /etc/cron.d/ssmstart\" > /etc/cron.d/ssmstart && /bin/sleep 60m"
                                 ],
                                 "env":
                                 [
@@ -69,6 +72,27 @@ class EksSsmDaemonSetStack(cdk.Stack):
                                 "terminationMessagePolicy": "File"
                             }
                         ],
+                        # Runs on the tainted Graviton nodes as well
+                        "tolerations": arch_tolerations("arm64"),
+                        "affinity": {
+                            "nodeAffinity": {
+                                "requiredDuringSchedulingIgnoredDuringExecution": {
+                                    "nodeSelectorTerms": [
+                                        {
+                                            "matchExpressions": [
+                                                {"key": "kubernetes.io/os", "operator": "In",
+                                                    "values": ["linux"]},
+                                                {"key": "kubernetes.io/arch", "operator": "In",
+                                                    "values": ["amd64", "arm64"]},
+                                                # Fargate pods can not mount host paths
+                                                {"key": "eks.amazonaws.com/compute-type", "operator": "NotIn",
+                                                    "values": ["fargate"]}
+                                            ]
+                                        }
+                                    ]
+                                }
+                            }
+                        },
                         "volumes": [
                             {
                                 "name": "cronfile",
@@ -0,0 +1,272 @@
+"""
+Spark log shipping settings.
+
+A Fluent Bit agent per EC2 node tails the stdout/stderr of the driver & executor containers
+of the EMR namespaces. Records are buffered on the node disk and flushed in batches, gzip
+compressed objects to the artifacts bucket & batched `PutLogEvents` calls to CloudWatch.
+The executor logs outlive the pods, which are gone once the job ends.
+
+DaemonSets do not run on Fargate. Drivers there log through the Fargate log router,
+configured by the `aws-logging` ConfigMap of the `aws-observability` namespace. It has
+no S3 output, their logs go to the CloudWatch log group only.
+"""
+
+import hashlib
+import json
+
+from stacks.back_end.eks_cluster_stacks.node_profiles import DEFAULT_ROOT_VOLUME_SIZE
+from stacks.k8s_utils.kube_api import parse_memory
+from stacks.k8s_utils.pod_templates import SPARK_DRIVER_CONTAINER, SPARK_EXECUTOR_CONTAINER
+
+
+LOG_SHIPPING_NS = "logging"
+FLUENT_BIT_NAME = "fluent-bit"
+
+# Ref: https://docs.aws.amazon.com/eks/latest/userguide/fargate-logging.html
+FARGATE_LOGGING_NS = "aws-observability"
+FARGATE_LOGGING_CONFIG_MAP = "aws-logging"
+
+# Fluent Bit buffers the records in chunks of ~2MB
+FLUENT_BIT_CHUNK_SIZE = 2 * 2 ** 20
+
+# Host directory of the filesystem buffer, the S3 staging files & the tail offsets
+FLUENT_BIT_STATE_DIR = "/var/fluent-bit/state"
+
+# The buffers share the node root volume with the images, the container logs & the executor scratch space
+MAX_ROOT_VOLUME_LOG_BUFFER_SHARE = 0.1
+
+# Values accepted by CloudWatch Logs for the retention of a log group
+LOG_RETENTION_DAYS = (1, 3, 5, 7, 14, 30, 60, 90, 120, 150, 180, 365, 400, 545, 731, 1827, 3653)
+
+# Override any of these with a dict in the `log_shipping` context
+DEFAULT_LOG_SHIPPING = {
+    "image": "public.ecr.aws/aws-observability/aws-for-fluent-bit:2.31.12",
+    "s3": True,
+    "cloudwatch": True,
+    # Containers of the Spark pods to ship
+    "containers": [SPARK_DRIVER_CONTAINER, SPARK_EXECUTOR_CONTAINER],
+    # Seconds between two flushes, every flush is one batched PutLogEvents call per log stream
+    "flush_interval": 5,
+    # A S3 object is uploaded once it reaches the size or the timeout, whichever comes first
+    "s3_total_file_size": "50M",
+    "s3_upload_timeout": "5m",
+    "log_retention_days": 14,
+    # Chunks held in memory, the rest waits in the filesystem buffer instead of growing the agent
+    "max_chunks_up": 32,
+    "backlog_mem_limit": "16M",
+    # Node disk used by the agent, split between the S3 staging files & the chunk queue of each
+    # output. The oldest chunks are dropped once an output is over its share.
+    "disk_budget": "2Gi",
+    # Requests & limits of the agent, it shares the node with the executors
+    "cpu_request": "100m",
+    "cpu_limit": "500m",
+    "memory_request": "128Mi",
+    "memory_limit": "256Mi",
+}
+
+
+def disk_buffer_limits(cfg):
+    """
+    `disk_budget` split evenly between the disk buffers of the enabled outputs, in bytes.
+    The S3 output has two, the upload staging files & its chunk queue.
+    """
+    buffers = []
+    if cfg["s3"]:
+        buffers += ["s3_store_dir", "s3_chunks"]
+    if cfg["cloudwatch"]:
+        buffers += ["cloudwatch_chunks"]
+    share = int(parse_memory(cfg["disk_budget"]) / len(buffers))
+    return {b: share for b in buffers}
+
+
+def _size(n_bytes):
+    return f"{n_bytes // 2 ** 20}M"
+
+
+def log_shipping_config(ctx_value, node_root_volume_size=DEFAULT_ROOT_VOLUME_SIZE):
+    """
+    Log shipping settings from the `log_shipping` context, `None` when it is disabled.
+    `true` deploys it with the defaults, a dict overrides them. The `disk_budget` has
+    to fit its share of the `node_root_volume_size`(GiB) root volume.
+    """
+    if not ctx_value or str(ctx_value).lower() in ("false", "0", "no"):
+        return None
+    cfg = dict(DEFAULT_LOG_SHIPPING)
+    if isinstance(ctx_value, dict):
+        unknown = set(ctx_value) - set(DEFAULT_LOG_SHIPPING)
+        if unknown:
+            raise ValueError(
+                f"Unknown log_shipping settings: {sorted(unknown)}")
+        cfg.update(ctx_value)
+    if not (cfg["s3"] or cfg["cloudwatch"]):
+        raise ValueError("log_shipping needs at least one of the s3 & cloudwatch outputs")
+    if not cfg["containers"]:
+        raise ValueError("log_shipping needs at least one container to ship")
+    if int(cfg["flush_interval"]) < 1:
+        raise ValueError("log_shipping flush_interval is in seconds, at least 1")
+    if cfg["cloudwatch"] and cfg["log_retention_days"] not in LOG_RETENTION_DAYS:
+        raise ValueError(
+            f"Unsupported log_retention_days {cfg['log_retention_days']}, choose one of {list(LOG_RETENTION_DAYS)}")
+    max_disk_budget = node_root_volume_size * 2 ** 30 * MAX_ROOT_VOLUME_LOG_BUFFER_SHARE
+    if parse_memory(cfg["disk_budget"]) > max_disk_budget:
+        raise ValueError(
+            f"disk_budget {cfg['disk_budget']} is more than {MAX_ROOT_VOLUME_LOG_BUFFER_SHARE:.0%} of the "
+            f"{node_root_volume_size}GiB node root volume, lower it")
+    limits = disk_buffer_limits(cfg)
+    if min(limits.values()) < FLUENT_BIT_CHUNK_SIZE:
+        raise ValueError(f"disk_budget {cfg['disk_budget']} leaves less than a chunk per output buffer")
+    if cfg["s3"] and limits["s3_store_dir"] < parse_memory(cfg["s3_total_file_size"]):
+        raise ValueError(
+            f"The {_size(limits['s3_store_dir'])} S3 staging share of disk_budget can not hold "
+            f"a {cfg['s3_total_file_size']} s3_total_file_size object")
+    # Leave half of the limit for the plugins, the tail offsets db & the HTTP client buffers
+    buffered = cfg["max_chunks_up"] * FLUENT_BIT_CHUNK_SIZE + parse_memory(cfg["backlog_mem_limit"])
+    if buffered > parse_memory(cfg["memory_limit"]) / 2:
+        raise ValueError(
+            f"max_chunks_up & backlog_mem_limit buffer ~{int(buffered / 2 ** 20)}Mi, "
+            f"more than half of the {cfg['memory_limit']} memory_limit")
+    return cfg
+
+
+def _section(name, settings):
+    lines = [f"[{name}]"]
+    lines += [f"    {k:<28} {v}" for k, v in settings]
+    return "\n".join(lines)
+
+
+def container_log_paths(cfg, namespaces):
+    """
+    Kubelet log files of the shipped containers, `<pod>_<namespace>_<container>-<id>.log`
+    """
+    return [
+        f"/var/log/containers/*_{ns}_{container}-*.log"
+        for ns in namespaces for container in cfg["containers"]
+    ]
+
+
+def fluent_bit_conf(cfg, namespaces, region, bucket_name=None, s3_prefix="", log_group_name=None):
+    """
+    `fluent-bit.conf` tailing the Spark containers of `namespaces`. The objects land under
+    `<s3_prefix><yyyy>/<mm>/<dd>/<pod>_<namespace>_<container>-<id>/`, one log stream per container.
+    """
+    disk_limits = disk_buffer_limits(cfg)
+    sections = [
+        _section("SERVICE", [
+            ("Flush", cfg["flush_interval"]),
+            ("Grace", 30),
+            ("Log_Level", "info"),
+            ("Daemon", "off"),
+            ("HTTP_Server", "On"),
+            ("HTTP_Listen", "0.0.0.0"),
+            ("HTTP_Port", 2020),
+            ("storage.path", f"{FLUENT_BIT_STATE_DIR}/flb-storage/"),
+            ("storage.sync", "normal"),
+            ("storage.max_chunks_up", cfg["max_chunks_up"]),
+            ("storage.backlog.mem_limit", cfg["backlog_mem_limit"]),
+        ]),
+        # With the filesystem buffer Mem_Buf_Limit does not apply, storage.max_chunks_up bounds the memory
+        _section("INPUT", [
+            ("Name", "tail"),
+            ("Tag", "kube.*"),
+            ("Path", ",".join(container_log_paths(cfg, namespaces))),
+            ("multiline.parser", "docker, cri"),
+            ("DB", f"{FLUENT_BIT_STATE_DIR}/flb_spark.db"),
+            ("storage.type", "filesystem"),
+            ("Skip_Long_Lines", "On"),
+            ("Refresh_Interval", 10),
+            # Executors are short lived, keep reading the rotated files until they are shipped
+            ("Rotate_Wait", 30),
+        ]),
+        # Pod metadata from the local kubelet, no watch on the API server per node
+        _section("FILTER", [
+            ("Name", "kubernetes"),
+            ("Match", "kube.*"),
+            ("Kube_Tag_Prefix", "kube.var.log.containers."),
+            ("Use_Kubelet", "On"),
+            # Node address from the downward api, the kubelet serving certificate is issued for it
+            ("Kubelet_Host", "${NODE_IP}"),
+            ("Kubelet_Port", 10250),
+            ("Buffer_Size", 0),
+            ("Labels", "On"),
+            ("Annotations", "Off"),
+            ("Merge_Log", "Off"),
+        ]),
+    ]
+    if cfg["s3"]:
+        sections.append(_section("OUTPUT", [
+            ("Name", "s3"),
+            ("Match", "kube.*"),
+            ("bucket", bucket_name),
+            ("region", region),
+            ("total_file_size", cfg["s3_total_file_size"]),
+            ("upload_timeout", cfg["s3_upload_timeout"]),
+            ("use_put_object", "On"),
+            ("compression", "gzip"),
+            ("s3_key_format", f"/{s3_prefix}%Y/%m/%d/$TAG[4]/%H%M%S-$UUID.gz"),
+            ("store_dir", f"{FLUENT_BIT_STATE_DIR}/s3"),
+            ("store_dir_limit_size", _size(disk_limits["s3_store_dir"])),
+            ("storage.total_limit_size", _size(disk_limits["s3_chunks"])),
+            ("Retry_Limit", 5),
+        ]))
+    if cfg["cloudwatch"]:
+        sections.append(_section("OUTPUT", [
+            ("Name", "cloudwatch_logs"),
+            ("Match", "kube.*"),
+            ("region", region),
+            ("log_group_name", log_group_name),
+            ("log_stream_prefix", "spark."),
+            # The stack owns the group & its retention
+            ("auto_create_group", "Off"),
+            ("storage.total_limit_size", _size(disk_limits["cloudwatch_chunks"])),
+            ("Retry_Limit", 5),
+        ]))
+    return "\n\n".join(sections) + "\n"
+
+
+def fargate_logging_conf(cfg, namespaces, region, log_group_name):
+    """
+    `aws-logging` ConfigMap data of the Fargate log router, the Spark containers of
+    `namespaces` to the CloudWatch log group, under their own `spark.fargate.` streams.
+    """
+    container_names = "|".join(cfg["containers"])
+    namespace_names = "|".join(namespaces)
+    return {
+        # The router's own logs stay out of the group
+        "flb_log_cw": "false",
+        "filters.conf": "\n\n".join([
+            _section("FILTER", [
+                ("Name", "kubernetes"),
+                ("Match", "kube.*"),
+                ("Merge_Log", "Off"),
+                ("Labels", "On"),
+                ("Annotations", "Off"),
+            ]),
+            _section("FILTER", [
+                ("Name", "grep"),
+                ("Match", "kube.*"),
+                ("Regex", f"$kubernetes['namespace_name'] ^({namespace_names})$"),
+            ]),
+            _section("FILTER", [
+                ("Name", "grep"),
+                ("Match", "kube.*"),
+                ("Regex", f"$kubernetes['container_name'] ^({container_names})$"),
+            ]),
+        ]) + "\n",
+        "output.conf": _section("OUTPUT", [
+            ("Name", "cloudwatch_logs"),
+            ("Match", "kube.*"),
+            ("region", region),
+            ("log_group_name", log_group_name),
+            ("log_stream_prefix", "spark.fargate."),
+            ("auto_create_group", "false"),
+        ]) + "\n",
+    }
+
+
+def config_checksum(cfg, namespaces):
+    """
+    Pod template annotation value, rolls the agents when the settings change. Hashes the
+    settings, the rendered config holds tokens(Ex: the bucket name) until deploy.
+    """
+    settings = json.dumps({"cfg": cfg, "namespaces": sorted(namespaces)}, sort_keys=True)
+    return hashlib.sha1(settings.encode("utf-8")).hexdigest()
@@ -0,0 +1,163 @@
+"""
+Node bootstrap profiles for the EKS node groups.
+
+A profile pins the kubelet reservations, eviction thresholds, cpu manager policy and
+kernel sysctls of the nodes. The node groups apply it through a launch template that
+runs the EKS AMI bootstrap with the matching `--kubelet-extra-args`.
+
+With a custom image in the launch template, EKS does not add its own bootstrap to the
+user data. The node group labels, the labels EKS sets on its nodes & the node group
+taints are passed to the kubelet here, otherwise the nodes join without them.
+"""
+
+
+# Root volume(GiB) of the node groups without a profile
+DEFAULT_ROOT_VOLUME_SIZE = 20
+
+# Labels EKS puts on the nodes of a managed node group
+EKS_NODEGROUP_LABEL = "eks.amazonaws.com/nodegroup"
+EKS_CAPACITY_TYPE_LABEL = "eks.amazonaws.com/capacityType"
+CAPACITY_TYPES = ("ON_DEMAND", "SPOT")
+
+# Sized for Spark executors, that use most of the node memory & open lots of shuffle connections
+SPARK_TUNED_PROFILE = {
+    # Keep room for the kubelet, container runtime & OS, so the executors are not starved/OOM killed
+    "kube_reserved": {"cpu": "250m", "memory": "1Gi", "ephemeral-storage": "1Gi"},
+    "system_reserved": {"cpu": "250m", "memory": "768Mi", "ephemeral-storage": "1Gi"},
+    # Soft thresholds give the executors a grace period to finish/decommission,
+    # hard thresholds only kick in when the node is about to fall over
+    "eviction_soft": {
+        "memory.available": "1Gi",
+        "nodefs.available": "15%",
+        "imagefs.available": "15%"
+    },
+    "eviction_soft_grace_period": {
+        "memory.available": "90s",
+        "nodefs.available": "2m",
+        "imagefs.available": "2m"
+    },
+    "eviction_hard": {
+        "memory.available": "300Mi",
+        "nodefs.available": "10%",
+        "imagefs.available": "10%",
+        "nodefs.inodesFree": "5%"
+    },
+    "eviction_max_pod_grace_period": 120,
+    # Pods with integer cpu requests in the Guaranteed QoS class get exclusive cores
+    "cpu_manager_policy": "static",
+    # High shuffle fan-out: many short lived connections & open files per executor
+    "sysctls": {
+        "net.core.somaxconn": 4096,
+        "net.core.netdev_max_backlog": 16384,
+        "net.ipv4.tcp_max_syn_backlog": 8192,
+        "net.ipv4.ip_local_port_range": "10240 65535",
+        "net.ipv4.tcp_tw_reuse": 1,
+        "net.ipv4.tcp_fin_timeout": 15,
+        "net.core.rmem_max": 16777216,
+        "net.core.wmem_max": 16777216,
+        "fs.file-max": 2097152,
+        "fs.inotify.max_user_watches": 524288,
+        "vm.max_map_count": 262144,
+    },
+    "root_volume_size": 20,
+}
+
+NODE_PROFILES = {
+    "spark_tuned": SPARK_TUNED_PROFILE,
+}
+
+
+def get_node_profile(profile_name):
+    try:
+        return NODE_PROFILES[profile_name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown node profile '{profile_name}', choose one of {sorted(NODE_PROFILES)}")
+
+
+def root_volume_size(profile_name=None):
+    """
+    Root volume(GiB) of the nodes, it holds the images, the container logs & the pods' scratch space
+    """
+    if not profile_name:
+        return DEFAULT_ROOT_VOLUME_SIZE
+    return get_node_profile(profile_name)["root_volume_size"]
+
+
+def _kv_list(d, sep="="):
+    return ",".join(f"{k}{sep}{v}" for k, v in d.items())
+
+
+def nodegroup_node_labels(ng_labels, nodegroup_name, capacity_type):
+    """
+    The node group labels, plus the ones EKS sets on the nodes it bootstraps itself
+    """
+    if capacity_type not in CAPACITY_TYPES:
+        raise ValueError(
+            f"Unknown capacity type '{capacity_type}', choose one of {list(CAPACITY_TYPES)}")
+    return {
+        **ng_labels,
+        EKS_NODEGROUP_LABEL: nodegroup_name,
+        EKS_CAPACITY_TYPE_LABEL: capacity_type,
+    }
+
+
+def kubelet_extra_args(profile, node_labels=None, node_taints=None):
+    args = []
+    if node_labels:
+        args.append(f"--node-labels={_kv_list(node_labels)}")
+    if node_taints:
+        args.append(
+            "--register-with-taints=" + ",".join(f"{t['key']}={t['value']}:{t['effect']}" for t in node_taints))
+    if profile.get("kube_reserved"):
+        args.append(f"--kube-reserved={_kv_list(profile['kube_reserved'])}")
+    if profile.get("system_reserved"):
+        args.append(
+            f"--system-reserved={_kv_list(profile['system_reserved'])}")
+    if profile.get("eviction_hard"):
+        args.append(
+            f"--eviction-hard={_kv_list(profile['eviction_hard'], sep='<')}")
+    if profile.get("eviction_soft"):
+        args.append(
+            f"--eviction-soft={_kv_list(profile['eviction_soft'], sep='<')}")
+    if profile.get("eviction_soft_grace_period"):
+        args.append(
+            f"--eviction-soft-grace-period={_kv_list(profile['eviction_soft_grace_period'])}")
+    if profile.get("eviction_max_pod_grace_period"):
+        args.append(
+            f"--eviction-max-pod-grace-period={profile['eviction_max_pod_grace_period']}")
+    if profile.get("cpu_manager_policy"):
+        args.append(f"--cpu-manager-policy={profile['cpu_manager_policy']}")
+    return " ".join(args)
+
+
+def sysctl_conf(profile):
+    return "\n".join(f"{k} = {v}" for k, v in profile.get("sysctls", {}).items())
+
+
+def node_user_data(profile, cluster_name, cluster_endpoint, cluster_ca, node_labels=None, node_taints=None):
+    """
+    MIME multi-part user data, applies the sysctls & bootstraps the node with the kubelet settings of the profile.
+    `node_taints` are `{"key", "value", "effect"}` dicts, Ex: `pod_templates.ARM64_NODE_TAINT`.
+    """
+    return f"""MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="==MIZTIIK_BOUNDARY=="
+
+--==MIZTIIK_BOUNDARY==
+Content-Type: text/x-shellscript; charset="us-ascii"
+
+#!/bin/bash
+set -ex
+
+cat > /etc/sysctl.d/99-miztiik-spark.conf <<'EOF'
+{sysctl_conf(profile)}
+EOF
+sysctl --system
+
+/etc/eks/bootstrap.sh {cluster_name} \\
+  --b64-cluster-ca {cluster_ca} \\
+  --apiserver-endpoint {cluster_endpoint} \\
+  --kubelet-extra-args '{kubelet_extra_args(profile, node_labels, node_taints)}'
+
+--==MIZTIIK_BOUNDARY==--
+"""
@@ -0,0 +1,38 @@
+"""
+gp3 StorageClasses installed with the EBS CSI driver.
+
+gp3 decouples IOPS & throughput from the volume size, unlike gp2 whose baseline
+is 3 IOPS/GiB. Executors spilling to EBS get the provisioned performance right away.
+"""
+
+
+# aws-ebs-csi-driver chart release(driver v1.5.0), the later driver releases drop Kubernetes 1.20
+EBS_CSI_CHART_VERSION = "2.6.2"
+
+# Executor shuffle/spill scratch volumes on instances without local NVMe
+SPILL_STORAGE_CLASS = "gp3-spill"
+
+GP3_STORAGE_CLASSES = {
+    "gp3": {"iops": 3000, "throughput": 125},
+    SPILL_STORAGE_CLASS: {"iops": 6000, "throughput": 500},
+}
+
+
+def gp3_storage_class_manifest(name, iops, throughput, fs_type="ext4"):
+    return {
+        "apiVersion": "storage.k8s.io/v1",
+        "kind": "StorageClass",
+        "metadata": {"name": name},
+        "provisioner": "ebs.csi.aws.com",
+        # Create the volume in the AZ the pod lands in
+        "volumeBindingMode": "WaitForFirstConsumer",
+        "reclaimPolicy": "Delete",
+        "allowVolumeExpansion": True,
+        "parameters": {
+            "type": "gp3",
+            "iops": str(iops),
+            "throughput": str(throughput),
+            "encrypted": "true",
+            "csi.storage.k8s.io/fstype": fs_type
+        }
+    }
@@ -0,0 +1,241 @@
+"""
+Versioned EMR release & Spark configuration profiles for the job templates.
+
+A profile pins the EMR release label & the `applicationConfiguration` classifications
+(spark-defaults with the AQE & S3A connector tuning, spark-hive-site, emrfs-site) that
+EmrOnEksStack writes into every job template of the virtual cluster.
+
+Profiles are selected with the `emr_config_profile` context as `<name>@<version>`, or just
+`<name>` for its latest version, Ex: `cdk synth -c emr_config_profile=spark3@3`.
+A published version is never edited, a change goes into a new version. Rolling it out to
+all the tenants is then the one line `emr_config_profile` change in `cdk.json`, & rolling
+back is the same line pointing to the previous version.
+"""
+
+import re
+
+
+CONFIG_PROFILE_CONTEXT_KEY = "emr_config_profile"
+DEFAULT_CONFIG_PROFILE = "spark3"
+
+SUPPORTED_CLASSIFICATIONS = ("spark-defaults", "spark-hive-site", "emrfs-site")
+
+# Set by EmrOnEksStack on every job template, a profile must not set them
+RESERVED_SPARK_CONFS = (
+    "spark.kubernetes.driver.podTemplateFile",
+    "spark.kubernetes.executor.podTemplateFile",
+)
+
+# Oldest release supporting a feature of the job templates
+MIN_RELEASES = {
+    "pod_templates": "emr-6.3.0",
+    "executor_decommission": "emr-6.3.0",
+    "executor_spill_pvc": "emr-6.3.0",
+    "arm64": "emr-6.6.0",
+}
+
+_RELEASE_LABEL_RE = re.compile(r"^emr-(\d+)\.(\d+)\.(\d+)(-latest|-\d{8})?$")
+_SIZE_RE = re.compile(r"^\d+[KMGT]?$")
+
+
+# Spark 3.1 ships with AQE off, coalesce the shuffle partitions & split skewed joins
+AQE_CONF = {
+    "spark.sql.adaptive.enabled": "true",
+    "spark.sql.adaptive.coalescePartitions.enabled": "true",
+    "spark.sql.adaptive.skewJoin.enabled": "true",
+    "spark.sql.adaptive.advisoryPartitionSizeInBytes": "128m",
+}
+
+# `s3a://` paths. A connection pool sized for the upload & read-ahead threads of all the
+# executor cores, multipart uploads buffered on local disk while the task is still writing
+S3A_TUNING_CONF = {
+    "spark.hadoop.fs.s3a.connection.maximum": "200",
+    "spark.hadoop.fs.s3a.threads.max": "64",
+    "spark.hadoop.fs.s3a.fast.upload": "true",
+    "spark.hadoop.fs.s3a.fast.upload.buffer": "disk",
+    "spark.hadoop.fs.s3a.multipart.size": "128M",
+    "spark.hadoop.fs.s3a.multipart.threshold": "128M",
+    "spark.hadoop.fs.s3a.experimental.input.fadvise": "random",
+}
+
+# Writes to `s3a://` commit through the S3A magic committer, no rename of the task output.
+# `s3://` paths stay on EMRFS & its S3-optimized committer.
+S3A_MAGIC_COMMITTER_CONF = {
+    "spark.hadoop.fs.s3a.committer.name": "magic",
+    "spark.hadoop.fs.s3a.committer.magic.enabled": "true",
+    "spark.hadoop.mapreduce.outputcommitter.factory.scheme.s3a": "org.apache.hadoop.fs.s3a.commit.S3ACommitterFactory",
+}
+
+# Spark SQL & parquet writes bind to the committer factory of the output scheme through these.
+# They apply to every output path, EMRFS `s3://` writes would lose their committer, so they
+# go on the jobs writing to `s3a://` only, never in a profile.
+S3A_COMMITTER_JOB_CONF = {
+    "spark.sql.sources.commitProtocolClass": "org.apache.spark.internal.io.cloud.PathOutputCommitProtocol",
+    "spark.sql.parquet.output.committer.class": "org.apache.spark.internal.io.cloud.BindingParquetOutputCommitter",
+}
+
+HIVE_SITE_CONF = {
+    "hive.exec.dynamic.partition": "true",
+    "hive.exec.dynamic.partition.mode": "nonstrict",
+}
+
+# `s3://` paths
+EMRFS_TUNING_CONF = {
+    "fs.s3.maxConnections": "200",
+}
+
+
+# name: {version: profile}
+EMR_CONFIG_PROFILES = {
+    "spark3": {
+        1: {
+            "release_label": "emr-6.3.0-latest",
+            "classifications": {
+                "spark-defaults": {**AQE_CONF},
+                "spark-hive-site": {**HIVE_SITE_CONF},
+            },
+        },
+        2: {
+            "release_label": "emr-6.6.0-latest",
+            "classifications": {
+                "spark-defaults": {**AQE_CONF, **S3A_TUNING_CONF},
+                "spark-hive-site": {**HIVE_SITE_CONF},
+                "emrfs-site": {**EMRFS_TUNING_CONF},
+            },
+        },
+        3: {
+            "release_label": "emr-6.6.0-latest",
+            "classifications": {
+                "spark-defaults": {**AQE_CONF, **S3A_TUNING_CONF, **S3A_MAGIC_COMMITTER_CONF},
+                "spark-hive-site": {**HIVE_SITE_CONF},
+                "emrfs-site": {**EMRFS_TUNING_CONF},
+            },
+        },
+    },
+}
+
+
+def s3a_committer_submit_parameters():
+    """
+    `sparkSubmitParameters` of a job writing its output to `s3a://` through the magic committer
+    """
+    return " ".join(f"--conf {k}={v}" for k, v in S3A_COMMITTER_JOB_CONF.items())
+
+
+def parse_release_label(release_label: str):
+    """
+    `emr-6.6.0-latest` as `(6, 6, 0)`
+    """
+    m = _RELEASE_LABEL_RE.match(str(release_label))
+    if not m:
+        raise ValueError(
+            f"Invalid EMR release label '{release_label}', Ex: emr-6.6.0-latest")
+    return tuple(int(v) for v in m.groups()[:3])
+
+
+def get_config_profile(selector: str = None):
+    """
+    The profile for `<name>@<version>` or the latest version of `<name>`,
+    with its `name` & `version` added
+    """
+    name, _, version = str(selector or DEFAULT_CONFIG_PROFILE).partition("@")
+    if name not in EMR_CONFIG_PROFILES:
+        raise ValueError(
+            f"Unknown EMR config profile '{name}', choose one of {sorted(EMR_CONFIG_PROFILES)}")
+    versions = EMR_CONFIG_PROFILES[name]
+    if version:
+        if not version.isdigit() or int(version) not in versions:
+            raise ValueError(
+                f"Unknown version '{version}' of EMR config profile '{name}', choose one of {sorted(versions)}")
+        version = int(version)
+    else:
+        version = max(versions)
+    return {"name": name, "version": version, **versions[version]}
+
+
+def profile_id(profile: dict):
+    return f"{profile['name']}@{profile['version']}"
+
+
+def _check_int(errors, props, key, minimum=1):
+    if key in props and (not str(props[key]).isdigit() or int(props[key]) < minimum):
+        errors.append(f"'{key}' must be an integer >= {minimum}, not '{props[key]}'")
+
+
+def validate_config_profile(profile: dict, features: list = None):
+    """
+    Raise a ValueError listing every problem of the profile, for the job template `features`
+    (keys of MIN_RELEASES) it has to support
+    """
+    errors = []
+    try:
+        release = parse_release_label(profile.get("release_label"))
+    except ValueError as e:
+        errors.append(str(e))
+        release = None
+
+    if release:
+        for feature in ["pod_templates", *(features or [])]:
+            if release < parse_release_label(MIN_RELEASES[feature]):
+                errors.append(
+                    f"'{feature}' needs {MIN_RELEASES[feature]} or later, the profile pins {profile['release_label']}")
+
+    classifications = profile.get("classifications") or {}
+    for classification, props in classifications.items():
+        if classification not in SUPPORTED_CLASSIFICATIONS:
+            errors.append(
+                f"Unsupported classification '{classification}', choose from {list(SUPPORTED_CLASSIFICATIONS)}")
+            continue
+        # The EMR API only takes string properties
+        for k, v in props.items():
+            if not isinstance(v, str):
+                errors.append(
+                    f"{classification} '{k}' must be a string, not {type(v).__name__} '{v}'")
+
+    spark_defaults = {k: v for k, v in classifications.get(
+        "spark-defaults", {}).items() if isinstance(v, str)}
+    for k in spark_defaults:
+        if not k.startswith("spark."):
+            errors.append(f"spark-defaults '{k}' is not a spark conf")
+        if k in RESERVED_SPARK_CONFS:
+            errors.append(f"spark-defaults '{k}' is set by the stack")
+
+    if spark_defaults.get("spark.sql.adaptive.enabled") != "true":
+        aqe_confs = [k for k in spark_defaults if k.startswith(
+            "spark.sql.adaptive.") and k != "spark.sql.adaptive.enabled"]
+        if aqe_confs:
+            errors.append(
+                f"{aqe_confs} have no effect without 'spark.sql.adaptive.enabled' true")
+
+    s3a = "spark.hadoop.fs.s3a."
+    _check_int(errors, spark_defaults, f"{s3a}connection.maximum")
+    _check_int(errors, spark_defaults, f"{s3a}threads.max")
+    if spark_defaults.get(f"{s3a}connection.maximum", "").isdigit() and spark_defaults.get(f"{s3a}threads.max", "").isdigit():
+        if int(spark_defaults[f"{s3a}connection.maximum"]) < int(spark_defaults[f"{s3a}threads.max"]):
+            errors.append(
+                f"'{s3a}connection.maximum' must be at least '{s3a}threads.max', the upload threads would wait on the pool")
+    for k in (f"{s3a}multipart.size", f"{s3a}multipart.threshold"):
+        if k in spark_defaults and not _SIZE_RE.match(spark_defaults[k]):
+            errors.append(f"'{k}' must be a size, Ex: 128M, not '{spark_defaults[k]}'")
+    if f"{s3a}fast.upload.buffer" in spark_defaults and spark_defaults[f"{s3a}fast.upload.buffer"] not in ("disk", "array", "bytebuffer"):
+        errors.append(
+            f"'{s3a}fast.upload.buffer' must be one of disk, array, bytebuffer")
+
+    # The magic committer only kicks in with all its confs, a partial set silently falls back to rename
+    if spark_defaults.get(f"{s3a}committer.name") == "magic":
+        missing = [k for k, v in S3A_MAGIC_COMMITTER_CONF.items()
+                   if spark_defaults.get(k) != v]
+        if missing:
+            errors.append(f"The S3A magic committer also needs {missing}")
+    global_committer_confs = sorted(set(spark_defaults) & set(S3A_COMMITTER_JOB_CONF))
+    if global_committer_confs:
+        errors.append(
+            f"{global_committer_confs} break the EMRFS committer of s3:// writes, set them per s3a:// job instead")
+
+    _check_int(errors, classifications.get("emrfs-site", {}),
+               "fs.s3.maxConnections")
+
+    if errors:
+        raise ValueError(
+            f"Invalid EMR config profile '{profile_id(profile) if 'name' in profile else profile}':\n  " + "\n  ".join(errors))
+    return profile
@@ -3,12 +3,17 @@ from aws_cdk import aws_ec2 as _ec2
 from aws_cdk import aws_iam as _iam
 from aws_cdk import aws_emrcontainers as _emrc
 from aws_cdk import aws_logs as _logs
+from aws_cdk import custom_resources as _cr
 from aws_cdk import core as cdk
 
+import json
 import yaml
 import requests
 
 from stacks.miztiik_global_args import GlobalArgs
+from stacks.k8s_utils import pod_templates
+from stacks.k8s_utils import flow_control
+from stacks.back_end.emr_on_eks_stack import emr_config_profiles
 
 
 # aws_ec2 as ec2,
@@ -20,6 +25,11 @@ from stacks.miztiik_global_args import GlobalArgs
 
 
 class EmrOnEksStack(cdk.Stack):
+
+    # Namespace registered with the virtual cluster
+    EMR_01_NAME = "spark"
+    EMR_01_NS_NAME = f"{EMR_01_NAME}-ns"
+
     def __init__(
         self,
         scope: cdk.Construct,
@@ -29,10 +39,33 @@ class EmrOnEksStack(cdk.Stack):
         eks_cluster,
         clust_oidc_provider_arn,
         clust_oidc_issuer,
+        dataset_routing: dict = None,
+        artifacts_bkt=None,
+        drivers_on_fargate: bool = False,
+        tenant: str = "red-shirts",
+        tenant_access_point: dict = None,
+        executor_spill_storage_class: str = None,
+        node_archs: list = None,
+        executor_decommission: bool = False,
+        cache_tier_spark_conf: dict = None,
+        config_profile: dict = None,
+        api_flow_control: bool = False,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # Release label & spark confs of the job templates, checked against the features they use
+        config_profile = config_profile or emr_config_profiles.get_config_profile()
+        profile_features = []
+        if executor_decommission:
+            profile_features.append("executor_decommission")
+        if executor_spill_storage_class:
+            profile_features.append("executor_spill_pvc")
+        if "arm64" in (node_archs or []):
+            profile_features.append("arm64")
+        emr_config_profiles.validate_config_profile(
+            config_profile, features=profile_features)
+
         # Add your stack resources below):
 
         #################################
@@ -41,8 +74,8 @@ class EmrOnEksStack(cdk.Stack):
         #######                   #######
         #################################
 
-        emr_01_name = "spark"
-        self.emr_01_ns_name = f"{emr_01_name}-ns"
+        emr_01_name = self.EMR_01_NAME
+        self.emr_01_ns_name = self.EMR_01_NS_NAME
 
         emr_01_ns_manifest = {
             "apiVersion": "v1",
@@ -57,7 +90,7 @@ class EmrOnEksStack(cdk.Stack):
                             "owner": "miztiik-automation",
                             "compute_provider": "on_demand",
                             "dept": "engineering",
-                            "team": "red-shirts"
+                            "team": f"{tenant}"
                         },
                 "annotations": {
                             "contact": "github.com/miztiik"
@@ -133,6 +166,18 @@ class EmrOnEksStack(cdk.Stack):
         # Make sure the cluster role exists before creating role binding
         emr_01_clust_role_binding.node.add_dependency(emr_01_clust_role)
 
+        # API Priority & Fairness for the namespace, the EMR controller & the Spark drivers
+        # get their own fair queued seats on the API server
+        if api_flow_control:
+            emr_01_flow_control = _eks.KubernetesManifest(
+                self,
+                "emr01FlowControl",
+                cluster=eks_cluster,
+                manifest=flow_control.namespace_flow_control_manifests(
+                    self.emr_01_ns_name)
+            )
+            emr_01_flow_control.node.add_dependency(emr_01_ns)
+
         #######################################
         #######                         #######
         #######   EMR Execution Role    #######
@@ -195,17 +240,22 @@ class EmrOnEksStack(cdk.Stack):
             )
         )
 
-        emr_01_execution_role.add_to_policy(
-            _iam.PolicyStatement(
-                effect=_iam.Effect.ALLOW,
-                actions=[
-                    "s3:PutObject",
-                    "s3:GetObject",
-                    "s3:ListBucket"
-                ],
-                resources=["*"]
+        # Scope S3 access down to the tenant prefix, through the bucket or the tenant access point
+        if artifacts_bkt and tenant_access_point:
+            self.grant_tenant_s3_access(
+                emr_01_execution_role, artifacts_bkt, tenant_access_point)
+        else:
+            emr_01_execution_role.add_to_policy(
+                _iam.PolicyStatement(
+                    effect=_iam.Effect.ALLOW,
+                    actions=[
+                        "s3:PutObject",
+                        "s3:GetObject",
+                        "s3:ListBucket"
+                    ],
+                    resources=["*"]
+                )
             )
-        )
         emr_01_execution_role.add_to_policy(
             _iam.PolicyStatement(
                 effect=_iam.Effect.ALLOW,
@@ -247,6 +297,28 @@ class EmrOnEksStack(cdk.Stack):
         self.emr_vc.node.add_dependency(emr_01_ns)
         self.emr_vc.node.add_dependency(emr_01_clust_role_binding)
 
+        ###############################################
+        #######                               #######
+        #######   Pod & Job Run Templates     #######
+        #######                               #######
+        ###############################################
+
+        # Pod templates & a default job run template for the virtual cluster,
+        # Jobs reference them from the artifacts bucket
+        self.job_template_key = None
+        if artifacts_bkt:
+            self.add_job_templates(
+                artifacts_bkt,
+                templates_prefix=f"{tenant_access_point['prefix'] if tenant_access_point else ''}emr-on-eks/{self.emr_01_ns_name}",
+                drivers_on_fargate=drivers_on_fargate,
+                executor_spill_storage_class=executor_spill_storage_class,
+                node_archs=node_archs,
+                executor_decommission=executor_decommission,
+                cache_tier_spark_conf=cache_tier_spark_conf,
+                config_profile=config_profile,
+                api_flow_control=api_flow_control
+            )
+
         ###########################################
         ################# OUTPUTS #################
         ###########################################
@@ -270,9 +342,214 @@ class EmrOnEksStack(cdk.Stack):
             description="EMR Execution Role Arn",
         )
 
+        if tenant_access_point:
+            output_7 = cdk.CfnOutput(
+                self,
+                "EmrTenantS3Location",
+                value=f"s3://{tenant_access_point['alias']}/{tenant_access_point['prefix']}",
+                description="Tenant prefix, through the tenant access point alias",
+            )
+
         output_3 = cdk.CfnOutput(
             self,
             "EmrVirtualClusterId",
             value=f"{self.emr_vc.attr_id}",
             description="EMR Virtual Cluster Id",
         )
+
+        output_8 = cdk.CfnOutput(
+            self,
+            "EmrReleaseLabel",
+            value=f"{config_profile['release_label']}",
+            description=f"EMR release of the job templates, from the {emr_config_profiles.profile_id(config_profile)} config profile",
+        )
+
+        if self.job_template_key:
+            output_6 = cdk.CfnOutput(
+                self,
+                "EmrJobTemplateLocation",
+                value=f"s3://{artifacts_bkt.bucket_name}/{self.job_template_key}",
+                description="Default job run template, with the configuration overrides for the pod templates",
+            )
+
+        if dataset_routing:
+            output_4 = cdk.CfnOutput(
+                self,
+                "DatasetRoutingTable",
+                value=json.dumps(dataset_routing, sort_keys=True),
+                description="Dataset to nearest EMR virtual cluster stack, across the fleet",
+            )
+            routed_here = sorted(
+                k for k, v in dataset_routing.items() if v["emr_stack"] == construct_id)
+            if routed_here:
+                output_5 = cdk.CfnOutput(
+                    self,
+                    "RoutedDatasets",
+                    value=",".join(routed_here),
+                    description="Datasets to process on this virtual cluster",
+                )
+
+    def grant_tenant_s3_access(self, role, bkt, tenant_access_point: dict):
+        ap_arn = tenant_access_point["arn"]
+        prefix = tenant_access_point["prefix"]
+        role.add_to_policy(
+            _iam.PolicyStatement(
+                effect=_iam.Effect.ALLOW,
+                actions=[
+                    "s3:PutObject",
+                    "s3:GetObject",
+                    "s3:DeleteObject",
+                    "s3:AbortMultipartUpload",
+                    "s3:ListMultipartUploadParts"
+                ],
+                resources=[
+                    f"{ap_arn}/object/{prefix}*",
+                    bkt.arn_for_objects(f"{prefix}*")
+                ]
+            )
+        )
+        role.add_to_policy(
+            _iam.PolicyStatement(
+                effect=_iam.Effect.ALLOW,
+                actions=[
+                    "s3:ListBucket",
+                    "s3:ListBucketMultipartUploads"
+                ],
+                resources=[
+                    ap_arn,
+                    bkt.bucket_arn
+                ],
+                conditions={
+                    "StringLike": {
+                        "s3:prefix": [f"{prefix}*", prefix.rstrip("/")]
+                    }
+                }
+            )
+        )
+
+    def upload_to_bkt(self, id, bkt, key, body):
+        # Write a small synth-time generated file to the bucket.
+        # Lighter than a BucketDeployment, which bundles its own lambda & aws cli layer
+        put_obj_call = _cr.AwsSdkCall(
+            service="S3",
+            action="putObject",
+            parameters={
+                "Bucket": bkt.bucket_name,
+                "Key": key,
+                "Body": body
+            },
+            physical_resource_id=_cr.PhysicalResourceId.of(key)
+        )
+        return _cr.AwsCustomResource(
+            self,
+            id,
+            on_create=put_obj_call,
+            on_update=put_obj_call,
+            policy=_cr.AwsCustomResourcePolicy.from_statements([
+                _iam.PolicyStatement(
+                    actions=["s3:PutObject"],
+                    resources=[bkt.arn_for_objects(key)]
+                )
+            ])
+        )
+
+    def add_job_templates(self, artifacts_bkt, templates_prefix: str, drivers_on_fargate: bool = False, executor_spill_storage_class: str = None, node_archs: list = None, executor_decommission: bool = False, cache_tier_spark_conf: dict = None, config_profile: dict = None, api_flow_control: bool = False):
+        executor_fs_group = pod_templates.SPARK_FS_GROUP if executor_spill_storage_class else None
+        executor_grace_period = pod_templates.EXECUTOR_DECOMMISSION_GRACE_PERIOD if executor_decommission else None
+
+        templates = {
+            "driver": pod_templates.driver_pod_template(),
+            "executor": pod_templates.executor_pod_template(
+                fs_group=executor_fs_group,
+                termination_grace_period=executor_grace_period
+            ),
+            "driver_fargate": pod_templates.fargate_driver_pod_template(),
+        }
+        # job template name: (driver pod template, executor pod template)
+        job_templates = {
+            "default": ("driver_fargate" if drivers_on_fargate else "driver", "executor")
+        }
+
+        # Pod templates pinned to a cpu architecture, Ex: to compare x86_64 & Graviton with the same job.
+        # Only these tolerate the Graviton node taint, the `default` template stays on x86_64.
+        for arch in node_archs or []:
+            arch_selector = pod_templates.arch_node_selector(arch)
+            arch_tolerations = pod_templates.arch_tolerations(arch)
+            templates[f"driver_{arch}"] = pod_templates.driver_pod_template(
+                node_selector=arch_selector,
+                tolerations=arch_tolerations
+            )
+            templates[f"executor_{arch}"] = pod_templates.executor_pod_template(
+                node_selector=arch_selector,
+                fs_group=executor_fs_group,
+                termination_grace_period=executor_grace_period,
+                tolerations=arch_tolerations
+            )
+            job_templates[arch] = (f"driver_{arch}", f"executor_{arch}")
+
+        template_uris = {}
+        for name, template in templates.items():
+            key = f"{templates_prefix}/pod_templates/{name}.yaml"
+            self.upload_to_bkt(
+                f"{name}PodTemplate",
+                artifacts_bkt,
+                key,
+                yaml.safe_dump(template, default_flow_style=False)
+            )
+            template_uris[name] = f"s3://{artifacts_bkt.bucket_name}/{key}"
+
+        for name, (driver_template, executor_template) in job_templates.items():
+            spark_defaults = pod_templates.pod_template_spark_conf(
+                driver_template_uri=template_uris[driver_template],
+                executor_template_uri=template_uris[executor_template]
+            )
+            # Executors on instances without local NVMe spill to on-demand gp3 volumes
+            if executor_spill_storage_class:
+                spark_defaults.update(
+                    pod_templates.spill_pvc_spark_conf(executor_spill_storage_class))
+            # Drained(spot interrupted) executors hand their blocks over instead of dying with them
+            if executor_decommission:
+                spark_defaults.update(pod_templates.decommission_spark_conf(
+                    fallback_storage_uri=f"s3://{artifacts_bkt.bucket_name}/{templates_prefix}/decommission_fallback/"))
+            # `alluxio://` paths are served from the in-cluster cache tier
+            if cache_tier_spark_conf:
+                spark_defaults.update(cache_tier_spark_conf)
+            # Fewer, batched executor pod requests & pod list polls from the drivers
+            if api_flow_control:
+                spark_defaults.update(pod_templates.kube_api_spark_conf())
+            classifications = dict(
+                config_profile["classifications"]) if config_profile else {}
+            profile_defaults = classifications.pop("spark-defaults", {})
+            overridden = sorted(set(profile_defaults) & set(spark_defaults))
+            if overridden:
+                raise ValueError(
+                    f"The EMR config profile sets {overridden}, that the {name} job template sets itself")
+            job_template = {
+                "configurationOverrides": {
+                    "applicationConfiguration": [
+                        {
+                            "classification": "spark-defaults",
+                            "properties": {**profile_defaults, **spark_defaults}
+                        }
+                    ] + [
+                        {
+                            "classification": classification,
+                            "properties": properties
+                        } for classification, properties in sorted(classifications.items())
+                    ]
+                }
+            }
+            if config_profile:
+                # `start_job_run` takes the release label next to the configuration overrides
+                job_template["releaseLabel"] = config_profile["release_label"]
+                job_template["configProfile"] = emr_config_profiles.profile_id(
+                    config_profile)
+            job_template_key = f"{templates_prefix}/job_templates/{name}.json"
+            self.upload_to_bkt(
+                f"{name}JobTemplate",
+                artifacts_bkt,
+                job_template_key,
+                json.dumps(job_template, indent=2, sort_keys=True)
+            )
+            if name == "default":
+                self.job_template_key = job_template_key
@@ -12,6 +12,7 @@ class S3Stack(cdk.Stack):
         construct_id: str,
         stack_log_level: str,
         custom_bkt_name: str = None,
+        tenants: list = None,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -54,6 +55,13 @@ class S3Stack(cdk.Stack):
             )
         )
 
+        # One access point & prefix per tenant. S3 request rate limits apply per prefix,
+        # so a heavy write burst from one tenant does not throttle the others.
+        self.tenant_access_points = {}
+        for tenant in tenants or []:
+            self.tenant_access_points[tenant] = self.add_tenant_access_point(
+                tenant, construct_id)
+
         ###########################################
         ################# OUTPUTS #################
         ###########################################
@@ -75,3 +83,37 @@ class S3Stack(cdk.Stack):
             value=f"https://console.aws.amazon.com/s3/buckets/{self.data_bkt.bucket_name}",
             description=f"The datasource bucket url"
         )
+
+        for tenant, ap in self.tenant_access_points.items():
+            cdk.CfnOutput(
+                self,
+                f"{tenant}AccessPointAlias",
+                value=f"{ap['alias']}",
+                description=f"Access point alias for tenant {tenant}, use it in place of the bucket name"
+            )
+            cdk.CfnOutput(
+                self,
+                f"{tenant}Prefix",
+                value=f"{ap['prefix']}",
+                description=f"Prefix owned by tenant {tenant}"
+            )
+
+    @staticmethod
+    def tenant_prefix(tenant: str):
+        return f"tenants/{tenant}/"
+
+    def add_tenant_access_point(self, tenant: str, construct_id: str):
+        # Access point names are unique per account & region, lowercase, 3-50 chars
+        ap_name = f"{tenant}-{construct_id}".lower()[:50].rstrip("-")
+        tenant_ap = _s3.CfnAccessPoint(
+            self,
+            f"{tenant}AccessPoint",
+            bucket=self.data_bkt.bucket_name,
+            name=ap_name
+        )
+        return {
+            "name": ap_name,
+            "arn": f"arn:aws:s3:{cdk.Aws.REGION}:{cdk.Aws.ACCOUNT_ID}:accesspoint/{ap_name}",
+            "alias": tenant_ap.attr_alias,
+            "prefix": self.tenant_prefix(tenant),
+        }
@@ -0,0 +1,66 @@
+from aws_cdk import core as cdk
+from aws_cdk.lambda_layer_kubectl import KubectlLayer
+
+from stacks.miztiik_global_args import GlobalArgs
+from stacks.fleet.fleet_spec import shared_assets_stack_name
+
+
+class SharedAssetsStack(cdk.Stack):
+    """
+    Provider assets shared by every EKS cluster in an environment(account/region).
+
+    `_eks.Cluster` bundles its own kubectl/helm layer otherwise, which gets hashed,
+    staged & uploaded once per cluster stack.
+    """
+
+    def __init__(
+        self,
+        scope: cdk.Construct,
+        construct_id: str,
+        stack_log_level: str,
+        **kwargs
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        # kubectl, helm & aws cli layer used by the kubectl provider of the clusters
+        self.kubectl_layer = KubectlLayer(
+            self,
+            "sharedKubectlLayer"
+        )
+
+        ###########################################
+        ################# OUTPUTS #################
+        ###########################################
+        output_0 = cdk.CfnOutput(
+            self,
+            "AutomationFrom",
+            value=f"{GlobalArgs.SOURCE_INFO}",
+            description="To know more about this automation stack, check out our github page.",
+        )
+        output_1 = cdk.CfnOutput(
+            self,
+            "SharedKubectlLayerArn",
+            value=f"{self.kubectl_layer.layer_version_arn}",
+            description="Shared kubectl layer used by the EKS clusters in this environment",
+        )
+
+    @classmethod
+    def for_env(cls, scope: cdk.Construct, env: cdk.Environment = None, stack_log_level: str = "INFO"):
+        """
+        Return the shared assets stack of the environment, creating it on first use.
+        Looked up in the construct tree of `scope`, so every `App` gets its own.
+        """
+        stack_name = shared_assets_stack_name(
+            env.account if env else None,
+            env.region if env else None
+        )
+        existing = scope.node.try_find_child(stack_name)
+        if existing is not None:
+            return existing
+        return cls(
+            scope,
+            stack_name,
+            stack_log_level=stack_log_level,
+            env=env,
+            description="Miztiik Automation: Provider assets shared by the EKS clusters"
+        )
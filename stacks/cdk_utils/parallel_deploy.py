@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Deploy the stacks of the cdk app concurrently, following their dependency graph.
+
+The app is synthesized once(skipped if the cloud assembly is up to date), then every
+stack whose dependencies have been deployed is handed to `cdk deploy --exclusively`
+from the same cloud assembly. At the end, the per-stack timings and the critical path
+through the graph are reported.
+
+Usage:
+    python -m stacks.cdk_utils.parallel_deploy --concurrency 3
+    python -m stacks.cdk_utils.parallel_deploy --concurrency 2 emr-on-eks-stack11
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from stacks.cdk_utils.synth_cache import context_args, ensure_synth
+
+
+logger = logging.getLogger("parallel_deploy")
+
+CDK_OUT_DIR = "cdk.out"
+STACK_ARTIFACT_TYPE = "aws:cloudformation:stack"
+
+
+def load_stack_graph(cdk_out_dir=CDK_OUT_DIR):
+    """
+    Read `{stack_name: [dependency stack names]}` from the cloud assembly manifest
+    """
+    with open(os.path.join(cdk_out_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    artifacts = manifest.get("artifacts", {})
+    stacks = {n for n, a in artifacts.items() if a.get(
+        "type") == STACK_ARTIFACT_TYPE}
+    # Asset manifests & other artifacts show up as dependencies too, we only order stacks
+    return {
+        n: sorted(d for d in artifacts[n].get(
+            "dependencies", []) if d in stacks)
+        for n in stacks
+    }
+
+
+def select_stacks(graph, requested):
+    """
+    Restrict the graph to the requested stacks plus everything they depend on
+    """
+    if not requested:
+        return graph
+    unknown = set(requested) - set(graph)
+    if unknown:
+        raise SystemExit(f"Unknown stacks: {sorted(unknown)}")
+    selected = set()
+    todo = list(requested)
+    while todo:
+        n = todo.pop()
+        if n not in selected:
+            selected.add(n)
+            todo.extend(graph[n])
+    return {n: graph[n] for n in selected}
+
+
+def critical_path(graph, durations):
+    """
+    Longest chain of stack deploy durations through the dependency graph
+    """
+    memo = {}
+
+    def _path(n):
+        if n not in memo:
+            best = max((_path(d) for d in graph[n]),
+                       key=lambda p: p[0], default=(0, []))
+            memo[n] = (best[0] + durations.get(n, 0), best[1] + [n])
+        return memo[n]
+
+    return max((_path(n) for n in graph), key=lambda p: p[0], default=(0, []))
+
+
+async def run_cmd(cmd):
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT
+    )
+    out, _ = await proc.communicate()
+    return proc.returncode, out.decode("utf-8", errors="replace")
+
+
+async def deploy_graph(graph, concurrency, cdk_cmd, cdk_out_dir, extra_args):
+    sem = asyncio.Semaphore(concurrency)
+    durations = {}
+    failed = set()
+    tasks = {}
+
+    async def _deploy(stack_name):
+        async with sem:
+            logger.info(f"Deploying {stack_name}")
+            start = time.time()
+            rc, out = await run_cmd([
+                cdk_cmd, "deploy",
+                "--app", cdk_out_dir,
+                "--exclusively",
+                "--require-approval", "never",
+                *extra_args,
+                stack_name
+            ])
+            durations[stack_name] = time.time() - start
+            if rc != 0:
+                failed.add(stack_name)
+                logger.error(f"{stack_name} failed after {durations[stack_name]:.0f}s\n{out}")
+            else:
+                logger.info(
+                    f"{stack_name} deployed in {durations[stack_name]:.0f}s")
+
+    while True:
+        for n, deps in graph.items():
+            if n in tasks:
+                continue
+            # Skip everything downstream of a failed stack
+            if any(d in failed for d in deps):
+                failed.add(n)
+                tasks[n] = None
+                logger.warning(f"Skipping {n}, a dependency failed")
+                continue
+            if all(d in durations and d not in failed for d in deps):
+                tasks[n] = asyncio.ensure_future(_deploy(n))
+        running = [t for t in tasks.values() if t and not t.done()]
+        if not running:
+            break
+        await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+    return durations, failed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Deploy cdk stacks concurrently following their dependencies")
+    parser.add_argument("stacks", nargs="*",
+                        help="Stacks to deploy, along with their dependencies. Defaults to all stacks")
+    parser.add_argument("--concurrency", type=int, default=3,
+                        help="Max number of stacks deployed at the same time")
+    parser.add_argument("--cdk", default="cdk", help="cdk cli executable")
+    parser.add_argument("--cdk-out", default=CDK_OUT_DIR)
+    parser.add_argument("--skip-synth", action="store_true",
+                        help="Reuse the existing cloud assembly without checking if it is up to date")
+    parser.add_argument("--log-level", default="INFO")
+    args, extra_args = parser.parse_known_args()
+    return args, extra_args
+
+
+def main():
+    args, extra_args = parse_args()
+    logging.basicConfig(
+        level=args.log_level,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+    if not args.skip_synth:
+        try:
+            ensure_synth(args.cdk, args.cdk_out, context_args(extra_args))
+        except subprocess.CalledProcessError as e:
+            sys.exit(e.returncode)
+
+    graph = select_stacks(load_stack_graph(args.cdk_out), args.stacks)
+
+    start = time.time()
+    durations, failed = asyncio.run(
+        deploy_graph(graph, args.concurrency, args.cdk, args.cdk_out, extra_args))
+    wall_clock = time.time() - start
+
+    cp_duration, cp_stacks = critical_path(graph, durations)
+    logger.info("Stack deploy timings:")
+    for n, d in sorted(durations.items(), key=lambda i: -i[1]):
+        logger.info(f"  {n:<50} {d:>8.0f}s")
+    logger.info(
+        f"Critical path ({cp_duration:.0f}s): {' -> '.join(cp_stacks)}")
+    logger.info(
+        f"Wall clock {wall_clock:.0f}s vs {sum(durations.values()):.0f}s deploying one stack at a time")
+
+    if failed:
+        logger.error(f"Failed or skipped stacks: {sorted(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
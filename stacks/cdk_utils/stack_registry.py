@@ -0,0 +1,80 @@
+"""
+Build only the stacks a cdk command needs.
+
+Stacks are registered by name with a builder & the names of the stacks they depend on.
+Nothing is built, or imported, until a stack is selected: the builders import their stack
+module themselves, so `aws_cdk.aws_eks` & co are only loaded when a stack needs them.
+The selection comes from the `stacks` context, comma separated stack names or fnmatch
+patterns, Ex: `cdk synth -c stacks=emr-artifacts-bkt-stack`. The dependencies of the
+selected stacks are always built along with them. Without the context every stack is built.
+"""
+
+import fnmatch
+
+
+STACKS_CONTEXT_KEY = "stacks"
+
+
+class StackRegistry():
+    def __init__(self, app):
+        self.app = app
+        self._builders = {}
+        self._dependencies = {}
+        self._stacks = {}
+
+    def __contains__(self, name):
+        return name in self._builders
+
+    @property
+    def names(self):
+        return list(self._builders)
+
+    def register(self, name: str, builder, depends_on: list = None):
+        """
+        `builder()` creates & returns the stack, it gets the stacks it needs through `get()`
+        """
+        if name in self._builders:
+            raise ValueError(f"Stack '{name}' is already registered")
+        self._builders[name] = builder
+        self._dependencies[name] = list(depends_on or [])
+
+    def get(self, name: str):
+        """
+        The stack, built with its dependencies on first use
+        """
+        if name not in self._stacks:
+            if name not in self._builders:
+                raise KeyError(f"Unknown stack '{name}'")
+            deps = [self.get(d) for d in self._dependencies[name]]
+            stack = self._builders[name]()
+            # Explicit deploy-time dependency graph between the stacks.
+            # Stacks without a path between them can be deployed concurrently,
+            # Ex: `python -m stacks.cdk_utils.parallel_deploy --concurrency 3`
+            for d in deps:
+                stack.add_dependency(d)
+            self._stacks[name] = stack
+        return self._stacks[name]
+
+    def select(self, patterns=None):
+        """
+        Registered stack names matching any of the patterns, all of them without patterns
+        """
+        if not patterns:
+            return self.names
+        selected = []
+        for pattern in patterns:
+            matches = [n for n in self._builders if fnmatch.fnmatch(n, pattern)]
+            if not matches:
+                raise ValueError(
+                    f"No stack matches '{pattern}', choose from {self.names}")
+            selected.extend(n for n in matches if n not in selected)
+        return selected
+
+    def build(self, patterns=None):
+        return [self.get(n) for n in self.select(patterns)]
+
+    def build_from_context(self):
+        ctx = self.app.node.try_get_context(STACKS_CONTEXT_KEY)
+        if isinstance(ctx, str):
+            ctx = [p.strip() for p in ctx.split(",") if p.strip()]
+        return self.build(ctx)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Skip `cdk synth` when nothing that feeds the cloud assembly has changed.
+
+A fingerprint of the app sources, cdk config & context is stored next to the cloud
+assembly. The app writes it on every synth, from the context it actually resolved, so a
+synth run outside this module(Ex: `cdk synth -c stacks=...`) invalidates it as well.
+When it matches, the existing `cdk.out` (and the assets already staged in it) is reused
+as is. Deploying with `--app cdk.out` keeps the asset hashes identical between
+runs, so `cdk-assets` finds them in the bootstrap bucket and skips the upload.
+
+Usage:
+    python -m stacks.cdk_utils.synth_cache [--force]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+
+
+logger = logging.getLogger("synth_cache")
+
+CDK_OUT_DIR = "cdk.out"
+FINGERPRINT_FILE = ".synth_fingerprint"
+
+# Env var the cdk cli passes the resolved context to the app in
+CONTEXT_ENV = "CDK_CONTEXT_JSON"
+# Context the cdk cli injects itself(Ex: aws:cdk:enable-path-metadata), not an app input
+CLI_CONTEXT_PREFIX = "aws:cdk:"
+
+# Everything that can change the synthesized templates or assets
+SYNTH_INPUTS = [
+    "app.py",
+    "cdk.json",
+    "cdk.context.json",
+    "requirements.txt",
+    "setup.py",
+]
+SYNTH_INPUT_DIRS = ["stacks"]
+SYNTH_INPUT_EXTENSIONS = (".py", ".yaml", ".yml", ".json", ".sql", ".sh")
+
+
+def _input_files(root="."):
+    files = [f for f in SYNTH_INPUTS if os.path.isfile(os.path.join(root, f))]
+    for d in SYNTH_INPUT_DIRS:
+        for dir_path, dir_names, file_names in os.walk(os.path.join(root, d)):
+            dir_names[:] = sorted(
+                n for n in dir_names if n != "__pycache__")
+            files.extend(
+                os.path.relpath(os.path.join(dir_path, f), root)
+                for f in file_names if f.endswith(SYNTH_INPUT_EXTENSIONS)
+            )
+    return sorted(files)
+
+
+def context_args(args):
+    """
+    `-c key=value` & `--context key=value` options of a cdk cli argument list, as `["-c", "key=value", ...]`
+    """
+    ctx_args = []
+    it = iter(args)
+    for a in it:
+        if a in ("-c", "--context"):
+            ctx_args += ["-c", next(it, "")]
+        elif a.startswith("--context="):
+            ctx_args += ["-c", a[len("--context="):]]
+    return ctx_args
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def expected_context(root=".", extra_args=()):
+    """
+    Context the cdk cli resolves for the app: `~/.cdk.json`, `cdk.json` & `cdk.context.json`,
+    then the command line values, which always come in as strings
+    """
+    ctx = {}
+    ctx.update(_read_json(os.path.expanduser("~/.cdk.json")).get("context", {}))
+    ctx.update(_read_json(os.path.join(root, "cdk.json")).get("context", {}))
+    ctx.update(_read_json(os.path.join(root, "cdk.context.json")))
+    for kv in context_args(extra_args)[1::2]:
+        k, _, v = kv.partition("=")
+        ctx[k] = v
+    return ctx
+
+
+def app_context():
+    """
+    Context the running app got from the cdk cli
+    """
+    return json.loads(os.environ.get(CONTEXT_ENV) or "{}")
+
+
+def synth_fingerprint(root=".", context=None):
+    h = hashlib.sha256()
+    for f in _input_files(root):
+        h.update(f.encode("utf-8"))
+        with open(os.path.join(root, f), "rb") as fp:
+            h.update(hashlib.sha256(fp.read()).digest())
+    # Every context value changes the output as well, Ex: the `stacks` selection
+    ctx = {k: v for k, v in (context or {}).items() if not k.startswith(CLI_CONTEXT_PREFIX)}
+    h.update(json.dumps(ctx, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def record_synth_fingerprint(cdk_out_dir, root="."):
+    """
+    Stamp the cloud assembly with the inputs & context of this synth, called by the app
+    """
+    with open(os.path.join(cdk_out_dir, FINGERPRINT_FILE), "w") as f:
+        f.write(synth_fingerprint(root, app_context()))
+
+
+def _read_fingerprint(cdk_out_dir):
+    try:
+        with open(os.path.join(cdk_out_dir, FINGERPRINT_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def ensure_synth(cdk_cmd="cdk", cdk_out_dir=CDK_OUT_DIR, extra_args=(), force=False):
+    """
+    Synthesize the app unless the cloud assembly is already up to date.
+    Returns `True` if the app was synthesized.
+    """
+    fingerprint = synth_fingerprint(context=expected_context(extra_args=extra_args))
+    up_to_date = (
+        os.path.isfile(os.path.join(cdk_out_dir, "manifest.json"))
+        and _read_fingerprint(cdk_out_dir) == fingerprint
+    )
+    if up_to_date and not force:
+        logger.info(f"{cdk_out_dir} is up to date, skipping synth")
+        return False
+
+    subprocess.run(
+        [cdk_cmd, "synth", "--quiet", "--output", cdk_out_dir, *extra_args],
+        check=True
+    )
+    # The app wrote the fingerprint, a mismatch means it resolved a different context than expected
+    if _read_fingerprint(cdk_out_dir) != fingerprint:
+        logger.warning(
+            f"{cdk_out_dir} was synthesized from a different context than expected, it will not be reused")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Synthesize the cdk app only when its inputs changed")
+    parser.add_argument("--cdk", default="cdk", help="cdk cli executable")
+    parser.add_argument("--cdk-out", default=CDK_OUT_DIR)
+    parser.add_argument("--force", action="store_true")
+    args, extra_args = parser.parse_known_args()
+    logging.basicConfig(
+        level="INFO", format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    try:
+        ensure_synth(args.cdk, args.cdk_out, extra_args, args.force)
+    except subprocess.CalledProcessError as e:
+        sys.exit(e.returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Check the synthesized templates against resource budgets & the snapshots of the last known good synth.
+
+Every stack in the cloud assembly(nested stacks included) is measured: custom resources,
+which each cost a Lambda invocation & a wait during deploy, Kubernetes manifests & helm
+charts, Lambda functions, IAM policies, template size, resources & outputs. Going over a
+budget in `template_budgets.yaml`, or past 80% of a CloudFormation hard limit, fails the
+check. The templates are also compared with the snapshots in `template_snapshots/`(asset
+hashes masked), so any drift in the generated resources shows up in review. The same checks
+run in `tests/test_template_budgets.py`, against an in-process synth of the app.
+
+Usage:
+    python -m stacks.cdk_utils.template_budgets
+    python -m stacks.cdk_utils.template_budgets --update-snapshots
+    python -m stacks.cdk_utils.template_budgets -c graviton_nodes=2
+"""
+
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+
+import yaml
+
+from stacks.cdk_utils.synth_cache import ensure_synth
+
+
+logger = logging.getLogger("template_budgets")
+
+CDK_OUT_DIR = "cdk.out"
+STACK_ARTIFACT_TYPE = "aws:cloudformation:stack"
+BUDGETS_FILE = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "template_budgets.yaml")
+SNAPSHOTS_DIR = "template_snapshots"
+
+# CloudFormation & IAM hard limits
+# Ref: https://docs.aws.amazon.com/AWSCloudFormation/latest/UserGuide/cloudformation-limits.html
+HARD_LIMITS = {
+    "template_bytes": 1000000,
+    "resources": 500,
+    "outputs": 200,
+    "parameters": 200,
+    "max_role_inline_policy_bytes": 10240,
+}
+# Fail before we get to the hard limit, not on the deploy that crosses it
+HARD_LIMIT_HEADROOM = 0.8
+
+KUBERNETES_RESOURCE_TYPES = (
+    "Custom::AWSCDK-EKS-KubernetesResource",
+    "Custom::AWSCDK-EKS-HelmChart",
+)
+IAM_POLICY_TYPES = ("AWS::IAM::Policy", "AWS::IAM::ManagedPolicy")
+
+# Asset hashes change with every code change of a bundled asset, they are not drift
+_ASSET_HASH_RE = re.compile(r"[0-9a-f]{64}")
+
+
+def load_stack_templates(cdk_out_dir=CDK_OUT_DIR):
+    """
+    `{stack_name: template file}` of the stacks in the cloud assembly
+    """
+    with open(os.path.join(cdk_out_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    return {
+        n: os.path.join(cdk_out_dir, a["properties"]["templateFile"])
+        for n, a in manifest.get("artifacts", {}).items()
+        if a.get("type") == STACK_ARTIFACT_TYPE
+    }
+
+
+def _nested_template_files(template, cdk_out_dir):
+    for r in template.get("Resources", {}).values():
+        asset_path = r.get("Metadata", {}).get("aws:asset:path")
+        if r.get("Type") == "AWS::CloudFormation::Stack" and asset_path:
+            yield os.path.join(cdk_out_dir, asset_path)
+
+
+def _role_inline_policy_bytes(resources):
+    # Inline policies & `AWS::IAM::Policy` attached to a role share the role's inline policy quota
+    sizes = {}
+    for logical_id, r in resources.items():
+        props = r.get("Properties", {})
+        if r["Type"] == "AWS::IAM::Role":
+            for p in props.get("Policies", []):
+                sizes[logical_id] = sizes.get(logical_id, 0) + len(
+                    json.dumps(p.get("PolicyDocument", {}), separators=(",", ":")))
+        elif r["Type"] == "AWS::IAM::Policy":
+            doc_size = len(json.dumps(
+                props.get("PolicyDocument", {}), separators=(",", ":")))
+            for role in props.get("Roles", []):
+                role_id = role.get("Ref") if isinstance(role, dict) else role
+                sizes[role_id] = sizes.get(role_id, 0) + doc_size
+    return max(sizes.values(), default=0)
+
+
+def template_stats(template_file, cdk_out_dir=CDK_OUT_DIR, template=None):
+    """
+    Counts & sizes of a stack template. The nested stacks(Ex: the EKS kubectl provider)
+    deploy with their parent, so their resources are added to it. `template` is the
+    parsed template when the caller already has it, Ex: `Template.to_json()` in the tests.
+    """
+    if template is None:
+        with open(template_file) as f:
+            template = json.load(f)
+    resources = template.get("Resources", {})
+    types = [r["Type"] for r in resources.values()]
+    stats = {
+        "custom_resources": sum(
+            1 for t in types if t.startswith("Custom::") or t == "AWS::CloudFormation::CustomResource"),
+        "kubernetes_resources": sum(1 for t in types if t in KUBERNETES_RESOURCE_TYPES),
+        "lambda_functions": types.count("AWS::Lambda::Function"),
+        "iam_policies": sum(1 for t in types if t in IAM_POLICY_TYPES) + sum(
+            len(r.get("Properties", {}).get("Policies", [])) for r in resources.values() if r["Type"] == "AWS::IAM::Role"),
+        "template_bytes": os.path.getsize(template_file),
+        "resources": len(resources),
+        "outputs": len(template.get("Outputs", {})),
+        "parameters": len(template.get("Parameters", {})),
+        "max_role_inline_policy_bytes": _role_inline_policy_bytes(resources),
+        "nested_stacks": 0,
+    }
+    for nested_file in _nested_template_files(template, cdk_out_dir):
+        nested = template_stats(nested_file, cdk_out_dir)
+        stats["nested_stacks"] += 1 + nested["nested_stacks"]
+        # Limits apply per template, the deploy cost adds up
+        for k in ("custom_resources", "kubernetes_resources", "lambda_functions", "iam_policies"):
+            stats[k] += nested[k]
+        for k in ("template_bytes", "resources", "outputs", "parameters", "max_role_inline_policy_bytes"):
+            stats[k] = max(stats[k], nested[k])
+    return stats
+
+
+def load_budgets(budgets_file=BUDGETS_FILE):
+    with open(budgets_file) as f:
+        return yaml.safe_load(f)
+
+
+def stack_budget(budgets, stack_name):
+    """
+    The defaults, overridden by every stack pattern that matches the stack name, in file order
+    """
+    budget = dict(budgets.get("defaults", {}))
+    for pattern, overrides in (budgets.get("stacks") or {}).items():
+        if fnmatch.fnmatch(stack_name, pattern):
+            budget.update(overrides)
+    return budget
+
+
+def check_stack(stack_name, stats, budget):
+    """
+    Violations of the budget & of the hard limit headroom
+    """
+    errors = []
+    for metric, limit in budget.items():
+        if stats.get(metric, 0) > limit:
+            errors.append(
+                f"{stack_name}: {metric} {stats[metric]} over the budget of {limit}")
+    for metric, hard_limit in HARD_LIMITS.items():
+        if stats[metric] > hard_limit * HARD_LIMIT_HEADROOM:
+            errors.append(
+                f"{stack_name}: {metric} {stats[metric]} is past {HARD_LIMIT_HEADROOM:.0%} of the CloudFormation limit of {hard_limit}")
+    return errors
+
+
+def normalized_template(template_file):
+    with open(template_file) as f:
+        body = f.read()
+    return json.loads(_ASSET_HASH_RE.sub("<asset-hash>", body))
+
+
+def snapshot_drift(stack_name, template_file, snapshots_dir, update=False):
+    """
+    Logical ids added, removed or changed since the snapshot. Records the snapshot when
+    there is none yet or when `update` is set.
+    """
+    current = normalized_template(template_file)
+    snapshot_file = os.path.join(snapshots_dir, f"{stack_name}.json")
+    if update or not os.path.isfile(snapshot_file):
+        os.makedirs(snapshots_dir, exist_ok=True)
+        with open(snapshot_file, "w") as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+            f.write("\n")
+        logger.info(f"{stack_name}: snapshot recorded in {snapshot_file}")
+        return []
+
+    with open(snapshot_file) as f:
+        snapshot = json.load(f)
+    drift = []
+    for section in ("Resources", "Outputs", "Parameters"):
+        old, new = snapshot.get(section, {}), current.get(section, {})
+        for k in sorted(set(old) | set(new)):
+            if k not in old:
+                drift.append(
+                    f"{stack_name}: + {section}.{k} {new[k].get('Type', '')}")
+            elif k not in new:
+                drift.append(
+                    f"{stack_name}: - {section}.{k} {old[k].get('Type', '')}")
+            elif old[k] != new[k]:
+                drift.append(
+                    f"{stack_name}: ~ {section}.{k} {new[k].get('Type', '')}")
+    return drift
+
+
+def print_report(all_stats):
+    cols = ["custom_resources", "kubernetes_resources", "lambda_functions",
+            "iam_policies", "resources", "outputs", "template_bytes"]
+    width = max([len(n) for n in all_stats] + [5])
+    logger.info(f"{'stack':<{width}} " +
+                " ".join(f"{c.split('_')[0][:10]:>10}" for c in cols))
+    for n in sorted(all_stats):
+        logger.info(f"{n:<{width}} " +
+                    " ".join(f"{all_stats[n][c]:>10}" for c in cols))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the synthesized templates against resource budgets & snapshots")
+    parser.add_argument("--cdk", default="cdk", help="cdk cli executable")
+    parser.add_argument("--cdk-out", default=CDK_OUT_DIR)
+    parser.add_argument("--skip-synth", action="store_true",
+                        help="Use the existing cloud assembly as is")
+    parser.add_argument("--budgets", default=BUDGETS_FILE)
+    parser.add_argument("--snapshots", default=SNAPSHOTS_DIR)
+    parser.add_argument("--update-snapshots", action="store_true",
+                        help="Accept the current templates as the new snapshots")
+    args, extra_args = parser.parse_known_args()
+    logging.basicConfig(
+        level="INFO", format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if not args.skip_synth:
+        try:
+            ensure_synth(args.cdk, args.cdk_out, extra_args)
+        except subprocess.CalledProcessError as e:
+            sys.exit(e.returncode)
+
+    budgets = load_budgets(args.budgets)
+    errors, drift, all_stats = [], [], {}
+    for stack_name, template_file in sorted(load_stack_templates(args.cdk_out).items()):
+        all_stats[stack_name] = template_stats(template_file, args.cdk_out)
+        errors += check_stack(stack_name,
+                              all_stats[stack_name], stack_budget(budgets, stack_name))
+        drift += snapshot_drift(stack_name, template_file,
+                                args.snapshots, args.update_snapshots)
+
+    print_report(all_stats)
+    for d in drift:
+        logger.error(d)
+    if drift:
+        logger.error(
+            "Templates drifted from the snapshots, review & run with --update-snapshots to accept")
+    for e in errors:
+        logger.error(e)
+    if errors or drift:
+        sys.exit(1)
+    logger.info("All stacks within budget & matching their snapshots")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Admission control in front of `start-job-run` for the EMR on EKS virtual clusters.
+
+Jobs are enqueued into a durable(sqlite) queue instead of being submitted directly. On every
+tick the governor reads the live cluster capacity from the Kubernetes API(allocatable vs
+requested resources, pending pods) & the active job runs from emr-containers, works out how
+many more jobs each namespace can take and submits that many from the head of its queue,
+highest priority first & FIFO within a priority. The queue depth is published as a metric.
+
+Usage:
+    kubectl proxy --port 8001 &
+
+    python -m stacks.emr_utils.admission_governor.governor \
+        --config stacks/emr_utils/admission_governor/sample_governor.yaml \
+        enqueue --namespace spark-ns --priority 5 --request job_run.json
+
+    python -m stacks.emr_utils.admission_governor.governor \
+        --config stacks/emr_utils/admission_governor/sample_governor.yaml run
+
+    # Against the kind cluster & the emr-containers stub of `stacks/local_harness`, the
+    # namespaces of the config use the virtual cluster `local-virtual-cluster`
+    python -m stacks.emr_utils.admission_governor.governor --config <config> \
+        run --endpoint-url http://127.0.0.1:8090 --once
+"""
+
+import argparse
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import boto3
+import yaml
+from botocore.exceptions import ClientError
+
+from stacks.emr_utils.emr_job_client import (
+    JOB_RUN_ACTIVE_STATES,
+    get_emr_client,
+    get_virtual_cluster_from_stack,
+)
+from stacks.k8s_utils.kube_api import (
+    DEFAULT_API_URL,
+    TERMINATED_POD_PHASES,
+    KubeApi,
+    parse_cpu,
+    parse_memory,
+    pod_requests,
+)
+
+
+logger = logging.getLogger("admission_governor")
+
+# Queue entry states
+QUEUED = "QUEUED"
+ADMITTED = "ADMITTED"
+REJECTED = "REJECTED"
+
+METRIC_NAMESPACE = "EmrOnEks/AdmissionGovernor"
+
+# Driver + the initial executors of a typical job
+DEFAULT_JOB_FOOTPRINT = {"cpu": "3", "memory": "8Gi"}
+
+# start_job_run errors that will not go away by retrying
+_PERMANENT_ERRORS = ("ValidationException", "ResourceNotFoundException")
+
+
+class JobQueue():
+    """
+    Durable priority queue of `start_job_run` requests, one queue per namespace
+    """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    namespace TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    request TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    admitted_at REAL,
+                    job_run_id TEXT,
+                    error TEXT,
+                    client_token TEXT NOT NULL
+                )""")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (namespace, state, priority DESC, id)")
+
+    def enqueue(self, namespace, request, priority=0):
+        with self._lock, self.conn:
+            # Row ids restart with a new database, the token must stay unique across them
+            cur = self.conn.execute(
+                "INSERT INTO jobs (namespace, priority, request, state, enqueued_at, client_token) VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, priority, json.dumps(request), QUEUED, time.time(), str(uuid.uuid4()))
+            )
+            return cur.lastrowid
+
+    def head(self, namespace, limit):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM jobs WHERE namespace = ? AND state = ? ORDER BY priority DESC, id LIMIT ?",
+                (namespace, QUEUED, limit)
+            ).fetchall()
+        return [{**dict(r), "request": json.loads(r["request"])} for r in rows]
+
+    def mark_admitted(self, entry_id, job_run_id):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, admitted_at = ?, job_run_id = ? WHERE id = ?",
+                (ADMITTED, time.time(), job_run_id, entry_id)
+            )
+
+    def mark_rejected(self, entry_id, error):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, error = ? WHERE id = ?",
+                (REJECTED, error, entry_id)
+            )
+
+    def depth(self):
+        """
+        Queued jobs per namespace
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT namespace, COUNT(*) AS n FROM jobs WHERE state = ? GROUP BY namespace",
+                (QUEUED,)
+            ).fetchall()
+        return {r["namespace"]: r["n"] for r in rows}
+
+    def oldest_wait(self, namespace):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT MIN(enqueued_at) AS t FROM jobs WHERE namespace = ? AND state = ?",
+                (namespace, QUEUED)
+            ).fetchone()
+        return time.time() - row["t"] if row["t"] else 0
+
+
+def _node_is_schedulable(node):
+    if node.get("spec", {}).get("unschedulable"):
+        return False
+    # Spark pods only land on Fargate through an explicit profile, so its capacity does not count
+    if node["metadata"].get("labels", {}).get("eks.amazonaws.com/compute-type") == "fargate":
+        return False
+    return any(
+        c["type"] == "Ready" and c["status"] == "True" for c in node.get("status", {}).get("conditions", [])
+    )
+
+
+def capacity_snapshot(kube):
+    """
+    Free cpu(cores) & memory(bytes) across the schedulable nodes & the pending pods per namespace
+    """
+    nodes = {
+        n["metadata"]["name"]: n for n in kube.list_nodes() if _node_is_schedulable(n)
+    }
+    allocatable_cpu = sum(parse_cpu(
+        n["status"]["allocatable"]["cpu"]) for n in nodes.values())
+    allocatable_mem = sum(parse_memory(
+        n["status"]["allocatable"]["memory"]) for n in nodes.values())
+
+    requested_cpu = requested_mem = 0.0
+    pending = {}
+    for pod in kube.list_pods():
+        phase = pod.get("status", {}).get("phase")
+        if phase in TERMINATED_POD_PHASES:
+            continue
+        if phase == "Pending" and not pod["spec"].get("nodeName"):
+            ns = pod["metadata"]["namespace"]
+            pending[ns] = pending.get(ns, 0) + 1
+            continue
+        if pod["spec"].get("nodeName") in nodes:
+            cpu, mem = pod_requests(pod)
+            requested_cpu += cpu
+            requested_mem += mem
+
+    return {
+        "free_cpu": max(0.0, allocatable_cpu - requested_cpu),
+        "free_memory": max(0.0, allocatable_mem - requested_mem),
+        "allocatable_cpu": allocatable_cpu,
+        "allocatable_memory": allocatable_mem,
+        "pending_pods": pending,
+    }
+
+
+def count_active_job_runs(emr_client, virtual_cluster_id):
+    paginator = emr_client.get_paginator("list_job_runs")
+    return sum(
+        len(page["jobRuns"]) for page in paginator.paginate(
+            virtualClusterId=virtual_cluster_id, states=JOB_RUN_ACTIVE_STATES)
+    )
+
+
+def admission_slots(ns_cfg, snapshot, namespace, active_job_runs):
+    """
+    How many more jobs the namespace can start right now.
+
+    Nothing is admitted while the namespace has more unscheduled pods than `max_pending_pods`,
+    those drivers & executors are already waiting for capacity. Otherwise the free capacity is
+    divided by the footprint of a job, bounded by `max_concurrent_jobs`. `min_concurrent_jobs`
+    always get through, so a scaled down cluster(autoscaler) still gets work to scale up for.
+    """
+    if snapshot["pending_pods"].get(namespace, 0) > ns_cfg["max_pending_pods"]:
+        return 0
+    footprint = ns_cfg["job_footprint"]
+    fits = math.floor(min(
+        snapshot["free_cpu"] / footprint["cpu"],
+        snapshot["free_memory"] / footprint["memory"]
+    ))
+    limit = min(ns_cfg["max_concurrent_jobs"], max(
+        ns_cfg["min_concurrent_jobs"], active_job_runs + fits))
+    return max(0, limit - active_job_runs)
+
+
+def load_config(config_path, region_name=None):
+    with open(config_path) as f:
+        cfg = yaml.safe_load(f)
+    namespaces = {}
+    for ns, ns_cfg in cfg.get("namespaces", {}).items():
+        ns_cfg = dict(ns_cfg)
+        if ns_cfg.get("stack_name") and not ns_cfg.get("virtual_cluster_id"):
+            ns_cfg["virtual_cluster_id"], ns_cfg["execution_role_arn"] = get_virtual_cluster_from_stack(
+                ns_cfg["stack_name"], region_name)
+        if not ns_cfg.get("virtual_cluster_id"):
+            raise ValueError(
+                f"Namespace '{ns}' needs a virtual_cluster_id or a stack_name")
+        footprint = {**DEFAULT_JOB_FOOTPRINT, **ns_cfg.get("job_footprint", {})}
+        ns_cfg["job_footprint"] = {
+            "cpu": parse_cpu(footprint["cpu"]),
+            "memory": parse_memory(footprint["memory"]),
+        }
+        ns_cfg.setdefault("max_concurrent_jobs", 10)
+        ns_cfg.setdefault("min_concurrent_jobs", 1)
+        ns_cfg.setdefault("max_pending_pods", 10)
+        namespaces[ns] = ns_cfg
+    cfg["namespaces"] = namespaces
+    return cfg
+
+
+class Governor():
+    def __init__(self, config, queue, emr_client, kube, cw_client=None):
+        self.namespaces = config["namespaces"]
+        self.poll_interval = config.get("poll_interval", 30)
+        self.queue = queue
+        self.emr_client = emr_client
+        self.kube = kube
+        self.cw_client = cw_client
+
+    def _submit(self, namespace, entry):
+        ns_cfg = self.namespaces[namespace]
+        req = {
+            **entry["request"],
+            "virtualClusterId": ns_cfg["virtual_cluster_id"],
+            # Idempotent on retries, a crash after the call but before the bookkeeping does not submit twice
+            "clientToken": entry["client_token"],
+        }
+        if "executionRoleArn" not in req and ns_cfg.get("execution_role_arn"):
+            req["executionRoleArn"] = ns_cfg["execution_role_arn"]
+        return self.emr_client.start_job_run(**req)["id"]
+
+    def tick(self):
+        """
+        Admit what fits for every namespace, returns the number of admitted jobs per namespace
+        """
+        snapshot = capacity_snapshot(self.kube)
+        admitted = {}
+        for ns, ns_cfg in self.namespaces.items():
+            active = count_active_job_runs(
+                self.emr_client, ns_cfg["virtual_cluster_id"])
+            slots = admission_slots(ns_cfg, snapshot, ns, active)
+            admitted[ns] = 0
+            for entry in self.queue.head(ns, slots):
+                try:
+                    job_run_id = self._submit(ns, entry)
+                except ClientError as e:
+                    if e.response["Error"]["Code"] in _PERMANENT_ERRORS:
+                        logger.error(f"Rejected queue entry {entry['id']}: {e}")
+                        self.queue.mark_rejected(entry["id"], str(e))
+                        continue
+                    # Throttling & co, keep the entry & try again on the next tick
+                    logger.warning(f"Could not submit queue entry {entry['id']}: {e}")
+                    break
+                self.queue.mark_admitted(entry["id"], job_run_id)
+                admitted[ns] += 1
+                logger.info(
+                    f"Admitted queue entry {entry['id']} in {ns} as {job_run_id}")
+                # The next namespace sees the capacity this job is about to take
+                snapshot["free_cpu"] -= ns_cfg["job_footprint"]["cpu"]
+                snapshot["free_memory"] -= ns_cfg["job_footprint"]["memory"]
+            logger.info(
+                f"{ns}: {active} active, {slots} slot(s), {admitted[ns]} admitted, "
+                f"{snapshot['pending_pods'].get(ns, 0)} pending pod(s)")
+        self.publish_metrics()
+        return admitted
+
+    def publish_metrics(self):
+        depth = self.queue.depth()
+        for ns in self.namespaces:
+            logger.info(
+                f"{ns}: queue depth {depth.get(ns, 0)}, oldest {self.queue.oldest_wait(ns):.0f}s")
+        if not self.cw_client:
+            return
+        self.cw_client.put_metric_data(
+            Namespace=METRIC_NAMESPACE,
+            MetricData=[
+                {
+                    "MetricName": metric,
+                    "Dimensions": [
+                        {"Name": "Namespace", "Value": ns},
+                        {"Name": "VirtualClusterId",
+                            "Value": ns_cfg["virtual_cluster_id"]},
+                    ],
+                    "Value": value(ns),
+                    "Unit": unit,
+                }
+                for ns, ns_cfg in self.namespaces.items()
+                for metric, value, unit in (
+                    ("QueueDepth", lambda n: depth.get(n, 0), "Count"),
+                    ("OldestQueuedJobAge", self.queue.oldest_wait, "Seconds"),
+                )
+            ]
+        )
+
+    def run(self, once=False):
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                if once:
+                    raise
+                # A flaky API server or endpoint should not take the governor down
+                logger.exception("Governor tick failed")
+            if once:
+                return
+            time.sleep(self.poll_interval)
+
+
+def start_metrics_server(queue, port):
+    """
+    Serve the queue depth in the Prometheus text format on `/metrics`
+    """
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            lines = [
+                "# HELP emr_admission_queue_depth Jobs waiting for admission",
+                "# TYPE emr_admission_queue_depth gauge",
+            ] + [
+                f'emr_admission_queue_depth{{namespace="{ns}"}} {n}' for ns, n in queue.depth().items()
+            ]
+            body = ("\n".join(lines) + "\n").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("0.0.0.0", port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def cmd_enqueue(args, queue):
+    with open(args.request) as f:
+        request = json.load(f)
+    entry_id = queue.enqueue(args.namespace, request, args.priority)
+    logger.info(
+        f"Enqueued {request.get('name', args.request)} in {args.namespace} as entry {entry_id}")
+
+
+def cmd_status(args, queue):
+    for ns, n in sorted(queue.depth().items()):
+        logger.info(f"{ns}: {n} queued, oldest {queue.oldest_wait(ns):.0f}s")
+
+
+def cmd_run(args, queue):
+    config = load_config(args.config, args.region)
+    if args.poll_interval:
+        config["poll_interval"] = args.poll_interval
+    governor = Governor(
+        config,
+        queue,
+        get_emr_client(args.region, args.endpoint_url),
+        KubeApi(args.kube_api_url, token=args.kube_token,
+                ca_bundle=args.kube_ca_bundle),
+        cw_client=boto3.client(
+            "cloudwatch", region_name=args.region) if args.cloudwatch_metrics else None
+    )
+    if args.metrics_port:
+        start_metrics_server(queue, args.metrics_port)
+    governor.run(once=args.once)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Admission queue & concurrency governor for EMR on EKS job runs")
+    parser.add_argument("--config", required=True,
+                        help="Path to the governor yaml")
+    parser.add_argument("--db", default="governor.db",
+                        help="sqlite file holding the queue")
+    parser.add_argument("--log-level", default="INFO")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = sub.add_parser("enqueue", help="Queue a job run")
+    enqueue.add_argument("--namespace", required=True)
+    enqueue.add_argument("--priority", type=int, default=0,
+                         help="Higher is admitted first")
+    enqueue.add_argument("--request", required=True,
+                         help="JSON file with the start-job-run request, as for `--cli-input-json`")
+    enqueue.set_defaults(func=cmd_enqueue)
+
+    status = sub.add_parser("status", help="Show the queue depth")
+    status.set_defaults(func=cmd_status)
+
+    run = sub.add_parser("run", help="Admit queued jobs as capacity allows")
+    run.add_argument("--once", action="store_true",
+                     help="Run a single admission round")
+    run.add_argument("--poll-interval", type=int)
+    run.add_argument("--kube-api-url", default=DEFAULT_API_URL,
+                     help="Kubernetes API, defaults to `kubectl proxy`")
+    run.add_argument("--kube-token")
+    run.add_argument("--kube-ca-bundle")
+    run.add_argument("--region")
+    run.add_argument("--endpoint-url",
+                     help="Override the emr-containers endpoint, for example a local stub")
+    run.add_argument("--cloudwatch-metrics", action="store_true",
+                     help=f"Publish the queue depth to CloudWatch under {METRIC_NAMESPACE}")
+    run.add_argument("--metrics-port", type=int,
+                     help="Serve the queue depth for Prometheus on this port")
+    run.set_defaults(func=cmd_run)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args.func(args, JobQueue(args.db))
+
+
+if __name__ == "__main__":
+    main()
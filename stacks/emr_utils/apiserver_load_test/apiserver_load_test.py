@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Load test of the Kubernetes API server with the executor fan-out of many Spark drivers.
+
+Every simulated driver does what a Spark driver does to the API server: it creates its
+executor pods in batches, keeps a watch on them & polls the full executor pod list. The
+executor pods stay Pending(unschedulable node selector), so thousands of them fit on a
+local `kind` cluster. The drivers run as service accounts of the test namespace, through
+impersonation, & a probe lists pods as the `emr-containers` user(the EMR controller) the
+whole time. The probe latency is reported against the number of executor pods created.
+
+Run it once as is & once with `--flow-control --spark-conf`, which applies the API Priority &
+Fairness manifests of EmrOnEksStack to the namespace & uses the executor batching & polling
+confs of the job templates. With them the probe latency should stay flat as the pod count
+grows, `--max-latency-growth` turns that into a pass/fail check.
+
+Usage:
+    kind create cluster --name apiserver-load
+    kubectl proxy --port 8001 &
+
+    python -m stacks.emr_utils.apiserver_load_test.apiserver_load_test \
+        --drivers 20 --executors-per-driver 200
+    python -m stacks.emr_utils.apiserver_load_test.apiserver_load_test \
+        --drivers 20 --executors-per-driver 200 --flow-control --spark-conf --max-latency-growth 2
+"""
+
+import argparse
+import logging
+import threading
+import time
+
+import requests
+
+from stacks.k8s_utils.kube_api import DEFAULT_API_URL, KubeApi
+from stacks.k8s_utils import flow_control, pod_templates
+
+
+logger = logging.getLogger("apiserver_load_test")
+
+DEFAULT_NAMESPACE = "apiserver-load-test"
+PAUSE_IMAGE = "registry.k8s.io/pause:3.9"
+UNSCHEDULABLE_SELECTOR = {"apiserver-load-test": "unschedulable"}
+
+# Defaults of `org.apache.spark.deploy.k8s.Config` in Spark 3.2(EMR 6.6), what a driver does
+# when the job templates do not set them. The simulated drivers do not model
+# `spark.kubernetes.allocation.maxPendingPods`, unbounded by default.
+SPARK_DEFAULT_CONF = {
+    "spark.kubernetes.allocation.batch.size": "5",
+    "spark.kubernetes.allocation.batch.delay": "1s",
+    "spark.kubernetes.executor.apiPollingInterval": "30s",
+}
+
+
+def parse_duration(d):
+    """
+    Spark time conf to seconds, Ex: "2s" -> 2.0, "500ms" -> 0.5, "1min" -> 60.0
+    """
+    d = str(d).strip()
+    for suffix, scale in (("ms", 0.001), ("min", 60), ("s", 1), ("m", 60), ("h", 3600)):
+        if d.endswith(suffix):
+            return float(d[:-len(suffix)]) * scale
+    return float(d)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def flow_control_api_version(kube):
+    return kube.get(f"/apis/{flow_control.FLOW_CONTROL_API_GROUP}")["preferredVersion"]["groupVersion"]
+
+
+def setup_namespace(kube, namespace):
+    kube.apply({"apiVersion": "v1", "kind": "Namespace",
+                "metadata": {"name": namespace}})
+    # The simulated drivers manage their pods, the probe reads them
+    for name, role, subject in (
+        ("spark-drivers-edit", "edit", {"kind": "Group", "name": f"system:serviceaccounts:{namespace}",
+                                        "apiGroup": "rbac.authorization.k8s.io"}),
+        ("emr-controller-view", "view", {"kind": "User", "name": flow_control.EMR_CONTROLLER_USER,
+                                         "apiGroup": "rbac.authorization.k8s.io"}),
+    ):
+        kube.apply({
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "RoleBinding",
+            "metadata": {"name": name, "namespace": namespace},
+            "subjects": [subject],
+            "roleRef": {"kind": "ClusterRole", "name": role, "apiGroup": "rbac.authorization.k8s.io"}
+        })
+
+
+def executor_pod(namespace, app_id, n):
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {
+            "name": f"{app_id}-exec-{n}",
+            "namespace": namespace,
+            "labels": {"spark-app-selector": app_id, "spark-role": "executor"}
+        },
+        "spec": {
+            "nodeSelector": UNSCHEDULABLE_SELECTOR,
+            "containers": [{
+                "name": "spark-kubernetes-executor",
+                "image": PAUSE_IMAGE,
+                "resources": {"requests": {"cpu": "10m", "memory": "16Mi"}}
+            }]
+        }
+    }
+
+
+class Stats():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pods_created = 0
+        self.driver_errors = 0
+        self.watch_events = 0
+        self.polls = 0
+        # (pods created, seconds or None when throttled)
+        self.probes = []
+
+    def add(self, **counts):
+        with self.lock:
+            for k, v in counts.items():
+                setattr(self, k, getattr(self, k) + v)
+
+
+class SimulatedDriver():
+    def __init__(self, kube, namespace, app_id, executors, spark_conf, stats, stop):
+        self.kube = kube
+        self.namespace = namespace
+        self.app_id = app_id
+        self.executors = executors
+        self.batch_size = int(spark_conf["spark.kubernetes.allocation.batch.size"])
+        self.batch_delay = parse_duration(
+            spark_conf["spark.kubernetes.allocation.batch.delay"])
+        self.polling_interval = parse_duration(
+            spark_conf["spark.kubernetes.executor.apiPollingInterval"])
+        self.stats = stats
+        self.stop = stop
+        self.selector = f"spark-app-selector={app_id},spark-role=executor"
+        self.pods_path = f"/api/v1/namespaces/{namespace}/pods"
+
+    def allocate(self):
+        created = 0
+        while created < self.executors and not self.stop.is_set():
+            for n in range(created, min(created + self.batch_size, self.executors)):
+                try:
+                    self.kube.post(self.pods_path, executor_pod(
+                        self.namespace, self.app_id, n))
+                    self.stats.add(pods_created=1)
+                except requests.RequestException:
+                    self.stats.add(driver_errors=1)
+            created = min(created + self.batch_size, self.executors)
+            self.stop.wait(self.batch_delay)
+
+    def watch(self):
+        while not self.stop.is_set():
+            try:
+                for _ in self.kube.watch(self.pods_path, {"labelSelector": self.selector}, timeout_seconds=30):
+                    self.stats.add(watch_events=1)
+                    if self.stop.is_set():
+                        return
+            except requests.RequestException:
+                self.stats.add(driver_errors=1)
+                self.stop.wait(1)
+
+    def poll(self):
+        while not self.stop.wait(self.polling_interval):
+            try:
+                self.kube.list_pods(self.namespace, label_selector=self.selector)
+                self.stats.add(polls=1)
+            except requests.RequestException:
+                self.stats.add(driver_errors=1)
+
+    def start(self):
+        self.threads = [threading.Thread(target=f, daemon=True)
+                        for f in (self.allocate, self.watch, self.poll)]
+        for t in self.threads:
+            t.start()
+        return self.threads[0]
+
+
+def probe(kube, namespace, interval, stats, stop):
+    path = f"/api/v1/namespaces/{namespace}/pods"
+    while not stop.wait(interval):
+        started = time.monotonic()
+        try:
+            kube.get(path, {"limit": 1})
+            latency = time.monotonic() - started
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 429:
+                logger.warning(f"Probe failed: {e}")
+                continue
+            latency = None
+        with stats.lock:
+            stats.probes.append((stats.pods_created, latency))
+
+
+def flow_control_metrics(kube, priority_levels):
+    """
+    APF counters of the priority levels of the namespace, from the API server metrics
+    """
+    resp = kube.session.get(f"{kube.api_url}/metrics", timeout=kube.timeout)
+    resp.raise_for_status()
+    metrics = {}
+    for line in resp.text.splitlines():
+        if not line.startswith(("apiserver_flowcontrol_rejected_requests_total", "apiserver_flowcontrol_dispatched_requests_total")):
+            continue
+        name, _, value = line.rpartition(" ")
+        if any(f'priority_level="{p}"' in name for p in priority_levels):
+            metrics[name] = float(value)
+    return metrics
+
+
+def latency_report(probes, buckets):
+    """
+    Probe latency percentiles per range of created pods
+    """
+    if not probes:
+        return []
+    size = max(1, -(-len(probes) // buckets))
+    rows = []
+    for i in range(0, len(probes), size):
+        chunk = probes[i:i + size]
+        latencies = [l for _, l in chunk if l is not None]
+        rows.append({
+            "pods": (chunk[0][0], chunk[-1][0]),
+            "samples": len(chunk),
+            "throttled": len(chunk) - len(latencies),
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+        })
+    return rows
+
+
+def _ms(v):
+    return f"{v * 1000:.0f}ms" if v is not None else "-"
+
+
+def run(args):
+    admin = KubeApi(args.kube_api_url, args.kube_token, args.kube_ca_bundle)
+    ns = args.namespace
+    setup_namespace(admin, ns)
+
+    flow_control_manifests = []
+    if args.flow_control:
+        flow_control_manifests = flow_control.namespace_flow_control_manifests(
+            ns, api_version=flow_control_api_version(admin))
+        for m in flow_control_manifests:
+            admin.apply(m)
+        logger.info(
+            f"Applied {len(flow_control_manifests)} flow control objects for {ns}")
+
+    spark_conf = dict(SPARK_DEFAULT_CONF)
+    if args.spark_conf:
+        spark_conf.update(pod_templates.kube_api_spark_conf())
+    logger.info(f"Drivers use {spark_conf}")
+
+    stats = Stats()
+    stop = threading.Event()
+    probe_kube = KubeApi(args.kube_api_url, args.kube_token, args.kube_ca_bundle,
+                         impersonate=flow_control.EMR_CONTROLLER_USER)
+    probe_thread = threading.Thread(
+        target=probe, args=(probe_kube, ns, args.probe_interval, stats, stop), daemon=True)
+    probe_thread.start()
+
+    allocators = []
+    for i in range(args.drivers):
+        kube = KubeApi(args.kube_api_url, args.kube_token, args.kube_ca_bundle,
+                       impersonate=f"system:serviceaccount:{ns}:spark-driver-{i}")
+        allocators.append(SimulatedDriver(
+            kube, ns, f"load-{i}", args.executors_per_driver, spark_conf, stats, stop).start())
+
+    started = time.monotonic()
+    try:
+        for t in allocators:
+            t.join()
+        logger.info(
+            f"Created {stats.pods_created} executor pods in {time.monotonic() - started:.0f}s, holding the watches for {args.hold}s")
+        stop.wait(args.hold)
+    finally:
+        stop.set()
+        probe_thread.join(args.probe_interval + admin.timeout)
+
+    rows = latency_report(stats.probes, args.buckets)
+    for row in rows:
+        logger.info(
+            f"pods {row['pods'][0]:>6}-{row['pods'][1]:<6} probes {row['samples']:>4} "
+            f"p50 {_ms(row['p50']):>7} p99 {_ms(row['p99']):>7} throttled {row['throttled']}")
+    logger.info(
+        f"watch events {stats.watch_events}, pod list polls {stats.polls}, driver errors {stats.driver_errors}")
+    if flow_control_manifests:
+        levels = [m["metadata"]["name"] for m in flow_control_manifests
+                  if m["kind"] == "PriorityLevelConfiguration"]
+        for name, value in sorted(flow_control_metrics(admin, levels).items()):
+            logger.info(f"{name} {value:g}")
+
+    if not args.keep:
+        admin.delete(f"/api/v1/namespaces/{ns}")
+        for m in flow_control_manifests:
+            admin.delete(
+                f"{admin.resource_path(m)}/{m['metadata']['name']}")
+
+    if args.max_latency_growth and len(rows) > 1:
+        # Every probe of the range got a 429, the controller could not list pods at all
+        throttled = [r for r in (rows[0], rows[-1]) if r["p99"] is None]
+        if throttled:
+            raise SystemExit(
+                f"All {throttled[0]['samples']} probes of pods {throttled[0]['pods'][0]}-{throttled[0]['pods'][1]} "
+                f"were throttled, no latency to compare")
+        growth = rows[-1]["p99"] / rows[0]["p99"]
+        logger.info(f"p99 probe latency grew {growth:.1f}x")
+        if growth > args.max_latency_growth:
+            raise SystemExit(
+                f"p99 probe latency grew {growth:.1f}x, over the {args.max_latency_growth}x limit")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Load the API server with the executor pods of many simulated Spark drivers")
+    parser.add_argument("--namespace", default=DEFAULT_NAMESPACE)
+    parser.add_argument("--drivers", type=int, default=10)
+    parser.add_argument("--executors-per-driver", type=int, default=200)
+    parser.add_argument("--hold", type=int, default=60,
+                        help="Seconds to keep the watches & polls running once all the pods are created")
+    parser.add_argument("--probe-interval", type=float, default=0.5)
+    parser.add_argument("--buckets", type=int, default=5,
+                        help="Pod count ranges to report the probe latency for")
+    parser.add_argument("--flow-control", action="store_true",
+                        help="Apply the API Priority & Fairness manifests of the EMR namespaces")
+    parser.add_argument("--spark-conf", action="store_true",
+                        help="Use the executor batching & polling confs of the job templates")
+    parser.add_argument("--max-latency-growth", type=float,
+                        help="Fail when the p99 probe latency of the last pod range is more than this times the first, "
+                             "or when every probe of either range was throttled")
+    parser.add_argument("--keep", action="store_true",
+                        help="Keep the namespace & flow control objects")
+    parser.add_argument("--kube-api-url", default=DEFAULT_API_URL,
+                        help="Kubernetes API, defaults to `kubectl proxy`")
+    parser.add_argument("--kube-token")
+    parser.add_argument("--kube-ca-bundle")
+    parser.add_argument("--log-level", default="INFO")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Run the same Spark job on x86_64 & Graviton(arm64) nodes and compare them.
+
+Both runs use the architecture pinned job templates uploaded by EmrOnEksStack when the
+cluster has a Graviton node group(`-c graviton_nodes=2`). The report has the duration of
+each run and the price/performance, using the hourly node prices given on the command line.
+
+Usage:
+    python -m stacks.emr_utils.benchmark.arch_benchmark_pair \
+        --stack-name emr-on-eks-stack11 \
+        --job-templates-prefix s3://<artifacts-bkt>/tenants/red-shirts/emr-on-eks/spark-ns/job_templates
+"""
+
+import argparse
+import logging
+import time
+
+from stacks.emr_utils.emr_job_client import (
+    JOB_RUN_TERMINAL_STATES,
+    build_start_job_run_request,
+    get_emr_client,
+    get_virtual_cluster_from_stack,
+    job_run_duration,
+    load_job_template,
+)
+
+
+logger = logging.getLogger("arch_benchmark_pair")
+
+# Graviton images for EMR on EKS are available from EMR 6.6.0
+DEFAULT_RELEASE_LABEL = "emr-6.6.0-latest"
+DEFAULT_ENTRY_POINT = "local:///usr/lib/spark/examples/src/main/python/pi.py"
+
+# On-demand us-east-1 hourly prices of the default node group instance types
+DEFAULT_NODE_PRICES = {
+    "amd64": 0.192,  # m5.xlarge
+    "arm64": 0.154,  # m6g.xlarge
+}
+
+ARCHS = ["amd64", "arm64"]
+
+
+def wait_for_job_runs(emr_client, virtual_cluster_id, job_run_ids, poll_interval):
+    job_runs = {}
+    while len(job_runs) < len(job_run_ids):
+        for arch, job_run_id in job_run_ids.items():
+            if arch in job_runs:
+                continue
+            job_run = emr_client.describe_job_run(
+                id=job_run_id, virtualClusterId=virtual_cluster_id)["jobRun"]
+            if job_run["state"] in JOB_RUN_TERMINAL_STATES:
+                logger.info(f"{arch} job run {job_run_id} {job_run['state']}")
+                job_runs[arch] = job_run
+        if len(job_runs) < len(job_run_ids):
+            time.sleep(poll_interval)
+    return job_runs
+
+
+def run_pair(args, emr_client, virtual_cluster_id, execution_role_arn):
+    job_run_ids = {}
+    # Submit both at the same time, so they see the same cluster & S3 conditions
+    for arch in ARCHS:
+        job_template = load_job_template(
+            f"{args.job_templates_prefix.rstrip('/')}/{arch}.json")
+        req = build_start_job_run_request(
+            virtual_cluster_id=virtual_cluster_id,
+            execution_role_arn=execution_role_arn,
+            release_label=args.release_label or job_template.get(
+                "releaseLabel", DEFAULT_RELEASE_LABEL),
+            name=f"arch-benchmark-{arch}",
+            entry_point=args.entry_point,
+            entry_point_arguments=args.entry_point_arguments,
+            spark_submit_parameters=args.spark_submit_parameters,
+            configuration_overrides=job_template["configurationOverrides"],
+            tags={"benchmark": "arch_pair", "arch": arch}
+        )
+        job_run_ids[arch] = emr_client.start_job_run(**req)["id"]
+        logger.info(f"Submitted {arch} job run {job_run_ids[arch]}")
+
+    return wait_for_job_runs(emr_client, virtual_cluster_id, job_run_ids, args.poll_interval)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare a Spark job on x86_64 & Graviton nodes")
+    parser.add_argument("--stack-name")
+    parser.add_argument("--virtual-cluster-id")
+    parser.add_argument("--execution-role-arn")
+    parser.add_argument("--job-templates-prefix", required=True,
+                        help="s3:// uri or local dir holding the amd64.json & arm64.json job templates")
+    # Defaults to the release pinned by the job template, then DEFAULT_RELEASE_LABEL
+    parser.add_argument("--release-label")
+    parser.add_argument("--entry-point", default=DEFAULT_ENTRY_POINT)
+    parser.add_argument("--entry-point-arguments", nargs="*", default=["1000"])
+    parser.add_argument("--spark-submit-parameters",
+                        default="--conf spark.executor.instances=2 --conf spark.executor.memory=4G --conf spark.executor.cores=2 --conf spark.driver.cores=1")
+    parser.add_argument("--amd64-price", type=float,
+                        default=DEFAULT_NODE_PRICES["amd64"], help="Hourly price of a x86_64 node")
+    parser.add_argument("--arm64-price", type=float,
+                        default=DEFAULT_NODE_PRICES["arm64"], help="Hourly price of a Graviton node")
+    parser.add_argument("--runs", type=int, default=1,
+                        help="Number of job pairs to run one after the other")
+    parser.add_argument("--region")
+    parser.add_argument("--endpoint-url")
+    parser.add_argument("--poll-interval", type=int, default=15)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level="INFO", format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    virtual_cluster_id, execution_role_arn = args.virtual_cluster_id, args.execution_role_arn
+    if args.stack_name:
+        virtual_cluster_id, execution_role_arn = get_virtual_cluster_from_stack(
+            args.stack_name, args.region)
+    emr_client = get_emr_client(args.region, args.endpoint_url)
+    prices = {"amd64": args.amd64_price, "arm64": args.arm64_price}
+
+    durations = {arch: [] for arch in ARCHS}
+    for i in range(args.runs):
+        job_runs = run_pair(args, emr_client,
+                            virtual_cluster_id, execution_role_arn)
+        for arch, job_run in job_runs.items():
+            if job_run["state"] != "COMPLETED":
+                raise SystemExit(
+                    f"{arch} job run {job_run['id']} ended as {job_run['state']}")
+            durations[arch].append(job_run_duration(job_run))
+
+    avg = {arch: sum(d) / len(d) for arch, d in durations.items()}
+    # Cost of the node time used by the job, lower is better
+    cost = {arch: avg[arch] / 3600 * prices[arch] for arch in ARCHS}
+    for arch in ARCHS:
+        logger.info(
+            f"{arch}: avg {avg[arch]:.0f}s over {args.runs} run(s), ~${cost[arch]:.5f} node time")
+    logger.info(f"arm64 speedup: {avg['amd64'] / avg['arm64']:.2f}x")
+    logger.info(
+        f"arm64 price/performance gain: {(1 - cost['arm64'] / cost['amd64']) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
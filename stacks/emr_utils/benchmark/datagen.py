@@ -0,0 +1,131 @@
+"""
+PySpark data generator for the benchmark suite.
+
+Writes a TPC-DS style star schema(store_sales fact & date/item/customer/store dimensions)
+as parquet. Scale factor 1 is ~1 GB of raw sales rows, data is deterministic for a given
+scale factor so the runs are comparable.
+
+Usage:
+    spark-submit datagen.py --scale-factor 1 --output s3://<bkt>/<prefix>/benchmark/data/sf1
+"""
+
+import argparse
+
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+
+# Rows at scale factor 1
+BASE_ROWS = {
+    "store_sales": 10_000_000,
+    "customer": 500_000,
+    "item": 50_000,
+    "store": 100,
+}
+DATE_DIM_DAYS = 365 * 5
+DATE_DIM_START = "2017-01-01"
+
+CATEGORIES = ["Books", "Electronics", "Home", "Jewelry", "Men", "Music", "Shoes", "Sports", "Toys", "Women"]
+STATES = ["CA", "FL", "GA", "IL", "NY", "OH", "TN", "TX", "VA", "WA"]
+
+
+def _rand_int(col_name, seed, modulo):
+    # Deterministic pseudo random int in [0, modulo)
+    return F.pmod(F.xxhash64(F.col(col_name), F.lit(seed)), F.lit(modulo))
+
+
+def _pick(values, col_name, seed):
+    return F.element_at(F.array(*[F.lit(v) for v in values]), (_rand_int(col_name, seed, len(values)) + 1).cast("int"))
+
+
+def gen_date_dim(spark):
+    return (
+        spark.range(DATE_DIM_DAYS)
+        .withColumnRenamed("id", "d_date_sk")
+        .withColumn("d_date", F.date_add(F.lit(DATE_DIM_START).cast("date"), F.col("d_date_sk").cast("int")))
+        .withColumn("d_year", F.year("d_date"))
+        .withColumn("d_moy", F.month("d_date"))
+        .withColumn("d_dow", F.dayofweek("d_date"))
+    )
+
+
+def gen_item(spark, rows):
+    return (
+        spark.range(rows)
+        .withColumnRenamed("id", "i_item_sk")
+        .withColumn("i_category", _pick(CATEGORIES, "i_item_sk", 1))
+        .withColumn("i_brand_id", _rand_int("i_item_sk", 2, 1000))
+        .withColumn("i_brand", F.concat(F.lit("brand#"), F.col("i_brand_id")))
+        .withColumn("i_current_price", (_rand_int("i_item_sk", 3, 10000) / 100).cast("decimal(7,2)"))
+    )
+
+
+def gen_customer(spark, rows):
+    return (
+        spark.range(rows)
+        .withColumnRenamed("id", "c_customer_sk")
+        .withColumn("c_name", F.concat(F.lit("customer#"), F.col("c_customer_sk")))
+        .withColumn("c_state", _pick(STATES, "c_customer_sk", 4))
+        .withColumn("c_birth_year", (_rand_int("c_customer_sk", 5, 60) + 1940).cast("int"))
+    )
+
+
+def gen_store(spark, rows):
+    return (
+        spark.range(rows)
+        .withColumnRenamed("id", "s_store_sk")
+        .withColumn("s_store_name", F.concat(F.lit("store#"), F.col("s_store_sk")))
+        .withColumn("s_state", _pick(STATES, "s_store_sk", 6))
+    )
+
+
+def gen_store_sales(spark, rows, n_items, n_customers, n_stores):
+    return (
+        spark.range(rows)
+        .withColumnRenamed("id", "ss_ticket_number")
+        .withColumn("ss_sold_date_sk", _rand_int("ss_ticket_number", 7, DATE_DIM_DAYS))
+        .withColumn("ss_item_sk", _rand_int("ss_ticket_number", 8, n_items))
+        # Skewed customers, the first 1% make a big share of the sales
+        .withColumn(
+            "ss_customer_sk",
+            F.when(_rand_int("ss_ticket_number", 9, 10) < 3, _rand_int("ss_ticket_number", 10, max(n_customers // 100, 1)))
+            .otherwise(_rand_int("ss_ticket_number", 11, n_customers))
+        )
+        .withColumn("ss_store_sk", _rand_int("ss_ticket_number", 12, n_stores))
+        .withColumn("ss_quantity", (_rand_int("ss_ticket_number", 13, 100) + 1).cast("int"))
+        .withColumn("ss_sales_price", (_rand_int("ss_ticket_number", 14, 20000) / 100).cast("decimal(7,2)"))
+        .withColumn("ss_net_profit", ((_rand_int("ss_ticket_number", 15, 10000) - 2000) / 100).cast("decimal(7,2)"))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the benchmark tables")
+    parser.add_argument("--scale-factor", type=float, default=1)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--partitions", type=int, default=0,
+                        help="Output files of the fact table, defaults to 1 per ~128MB")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.appName(f"benchmark-datagen-sf{args.scale_factor}").getOrCreate()
+
+    rows = {t: max(int(n * args.scale_factor), 1) for t, n in BASE_ROWS.items()}
+    fact_partitions = args.partitions or max(int(8 * args.scale_factor), 1)
+
+    tables = {
+        "date_dim": gen_date_dim(spark).coalesce(1),
+        "item": gen_item(spark, rows["item"]).coalesce(1),
+        "customer": gen_customer(spark, rows["customer"]).coalesce(max(int(args.scale_factor), 1)),
+        "store": gen_store(spark, rows["store"]).coalesce(1),
+        "store_sales": gen_store_sales(
+            spark, rows["store_sales"], rows["item"], rows["customer"], rows["store"]
+        ).repartition(fact_partitions),
+    }
+    for name, df in tables.items():
+        df.write.mode("overwrite").parquet(f"{args.output.rstrip('/')}/{name}")
+        print(f"Wrote {name}")
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
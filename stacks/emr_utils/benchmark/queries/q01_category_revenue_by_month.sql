@@ -0,0 +1,7 @@
+-- Scan & aggregate: monthly revenue per category, small dimension broadcast joins
+SELECT d.d_year, d.d_moy, i.i_category, SUM(ss.ss_sales_price * ss.ss_quantity) AS revenue
+FROM store_sales ss
+JOIN date_dim d ON ss.ss_sold_date_sk = d.d_date_sk
+JOIN item i ON ss.ss_item_sk = i.i_item_sk
+GROUP BY d.d_year, d.d_moy, i.i_category
+ORDER BY d.d_year, d.d_moy, revenue DESC
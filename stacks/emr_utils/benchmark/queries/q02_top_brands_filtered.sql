@@ -0,0 +1,9 @@
+-- Selective filter with predicate pushdown into parquet, then top-N
+SELECT i.i_brand, i.i_category, SUM(ss.ss_net_profit) AS profit
+FROM store_sales ss
+JOIN date_dim d ON ss.ss_sold_date_sk = d.d_date_sk
+JOIN item i ON ss.ss_item_sk = i.i_item_sk
+WHERE d.d_year = 2019 AND d.d_moy IN (11, 12) AND i.i_category IN ('Electronics', 'Toys')
+GROUP BY i.i_brand, i.i_category
+ORDER BY profit DESC
+LIMIT 100
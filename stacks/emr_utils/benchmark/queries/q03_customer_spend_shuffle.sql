@@ -0,0 +1,6 @@
+-- Wide shuffle on a skewed key: spend per customer joined with the customer dimension
+SELECT c.c_state, c.c_customer_sk, c.c_name, SUM(ss.ss_sales_price * ss.ss_quantity) AS spend, COUNT(*) AS tickets
+FROM store_sales ss
+JOIN customer c ON ss.ss_customer_sk = c.c_customer_sk
+GROUP BY c.c_state, c.c_customer_sk, c.c_name
+HAVING COUNT(*) > 5
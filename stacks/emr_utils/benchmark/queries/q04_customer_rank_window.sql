@@ -0,0 +1,9 @@
+-- Window function over a shuffled & sorted dataset: top customers per state
+SELECT * FROM (
+    SELECT c.c_state, ss.ss_customer_sk, SUM(ss.ss_net_profit) AS profit,
+           RANK() OVER (PARTITION BY c.c_state ORDER BY SUM(ss.ss_net_profit) DESC) AS rnk
+    FROM store_sales ss
+    JOIN customer c ON ss.ss_customer_sk = c.c_customer_sk
+    GROUP BY c.c_state, ss.ss_customer_sk
+) ranked
+WHERE rnk <= 10
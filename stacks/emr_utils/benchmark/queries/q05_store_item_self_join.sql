@@ -0,0 +1,7 @@
+-- Large fact to fact join(sort merge join): items sold in more than one state on the same day
+SELECT a.ss_item_sk, a.ss_sold_date_sk, COUNT(DISTINCT sa.s_state) AS states
+FROM store_sales a
+JOIN store sa ON a.ss_store_sk = sa.s_store_sk
+JOIN store_sales b ON a.ss_item_sk = b.ss_item_sk AND a.ss_sold_date_sk = b.ss_sold_date_sk AND a.ss_ticket_number < b.ss_ticket_number
+GROUP BY a.ss_item_sk, a.ss_sold_date_sk
+HAVING COUNT(DISTINCT sa.s_state) > 1
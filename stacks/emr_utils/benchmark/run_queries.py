@@ -0,0 +1,82 @@
+"""
+PySpark runner for the benchmark queries.
+
+Registers the generated tables as views, runs every `.sql` file from the queries
+location(local dir or s3 prefix) and writes the per query timings as json lines.
+The query results are not materialized, the `noop` sink forces the full execution.
+
+Usage:
+    spark-submit run_queries.py --data s3://<bkt>/.../data/sf1 --queries s3://<bkt>/.../queries \
+        --results s3://<bkt>/.../results/<run_id>
+"""
+
+import argparse
+import json
+import os
+import time
+
+from pyspark.sql import SparkSession
+
+
+TABLES = ["date_dim", "item", "customer", "store", "store_sales"]
+
+
+def load_queries(spark, queries_uri):
+    # wholeTextFiles reads from local paths & s3 alike
+    files = spark.sparkContext.wholeTextFiles(f"{queries_uri.rstrip('/')}/*.sql").collect()
+    return sorted((os.path.basename(path)[:-len(".sql")], sql) for path, sql in files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark queries")
+    parser.add_argument("--data", required=True)
+    parser.add_argument("--queries", required=True)
+    parser.add_argument("--results", required=True)
+    parser.add_argument("--iterations", type=int, default=1)
+    parser.add_argument("--run-id", default=time.strftime("%Y%m%dT%H%M%S"))
+    parser.add_argument("--only", nargs="*", help="Only run these queries")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.appName(f"benchmark-queries-{args.run_id}").getOrCreate()
+
+    for t in TABLES:
+        spark.read.parquet(f"{args.data.rstrip('/')}/{t}").createOrReplaceTempView(t)
+
+    timings = []
+    for name, sql in load_queries(spark, args.queries):
+        if args.only and name not in args.only:
+            continue
+        for i in range(args.iterations):
+            spark.sparkContext.setJobDescription(f"{name} #{i}")
+            start = time.time()
+            status = "OK"
+            try:
+                spark.sql(sql).write.format("noop").mode("overwrite").save()
+            except Exception as e:
+                status = f"FAILED: {str(e)[:500]}"
+            elapsed = time.time() - start
+            print(f"{name} iteration {i}: {elapsed:.2f}s {status}")
+            timings.append({
+                "run_id": args.run_id,
+                "query": name,
+                "iteration": i,
+                "seconds": round(elapsed, 3),
+                "status": status,
+                "data": args.data,
+                "spark_version": spark.version,
+                "executor_instances": spark.conf.get("spark.executor.instances", None),
+                "executor_cores": spark.conf.get("spark.executor.cores", None),
+                "executor_memory": spark.conf.get("spark.executor.memory", None),
+            })
+
+    (
+        spark.createDataFrame([json.dumps(t) for t in timings], "string")
+        .coalesce(1)
+        .write.mode("overwrite")
+        .text(f"{args.results.rstrip('/')}/{args.run_id}")
+    )
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Run the benchmark suite on the EMR virtual cluster, or locally for smoke runs.
+
+EMR mode uploads the generator, the runner & the queries under the tenant prefix of the
+artifacts bucket, generates the data for the scale factor(unless it is already there),
+runs the queries & prints the per query timings recorded in the bucket.
+
+Usage:
+    python -m stacks.emr_utils.benchmark.submit_benchmark \
+        --stack-name emr-on-eks-stack11 \
+        --artifacts-prefix s3://<artifacts-bkt>/tenants/red-shirts/ \
+        --scale-factor 10
+
+    # Small local smoke run, needs `spark-submit` on the PATH
+    python -m stacks.emr_utils.benchmark.submit_benchmark --local --scale-factor 0.01
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import subprocess
+import time
+
+import boto3
+
+from stacks.emr_utils.emr_job_client import (
+    JOB_RUN_TERMINAL_STATES,
+    build_start_job_run_request,
+    get_emr_client,
+    get_virtual_cluster_from_stack,
+    job_run_duration,
+    load_job_template,
+)
+
+
+logger = logging.getLogger("submit_benchmark")
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+QUERIES_DIR = os.path.join(BENCHMARK_DIR, "queries")
+SCRIPTS = ["datagen.py", "run_queries.py"]
+
+DEFAULT_RELEASE_LABEL = "emr-6.2.0-latest"
+DEFAULT_SPARK_SUBMIT_PARAMETERS = "--conf spark.executor.instances=4 --conf spark.executor.memory=4G --conf spark.executor.cores=2 --conf spark.driver.cores=1"
+
+
+def _split_s3_uri(uri):
+    bkt, _, key = uri[len("s3://"):].partition("/")
+    return bkt, key
+
+
+def upload_code(s3_client, code_uri):
+    bkt, prefix = _split_s3_uri(code_uri)
+    for f in SCRIPTS:
+        s3_client.upload_file(os.path.join(BENCHMARK_DIR, f),
+                              bkt, f"{prefix}{f}")
+    for f in glob.glob(os.path.join(QUERIES_DIR, "*.sql")):
+        s3_client.upload_file(
+            f, bkt, f"{prefix}queries/{os.path.basename(f)}")
+
+
+def s3_prefix_exists(s3_client, uri):
+    bkt, prefix = _split_s3_uri(uri)
+    return s3_client.list_objects_v2(Bucket=bkt, Prefix=prefix, MaxKeys=1).get("KeyCount", 0) > 0
+
+
+def read_s3_results(s3_client, results_uri):
+    bkt, prefix = _split_s3_uri(results_uri)
+    rows = []
+    for obj in s3_client.list_objects_v2(Bucket=bkt, Prefix=prefix).get("Contents", []):
+        if os.path.basename(obj["Key"]).startswith("part-"):
+            body = s3_client.get_object(Bucket=bkt, Key=obj["Key"])[
+                "Body"].read().decode("utf-8")
+            rows.extend(json.loads(l) for l in body.splitlines() if l)
+    return rows
+
+
+def read_local_results(results_dir):
+    rows = []
+    for f in glob.glob(os.path.join(results_dir, "part-*")):
+        with open(f) as fp:
+            rows.extend(json.loads(l) for l in fp if l.strip())
+    return rows
+
+
+def print_results(rows):
+    for r in sorted(rows, key=lambda r: (r["query"], r["iteration"])):
+        logger.info(
+            f"  {r['query']:<40} #{r['iteration']} {r['seconds']:>10.2f}s {r['status']}")
+    ok = [r["seconds"] for r in rows if r["status"] == "OK"]
+    logger.info(f"Total query time: {sum(ok):.2f}s, {len(rows) - len(ok)} failed")
+
+
+def run_job(emr_client, base_req, name, entry_point, entry_point_arguments, poll_interval):
+    req = build_start_job_run_request(
+        name=name,
+        entry_point=entry_point,
+        entry_point_arguments=entry_point_arguments,
+        tags={"benchmark": "suite"},
+        **base_req
+    )
+    job_run_id = emr_client.start_job_run(**req)["id"]
+    logger.info(f"Submitted {name} as {job_run_id}")
+    while True:
+        job_run = emr_client.describe_job_run(
+            id=job_run_id, virtualClusterId=base_req["virtual_cluster_id"])["jobRun"]
+        if job_run["state"] in JOB_RUN_TERMINAL_STATES:
+            break
+        time.sleep(poll_interval)
+    if job_run["state"] != "COMPLETED":
+        raise SystemExit(
+            f"{name} job run {job_run_id} ended as {job_run['state']}: {job_run.get('stateDetails', '')}")
+    logger.info(f"{name} completed in {job_run_duration(job_run):.0f}s")
+
+
+def run_on_emr(args):
+    if not args.artifacts_prefix or not args.artifacts_prefix.startswith("s3://"):
+        raise SystemExit("--artifacts-prefix s3://<bkt>/<prefix>/ is required")
+    virtual_cluster_id, execution_role_arn = args.virtual_cluster_id, args.execution_role_arn
+    if args.stack_name:
+        virtual_cluster_id, execution_role_arn = get_virtual_cluster_from_stack(
+            args.stack_name, args.region)
+
+    s3_client = boto3.client("s3", region_name=args.region)
+    emr_client = get_emr_client(args.region, args.endpoint_url)
+
+    base_uri = f"{args.artifacts_prefix.rstrip('/')}/benchmark"
+    code_uri = f"{base_uri}/code/"
+    data_uri = f"{base_uri}/data/sf{args.scale_factor:g}"
+    results_uri = f"{base_uri}/results"
+
+    upload_code(s3_client, code_uri)
+
+    job_template = load_job_template(
+        args.job_template) if args.job_template else {}
+    base_req = {
+        "virtual_cluster_id": virtual_cluster_id,
+        "execution_role_arn": execution_role_arn,
+        "release_label": args.release_label or job_template.get("releaseLabel", DEFAULT_RELEASE_LABEL),
+        "spark_submit_parameters": args.spark_submit_parameters,
+        "configuration_overrides": job_template.get("configurationOverrides"),
+    }
+
+    if args.regenerate or not s3_prefix_exists(s3_client, f"{data_uri}/store_sales/"):
+        run_job(emr_client, base_req, f"benchmark-datagen-sf{args.scale_factor:g}",
+                f"{code_uri}datagen.py",
+                ["--scale-factor", str(args.scale_factor),
+                 "--output", data_uri],
+                args.poll_interval)
+
+    run_job(emr_client, base_req, f"benchmark-queries-{args.run_id}",
+            f"{code_uri}run_queries.py",
+            ["--data", data_uri, "--queries", f"{code_uri}queries",
+             "--results", results_uri, "--run-id", args.run_id,
+             "--iterations", str(args.iterations)],
+            args.poll_interval)
+
+    logger.info(f"Results in {results_uri}/{args.run_id}")
+    print_results(read_s3_results(s3_client, f"{results_uri}/{args.run_id}/"))
+
+
+def run_locally(args):
+    base_dir = os.path.abspath(args.local_dir)
+    data_dir = os.path.join(base_dir, f"data/sf{args.scale_factor:g}")
+    results_dir = os.path.join(base_dir, "results")
+    spark_submit = [args.spark_submit, "--master", "local[*]"]
+
+    if args.regenerate or not os.path.isdir(os.path.join(data_dir, "store_sales")):
+        subprocess.run(spark_submit + [
+            os.path.join(BENCHMARK_DIR, "datagen.py"),
+            "--scale-factor", str(args.scale_factor),
+            "--output", data_dir
+        ], check=True)
+
+    subprocess.run(spark_submit + [
+        os.path.join(BENCHMARK_DIR, "run_queries.py"),
+        "--data", data_dir,
+        "--queries", QUERIES_DIR,
+        "--results", results_dir,
+        "--run-id", args.run_id,
+        "--iterations", str(args.iterations)
+    ], check=True)
+
+    print_results(read_local_results(os.path.join(results_dir, args.run_id)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the Spark benchmark suite")
+    parser.add_argument("--local", action="store_true",
+                        help="Run with a local spark-submit instead of the virtual cluster")
+    parser.add_argument("--local-dir", default="benchmark_out")
+    parser.add_argument("--spark-submit", default="spark-submit")
+    parser.add_argument("--stack-name")
+    parser.add_argument("--virtual-cluster-id")
+    parser.add_argument("--execution-role-arn")
+    parser.add_argument("--artifacts-prefix",
+                        help="s3:// prefix the execution role can write to, Ex: the tenant prefix")
+    parser.add_argument("--job-template",
+                        help="Job template with the configuration overrides to use, s3:// uri or local path")
+    # Defaults to the release pinned by the job template, then DEFAULT_RELEASE_LABEL
+    parser.add_argument("--release-label")
+    parser.add_argument("--spark-submit-parameters",
+                        default=DEFAULT_SPARK_SUBMIT_PARAMETERS)
+    parser.add_argument("--scale-factor", type=float, default=1)
+    parser.add_argument("--regenerate", action="store_true",
+                        help="Generate the data even if it already exists")
+    parser.add_argument("--iterations", type=int, default=1)
+    parser.add_argument("--run-id", default=time.strftime("%Y%m%dT%H%M%S"))
+    parser.add_argument("--region")
+    parser.add_argument("--endpoint-url")
+    parser.add_argument("--poll-interval", type=int, default=15)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level="INFO", format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.local:
+        run_locally(args)
+    else:
+        run_on_emr(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Cost & utilisation of the EMR on EKS job runs, per tenant and per job.
+
+`collect` is meant to run every few minutes(cron, CronJob). Each run samples the Spark pods
+of the namespace: requests from the Kubernetes API, usage from the metrics server & the
+instance type/capacity type of their node. The time since the previous sample is added to
+the pod totals & to the daily tenant rollups, so a report over months of history only reads
+the rollups. The job runs are synced from emr-containers from the last watermark on.
+
+The tenant of a pod is the `team` label of its namespace(set by EmrOnEksStack). The cost of a
+pod is its share of the node, by its cpu or memory requests whichever is larger, times the
+hourly node price from `node_prices.yaml`. Nodes without the `eks.amazonaws.com/capacityType`
+label(self managed) have no known price & are counted as free, with a warning.
+
+Usage:
+    kubectl proxy --port 8001 &
+
+    python -m stacks.emr_utils.cost_report.cost_report collect \
+        --namespace spark-ns --stack-name emr-on-eks-stack11
+
+    python -m stacks.emr_utils.cost_report.cost_report report --since 2026-10-01
+    python -m stacks.emr_utils.cost_report.cost_report jobs --since 2026-10-01
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import sqlite3
+import time
+
+import yaml
+
+from stacks.emr_utils.emr_job_client import (
+    JOB_RUN_TERMINAL_STATES,
+    get_emr_client,
+    get_virtual_cluster_from_stack,
+)
+from stacks.k8s_utils.kube_api import (
+    DEFAULT_API_URL,
+    TERMINATED_POD_PHASES,
+    KubeApi,
+    parse_cpu,
+    parse_memory,
+    pod_requests,
+)
+
+
+logger = logging.getLogger("cost_report")
+
+PRICES_FILE = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "node_prices.yaml")
+
+# Labels EMR on EKS puts on the Spark pods
+JOB_ID_LABEL = "emr-containers.amazonaws.com/job.id"
+SPARK_ROLE_LABEL = "spark-role"
+
+GIB = 2 ** 30
+UNKNOWN_TENANT = "unknown"
+
+# Executors using less than this share of what they requested are flagged as over-provisioned
+DEFAULT_EFFICIENCY_THRESHOLD = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_runs (
+    id TEXT PRIMARY KEY,
+    virtual_cluster_id TEXT,
+    name TEXT,
+    state TEXT,
+    created_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS pods (
+    uid TEXT PRIMARY KEY,
+    name TEXT,
+    namespace TEXT,
+    tenant TEXT,
+    job_id TEXT,
+    spark_role TEXT,
+    node TEXT,
+    instance_type TEXT,
+    capacity_type TEXT,
+    req_cpu REAL,
+    req_mem_gib REAL,
+    first_seen REAL,
+    last_seen REAL,
+    req_cpu_s REAL DEFAULT 0,
+    req_mem_gib_s REAL DEFAULT 0,
+    used_cpu_s REAL DEFAULT 0,
+    used_mem_gib_s REAL DEFAULT 0,
+    -- Requested seconds covered by usage samples, the denominator of the efficiency
+    metered_s REAL DEFAULT 0,
+    peak_mem_gib REAL DEFAULT 0,
+    cost REAL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS pods_job ON pods (job_id);
+CREATE TABLE IF NOT EXISTS tenant_daily (
+    day TEXT,
+    tenant TEXT,
+    namespace TEXT,
+    req_cpu_h REAL DEFAULT 0,
+    req_mem_gib_h REAL DEFAULT 0,
+    used_cpu_h REAL DEFAULT 0,
+    used_mem_gib_h REAL DEFAULT 0,
+    metered_cpu_h REAL DEFAULT 0,
+    metered_mem_gib_h REAL DEFAULT 0,
+    cost REAL DEFAULT 0,
+    PRIMARY KEY (day, tenant, namespace)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    name TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+
+class PriceTable():
+    """
+    Hourly node prices by instance type & capacity type, plus the Fargate vCPU/GB rates
+    """
+
+    def __init__(self, prices):
+        self.instances = prices.get("instances", {})
+        self.fargate = prices.get("fargate", {})
+        self.spot_discount = prices.get("default_spot_discount", 0.6)
+
+    @classmethod
+    def from_file(cls, path=PRICES_FILE):
+        with open(path) as f:
+            return cls(yaml.safe_load(f))
+
+    def node_hourly(self, instance_type, capacity_type):
+        price = self.instances.get(instance_type)
+        if price is None:
+            logger.warning(f"No price for {instance_type}, counting it as free")
+            return 0.0
+        if capacity_type == "SPOT":
+            return price.get("spot", price["on_demand"] * (1 - self.spot_discount))
+        if capacity_type != "ON_DEMAND":
+            # Pricing a spot node on demand would double its cost, leave it out instead
+            logger.warning(f"No capacity type for the {instance_type} node, counting it as free")
+            return 0.0
+        return price["on_demand"]
+
+    def fargate_hourly(self, cpu, mem_gib):
+        return cpu * self.fargate.get("vcpu_hour", 0) + mem_gib * self.fargate.get("gb_hour", 0)
+
+
+class CostStore():
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.executescript(_SCHEMA)
+
+    def watermark(self, name, default=None):
+        row = self.conn.execute(
+            "SELECT value FROM watermarks WHERE name = ?", (name,)).fetchone()
+        return row["value"] if row else default
+
+    def set_watermark(self, name, value):
+        self.conn.execute(
+            "INSERT INTO watermarks (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, value)
+        )
+
+
+def _ts(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _day(ts):
+    return datetime.datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d")
+
+
+def sync_job_runs(store, emr_client, virtual_cluster_id):
+    """
+    Upsert the job runs created since the oldest run we have not seen finish yet
+    """
+    wm_name = f"job_runs:{virtual_cluster_id}"
+    row = store.conn.execute(
+        f"SELECT MIN(created_at) AS t FROM job_runs WHERE virtual_cluster_id = ? AND state NOT IN ({','.join('?' * len(JOB_RUN_TERMINAL_STATES))})",
+        (virtual_cluster_id, *JOB_RUN_TERMINAL_STATES)
+    ).fetchone()
+    since = min(filter(None, [row["t"], store.watermark(wm_name)]), default=0)
+    # Job runs created while we page are picked up by the next sync
+    synced_until = time.time()
+
+    n = 0
+    paginator = emr_client.get_paginator("list_job_runs")
+    with store.conn:
+        for page in paginator.paginate(
+            virtualClusterId=virtual_cluster_id,
+            createdAfter=datetime.datetime.utcfromtimestamp(since)
+        ):
+            for jr in page["jobRuns"]:
+                store.conn.execute(
+                    """INSERT INTO job_runs (id, virtual_cluster_id, name, state, created_at, finished_at)
+                       VALUES (?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(id) DO UPDATE SET state = excluded.state, finished_at = excluded.finished_at""",
+                    (jr["id"], virtual_cluster_id, jr.get("name"), jr["state"],
+                     _ts(jr.get("createdAt")), _ts(jr.get("finishedAt")))
+                )
+                n += 1
+        store.set_watermark(wm_name, synced_until)
+    logger.info(f"Synced {n} job run(s) of {virtual_cluster_id}")
+
+
+def _node_info(node):
+    labels = node["metadata"].get("labels", {})
+    return {
+        "instance_type": labels.get("node.kubernetes.io/instance-type"),
+        "capacity_type": "FARGATE" if labels.get("eks.amazonaws.com/compute-type") == "fargate"
+        else labels.get("eks.amazonaws.com/capacityType"),
+        "cpu": parse_cpu(node["status"]["allocatable"]["cpu"]),
+        "mem_gib": parse_memory(node["status"]["allocatable"]["memory"]) / GIB,
+    }
+
+
+def pod_hourly_cost(prices, node, req_cpu, req_mem_gib):
+    """
+    The pod's share of the node, by cpu or memory whichever it takes more of
+    """
+    if node["capacity_type"] == "FARGATE":
+        return prices.fargate_hourly(req_cpu, req_mem_gib)
+    share = max(
+        req_cpu / node["cpu"] if node["cpu"] else 0,
+        req_mem_gib / node["mem_gib"] if node["mem_gib"] else 0
+    )
+    return share * prices.node_hourly(node["instance_type"], node["capacity_type"])
+
+
+def collect_pods(store, kube, prices, namespace, max_gap=900, now=None):
+    """
+    Sample the Spark pods of the namespace & add the time since their previous sample
+    to the pod totals & the daily tenant rollups
+    """
+    now = now or time.time()
+    ns_labels = kube.get_namespace(namespace)["metadata"].get("labels", {})
+    tenant = ns_labels.get("team", UNKNOWN_TENANT)
+    nodes = {n["metadata"]["name"]: _node_info(n) for n in kube.list_nodes()}
+
+    metrics = kube.list_pod_metrics(namespace)
+    usage = None
+    if metrics is not None:
+        usage = {}
+        for m in metrics:
+            cpu = sum(parse_cpu(c["usage"]["cpu"]) for c in m["containers"])
+            mem = sum(parse_memory(c["usage"]["memory"])
+                      for c in m["containers"]) / GIB
+            usage[m["metadata"]["name"]] = (cpu, mem)
+    else:
+        logger.warning("Metrics API not available, only requests are recorded")
+
+    sampled = 0
+    with store.conn:
+        for pod in kube.list_pods(namespace, label_selector=JOB_ID_LABEL):
+            meta, spec = pod["metadata"], pod["spec"]
+            if pod.get("status", {}).get("phase") in TERMINATED_POD_PHASES or spec.get("nodeName") not in nodes:
+                continue
+            node = nodes[spec["nodeName"]]
+            req_cpu, req_mem = pod_requests(pod)
+            req_mem_gib = req_mem / GIB
+
+            row = store.conn.execute(
+                "SELECT last_seen FROM pods WHERE uid = ?", (meta["uid"],)).fetchone()
+            if row is None:
+                started = _ts(pod.get("status", {}).get("startTime")) or now
+                store.conn.execute(
+                    """INSERT INTO pods (uid, name, namespace, tenant, job_id, spark_role, node, instance_type,
+                       capacity_type, req_cpu, req_mem_gib, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (meta["uid"], meta["name"], namespace, tenant, meta["labels"][JOB_ID_LABEL],
+                     meta["labels"].get(SPARK_ROLE_LABEL), spec["nodeName"], node["instance_type"],
+                     node["capacity_type"], req_cpu, req_mem_gib, started, started)
+                )
+                last_seen = started
+            else:
+                last_seen = row["last_seen"]
+            # A long gap means we were not running, do not guess what happened in between
+            dt = min(max(0.0, now - last_seen), max_gap)
+            cost = pod_hourly_cost(prices, node, req_cpu,
+                                   req_mem_gib) * dt / 3600
+
+            used_cpu = used_mem = 0.0
+            metered = 0.0
+            if usage is not None and meta["name"] in usage:
+                used_cpu, used_mem = usage[meta["name"]]
+                metered = dt
+            store.conn.execute(
+                """UPDATE pods SET last_seen = ?, req_cpu_s = req_cpu_s + ?, req_mem_gib_s = req_mem_gib_s + ?,
+                   used_cpu_s = used_cpu_s + ?, used_mem_gib_s = used_mem_gib_s + ?, metered_s = metered_s + ?,
+                   peak_mem_gib = MAX(peak_mem_gib, ?), cost = cost + ? WHERE uid = ?""",
+                (now, req_cpu * dt, req_mem_gib * dt, used_cpu * dt, used_mem * dt,
+                 metered, used_mem, cost, meta["uid"])
+            )
+            store.conn.execute(
+                """INSERT INTO tenant_daily (day, tenant, namespace) VALUES (?, ?, ?)
+                   ON CONFLICT(day, tenant, namespace) DO NOTHING""",
+                (_day(now), tenant, namespace)
+            )
+            store.conn.execute(
+                """UPDATE tenant_daily SET req_cpu_h = req_cpu_h + ?, req_mem_gib_h = req_mem_gib_h + ?,
+                   used_cpu_h = used_cpu_h + ?, used_mem_gib_h = used_mem_gib_h + ?,
+                   metered_cpu_h = metered_cpu_h + ?, metered_mem_gib_h = metered_mem_gib_h + ?, cost = cost + ?
+                   WHERE day = ? AND tenant = ? AND namespace = ?""",
+                (req_cpu * dt / 3600, req_mem_gib * dt / 3600, used_cpu * dt / 3600, used_mem * dt / 3600,
+                 req_cpu * metered / 3600, req_mem_gib * metered / 3600, cost, _day(now), tenant, namespace)
+            )
+            sampled += 1
+    logger.info(f"Sampled {sampled} pod(s) in {namespace}, tenant {tenant}")
+
+
+def _ratio(used, metered):
+    return used / metered if metered else None
+
+
+def tenant_report(store, since_day):
+    return [
+        {
+            **dict(r),
+            "cpu_efficiency": _ratio(r["used_cpu_h"], r["metered_cpu_h"]),
+            "mem_efficiency": _ratio(r["used_mem_gib_h"], r["metered_mem_gib_h"]),
+        }
+        for r in store.conn.execute(
+            """SELECT tenant, namespace, SUM(req_cpu_h) AS req_cpu_h, SUM(req_mem_gib_h) AS req_mem_gib_h,
+               SUM(used_cpu_h) AS used_cpu_h, SUM(used_mem_gib_h) AS used_mem_gib_h,
+               SUM(metered_cpu_h) AS metered_cpu_h, SUM(metered_mem_gib_h) AS metered_mem_gib_h, SUM(cost) AS cost
+               FROM tenant_daily WHERE day >= ? GROUP BY tenant, namespace ORDER BY cost DESC""",
+            (since_day,)
+        )
+    ]
+
+
+def job_report(store, since_ts, threshold=DEFAULT_EFFICIENCY_THRESHOLD):
+    """
+    Per job efficiency of the executors, `used / requested` over the metered time.
+    Jobs under the threshold get a right-sized executor memory suggestion from the peak usage.
+    """
+    rows = store.conn.execute(
+        """SELECT p.job_id, j.name, j.state, p.tenant, COUNT(*) AS executors,
+           SUM(p.req_cpu_s) AS req_cpu_s, SUM(p.used_cpu_s) AS used_cpu_s,
+           SUM(p.req_cpu * p.metered_s) AS metered_cpu_s,
+           SUM(p.req_mem_gib * p.metered_s) AS metered_mem_gib_s, SUM(p.used_mem_gib_s) AS used_mem_gib_s,
+           MAX(p.req_mem_gib) AS req_mem_gib, MAX(p.peak_mem_gib) AS peak_mem_gib, SUM(p.cost) AS executor_cost
+           FROM pods p LEFT JOIN job_runs j ON j.id = p.job_id
+           WHERE p.spark_role = 'executor' AND p.last_seen >= ?
+           GROUP BY p.job_id ORDER BY executor_cost DESC""",
+        (since_ts,)
+    )
+    jobs = []
+    for r in rows:
+        cpu_eff = _ratio(r["used_cpu_s"], r["metered_cpu_s"])
+        mem_eff = _ratio(r["used_mem_gib_s"], r["metered_mem_gib_s"])
+        scores = [e for e in (cpu_eff, mem_eff) if e is not None]
+        job = {
+            **dict(r),
+            "cpu_efficiency": cpu_eff,
+            "mem_efficiency": mem_eff,
+            "efficiency": min(scores) if scores else None,
+            "over_provisioned": bool(scores) and min(scores) < threshold,
+        }
+        if mem_eff is not None and mem_eff < threshold and r["peak_mem_gib"]:
+            # Keep 20% headroom over the peak, the memory overhead is added on top by Spark
+            job["suggested_executor_memory_gib"] = round(
+                r["peak_mem_gib"] * 1.2, 1)
+        jobs.append(job)
+    return jobs
+
+
+def _fmt(v, pct=False):
+    if v is None:
+        return "n/a"
+    return f"{v:.0%}" if pct else f"{v:.2f}"
+
+
+def cmd_collect(args, store):
+    prices = PriceTable.from_file(args.prices)
+    kube = KubeApi(args.kube_api_url, token=args.kube_token,
+                   ca_bundle=args.kube_ca_bundle)
+    collect_pods(store, kube, prices, args.namespace, max_gap=args.max_gap)
+
+    virtual_cluster_id = args.virtual_cluster_id
+    if args.stack_name:
+        virtual_cluster_id, _ = get_virtual_cluster_from_stack(
+            args.stack_name, args.region)
+    if virtual_cluster_id:
+        sync_job_runs(store, get_emr_client(
+            args.region, args.endpoint_url), virtual_cluster_id)
+
+
+def cmd_report(args, store):
+    logger.info(f"Per tenant since {args.since}")
+    logger.info(f"{'tenant':<20} {'namespace':<15} {'vCPU-h req':>11} {'vCPU-h used':>12} {'GB-h req':>10} {'GB-h used':>10} {'cpu eff':>8} {'mem eff':>8} {'cost $':>10}")
+    for r in tenant_report(store, args.since):
+        logger.info(
+            f"{r['tenant']:<20} {r['namespace']:<15} {r['req_cpu_h']:>11.2f} {r['used_cpu_h']:>12.2f} "
+            f"{r['req_mem_gib_h']:>10.2f} {r['used_mem_gib_h']:>10.2f} {_fmt(r['cpu_efficiency'], True):>8} "
+            f"{_fmt(r['mem_efficiency'], True):>8} {r['cost']:>10.2f}")
+
+
+def cmd_jobs(args, store):
+    since_ts = datetime.datetime.fromisoformat(args.since).replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+    for j in job_report(store, since_ts, args.threshold):
+        flag = "OVER-PROVISIONED" if j["over_provisioned"] else ""
+        suggestion = f" try spark.executor.memory={j['suggested_executor_memory_gib']}g" if "suggested_executor_memory_gib" in j else ""
+        logger.info(
+            f"{j['job_id']} {j['name'] or '':<30} {j['tenant']:<15} executors {j['executors']:>4} "
+            f"cpu {_fmt(j['cpu_efficiency'], True):>5} mem {_fmt(j['mem_efficiency'], True):>5} "
+            f"${j['executor_cost']:.2f} {flag}{suggestion}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Cost & utilisation report of the EMR on EKS job runs")
+    parser.add_argument("--db", default="cost_report.db",
+                        help="sqlite file holding the samples & rollups")
+    parser.add_argument("--log-level", default="INFO")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    collect = sub.add_parser(
+        "collect", help="Sample the Spark pods & sync the job runs")
+    collect.add_argument("--namespace", required=True)
+    collect.add_argument("--stack-name",
+                         help="EmrOnEksStack name to read the virtual cluster id from")
+    collect.add_argument("--virtual-cluster-id")
+    collect.add_argument("--prices", default=PRICES_FILE)
+    collect.add_argument("--max-gap", type=int, default=900,
+                         help="Longest time in seconds credited between two samples of a pod")
+    collect.add_argument("--kube-api-url", default=DEFAULT_API_URL,
+                         help="Kubernetes API, defaults to `kubectl proxy`")
+    collect.add_argument("--kube-token")
+    collect.add_argument("--kube-ca-bundle")
+    collect.add_argument("--region")
+    collect.add_argument("--endpoint-url",
+                         help="Override the emr-containers endpoint, for example a local stub")
+    collect.set_defaults(func=cmd_collect)
+
+    report = sub.add_parser("report", help="Requested vs used per tenant")
+    report.add_argument("--since", default=(datetime.date.today() - datetime.timedelta(days=30)).isoformat(),
+                        help="First day(YYYY-MM-DD) in the report")
+    report.set_defaults(func=cmd_report)
+
+    jobs = sub.add_parser("jobs", help="Executor efficiency per job")
+    jobs.add_argument("--since", default=(datetime.date.today() - datetime.timedelta(days=7)).isoformat(),
+                      help="First day(YYYY-MM-DD) in the report")
+    jobs.add_argument("--threshold", type=float, default=DEFAULT_EFFICIENCY_THRESHOLD,
+                      help="Efficiency under which the executors are flagged as over-provisioned")
+    jobs.set_defaults(func=cmd_jobs)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args.func(args, CostStore(args.db))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Run a DAG of Spark jobs on the EMR on EKS virtual cluster.
+
+Jobs are submitted the moment all their dependencies have completed. Each tenant
+has its own concurrency budget, failed jobs are retried and the state of the run
+is checkpointed after every transition, so an interrupted run can be resumed.
+
+Usage:
+    python -m stacks.emr_utils.dag_runner.dag_runner \
+        --dag stacks/emr_utils/dag_runner/sample_dag.yaml \
+        --stack-name emr-on-eks-stack11 \
+        --job-template s3://<artifacts-bkt>/<templates-prefix>/job_templates/default.json \
+        --checkpoint s3://<artifacts-bkt>/dag_runs/daily_sales.json
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+
+import boto3
+import yaml
+
+from stacks.back_end.emr_on_eks_stack.emr_config_profiles import get_config_profile
+from stacks.emr_utils.emr_job_client import (
+    JOB_RUN_TERMINAL_STATES,
+    build_start_job_run_request,
+    get_emr_client,
+    get_virtual_cluster_from_stack,
+    load_job_template,
+)
+
+
+logger = logging.getLogger("dag_runner")
+
+# Node states
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+UPSTREAM_FAILED = "UPSTREAM_FAILED"
+
+DEFAULT_TENANT = "default"
+# Jobs without a job template run on the release the job templates are built for by default
+DEFAULT_RELEASE_LABEL = get_config_profile()["release_label"]
+
+
+class DagValidationError(ValueError):
+    pass
+
+
+class CheckpointStore():
+    """
+    Persist the DAG run state as JSON to a local file or an `s3://` uri
+    """
+
+    def __init__(self, uri, s3_client=None):
+        self.uri = uri
+        self._s3_client = s3_client
+
+    @property
+    def s3_client(self):
+        if self._s3_client is None:
+            self._s3_client = boto3.client("s3")
+        return self._s3_client
+
+    def _split_s3_uri(self):
+        bkt, _, key = self.uri[len("s3://"):].partition("/")
+        return bkt, key
+
+    def load(self):
+        if not self.uri:
+            return None
+        if self.uri.startswith("s3://"):
+            bkt, key = self._split_s3_uri()
+            try:
+                resp = self.s3_client.get_object(Bucket=bkt, Key=key)
+            except self.s3_client.exceptions.NoSuchKey:
+                return None
+            return json.loads(resp["Body"].read())
+        if not os.path.exists(self.uri):
+            return None
+        with open(self.uri) as f:
+            return json.load(f)
+
+    def save(self, state):
+        if not self.uri:
+            return
+        body = json.dumps(state, indent=2, sort_keys=True)
+        if self.uri.startswith("s3://"):
+            bkt, key = self._split_s3_uri()
+            self.s3_client.put_object(
+                Bucket=bkt, Key=key, Body=body.encode("utf-8"))
+            return
+        # Write & rename, so a crash never leaves a truncated checkpoint behind
+        tmp_path = f"{self.uri}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(body)
+        os.replace(tmp_path, self.uri)
+
+
+def load_dag(dag_path):
+    with open(dag_path) as f:
+        return yaml.safe_load(f)
+
+
+def validate_dag(dag):
+    """
+    Make sure every dependency exists and the graph has no cycles
+    """
+    jobs = {j["name"]: j for j in dag.get("jobs", [])}
+    if len(jobs) != len(dag.get("jobs", [])):
+        raise DagValidationError("Job names must be unique")
+
+    for name, job in jobs.items():
+        for dep in job.get("depends_on", []):
+            if dep not in jobs:
+                raise DagValidationError(
+                    f"Job '{name}' depends on unknown job '{dep}'")
+
+    # Kahn's algorithm, whatever is left over is part of a cycle
+    in_degree = {n: len(j.get("depends_on", [])) for n, j in jobs.items()}
+    ready = [n for n, d in in_degree.items() if d == 0]
+    visited = 0
+    while ready:
+        n = ready.pop()
+        visited += 1
+        for m, j in jobs.items():
+            if n in j.get("depends_on", []):
+                in_degree[m] -= 1
+                if in_degree[m] == 0:
+                    ready.append(m)
+    if visited != len(jobs):
+        cyclic = sorted(n for n, d in in_degree.items() if d > 0)
+        raise DagValidationError(f"DAG has a cycle between jobs: {cyclic}")
+    return jobs
+
+
+class DagRunner():
+    def __init__(
+        self,
+        dag,
+        emr_client,
+        virtual_cluster_id,
+        execution_role_arn,
+        checkpoint_store=None,
+        poll_interval=30,
+        retry_backoff=30,
+        job_template=None,
+    ):
+        self.dag = dag
+        self.jobs = validate_dag(dag)
+        self.emr_client = emr_client
+        self.virtual_cluster_id = virtual_cluster_id
+        self.execution_role_arn = execution_role_arn
+        self.checkpoint_store = checkpoint_store or CheckpointStore(None)
+        self.poll_interval = poll_interval
+        self.retry_backoff = retry_backoff
+
+        self.defaults = dag.get("defaults", {})
+        # The release & configuration overrides pinned by the job template, unless the DAG sets its own
+        job_template = job_template or {}
+        self.release_label = dag.get(
+            "release_label", job_template.get("releaseLabel", DEFAULT_RELEASE_LABEL))
+        self.configuration_overrides = job_template.get("configurationOverrides")
+
+        self.state = self._init_state()
+
+    def _init_state(self):
+        state = {
+            "dag_name": self.dag.get("dag_name", "dag"),
+            "nodes": {n: {"state": PENDING, "attempts": 0, "job_run_id": None} for n in self.jobs}
+        }
+        saved = self.checkpoint_store.load()
+        if saved and saved.get("dag_name") == state["dag_name"]:
+            for n, node in saved.get("nodes", {}).items():
+                if n not in state["nodes"]:
+                    continue
+                # Failures are retried on resume with a fresh attempt budget
+                if node["state"] in (FAILED, UPSTREAM_FAILED):
+                    node = {**node, "state": PENDING, "attempts": 0}
+                state["nodes"][n] = node
+            logger.info(f"Resuming DAG '{state['dag_name']}' from checkpoint")
+        return state
+
+    def _job_opt(self, name, key, default=None):
+        return self.jobs[name].get(key, self.defaults.get(key, default))
+
+    def _tenant(self, name):
+        return self._job_opt(name, "tenant", DEFAULT_TENANT)
+
+    def _build_semaphores(self):
+        concurrency = self.dag.get("concurrency", {})
+        default_limit = concurrency.get(DEFAULT_TENANT, 2)
+        return {
+            t: asyncio.Semaphore(concurrency.get(t, default_limit))
+            for t in {self._tenant(n) for n in self.jobs}
+        }
+
+    async def _call(self, fn, **kwargs):
+        # boto3 is blocking, keep the event loop free for the other nodes
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(fn, **kwargs))
+
+    async def _checkpoint(self):
+        async with self._checkpoint_lock:
+            await self._call(self.checkpoint_store.save, state=self.state)
+
+    async def _set_node(self, name, **kwargs):
+        self.state["nodes"][name].update(kwargs)
+        await self._checkpoint()
+
+    def _is_ready(self, name):
+        node = self.state["nodes"][name]
+        if node["state"] not in (PENDING, RUNNING):
+            return False
+        return all(
+            self.state["nodes"][d]["state"] == SUCCEEDED for d in self.jobs[name].get("depends_on", [])
+        )
+
+    def _mark_downstream_failed(self, name):
+        for n, job in self.jobs.items():
+            if name in job.get("depends_on", []) and self.state["nodes"][n]["state"] == PENDING:
+                self.state["nodes"][n]["state"] = UPSTREAM_FAILED
+                self._mark_downstream_failed(n)
+
+    async def _submit(self, name):
+        job = self.jobs[name]
+        req = build_start_job_run_request(
+            virtual_cluster_id=self.virtual_cluster_id,
+            execution_role_arn=self.execution_role_arn,
+            release_label=self._job_opt(
+                name, "release_label", self.release_label),
+            name=f"{self.state['dag_name']}-{name}"[:64],
+            entry_point=job["entry_point"],
+            entry_point_arguments=job.get("entry_point_arguments"),
+            spark_submit_parameters=self._job_opt(
+                name, "spark_submit_parameters"),
+            configuration_overrides=self._job_opt(
+                name, "configuration_overrides", self.configuration_overrides),
+            tags={"dag": self.state["dag_name"], "tenant": self._tenant(name)}
+        )
+        resp = await self._call(self.emr_client.start_job_run, **req)
+        return resp["id"]
+
+    async def _wait_for(self, job_run_id):
+        while True:
+            resp = await self._call(
+                self.emr_client.describe_job_run,
+                id=job_run_id,
+                virtualClusterId=self.virtual_cluster_id
+            )
+            job_state = resp["jobRun"]["state"]
+            if job_state in JOB_RUN_TERMINAL_STATES:
+                return job_state
+            await asyncio.sleep(self.poll_interval)
+
+    async def _run_node(self, name):
+        max_attempts = self._job_opt(name, "max_attempts", 3)
+        tenant_sem = self._semaphores[self._tenant(name)]
+        node = self.state["nodes"][name]
+
+        while True:
+            async with tenant_sem:
+                job_run_id = node["job_run_id"] if node["state"] == RUNNING else None
+                if job_run_id:
+                    logger.info(
+                        f"Re-attaching to '{name}' job run {job_run_id}")
+                else:
+                    job_run_id = await self._submit(name)
+                    await self._set_node(
+                        name,
+                        state=RUNNING,
+                        attempts=node["attempts"] + 1,
+                        job_run_id=job_run_id,
+                        started_at=time.time()
+                    )
+                    logger.info(
+                        f"Submitted '{name}' as {job_run_id} (attempt {node['attempts']}/{max_attempts})")
+                job_state = await self._wait_for(job_run_id)
+
+            if job_state == "COMPLETED":
+                await self._set_node(name, state=SUCCEEDED, finished_at=time.time())
+                logger.info(f"'{name}' completed")
+                return SUCCEEDED
+
+            logger.warning(f"'{name}' job run {job_run_id} ended as {job_state}")
+            if node["attempts"] >= max_attempts:
+                self._mark_downstream_failed(name)
+                await self._set_node(name, state=FAILED, finished_at=time.time())
+                return FAILED
+
+            await self._set_node(name, state=PENDING, job_run_id=None)
+            await asyncio.sleep(self.retry_backoff * node["attempts"])
+
+    async def run(self):
+        self._semaphores = self._build_semaphores()
+        self._checkpoint_lock = asyncio.Lock()
+        await self._checkpoint()
+
+        tasks = {}
+        while True:
+            for name in self.jobs:
+                if name not in tasks and self._is_ready(name):
+                    tasks[name] = asyncio.ensure_future(self._run_node(name))
+            running = [t for t in tasks.values() if not t.done()]
+            if not running:
+                break
+            await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            # Surface unexpected errors instead of silently stalling the DAG
+            for t in tasks.values():
+                if t.done() and t.exception():
+                    raise t.exception()
+
+        await self._checkpoint()
+        return {n: node["state"] for n, node in self.state["nodes"].items()}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run a DAG of Spark jobs on EMR on EKS")
+    parser.add_argument("--dag", required=True, help="Path to the DAG yaml")
+    parser.add_argument(
+        "--stack-name", help="EmrOnEksStack name to read the virtual cluster outputs from")
+    parser.add_argument("--virtual-cluster-id")
+    parser.add_argument("--execution-role-arn")
+    parser.add_argument("--job-template",
+                        help="Job template with the release & configuration overrides to use, s3:// uri or local path")
+    parser.add_argument(
+        "--checkpoint", help="Local path or s3:// uri to checkpoint the DAG run state")
+    parser.add_argument("--region")
+    parser.add_argument(
+        "--endpoint-url", help="Override the emr-containers endpoint, for example a local stub")
+    parser.add_argument("--poll-interval", type=int, default=30)
+    parser.add_argument("--retry-backoff", type=int, default=30)
+    parser.add_argument("--log-level", default="INFO")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+    dag = load_dag(args.dag)
+
+    virtual_cluster_id = args.virtual_cluster_id or dag.get(
+        "virtual_cluster_id")
+    execution_role_arn = args.execution_role_arn or dag.get(
+        "execution_role_arn")
+    if args.stack_name:
+        virtual_cluster_id, execution_role_arn = get_virtual_cluster_from_stack(
+            args.stack_name, args.region)
+    if not (virtual_cluster_id and execution_role_arn):
+        raise SystemExit(
+            "Provide --stack-name or --virtual-cluster-id & --execution-role-arn")
+
+    job_template_uri = args.job_template or dag.get("job_template")
+    job_template = load_job_template(
+        job_template_uri) if job_template_uri else None
+
+    runner = DagRunner(
+        dag,
+        emr_client=get_emr_client(args.region, args.endpoint_url),
+        virtual_cluster_id=virtual_cluster_id,
+        execution_role_arn=execution_role_arn,
+        checkpoint_store=CheckpointStore(args.checkpoint),
+        poll_interval=args.poll_interval,
+        retry_backoff=args.retry_backoff,
+        job_template=job_template
+    )
+    result = asyncio.run(runner.run())
+    logger.info(json.dumps(result, indent=2, sort_keys=True))
+    if any(s != SUCCEEDED for s in result.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import json
+
+import boto3
+
+from stacks.miztiik_global_args import GlobalArgs
+
+
+# Job run states reported by emr-containers
+# https://docs.aws.amazon.com/emr-on-eks/latest/APIReference/API_JobRun.html
+JOB_RUN_ACTIVE_STATES = ["PENDING", "SUBMITTED", "RUNNING"]
+JOB_RUN_TERMINAL_STATES = ["COMPLETED", "FAILED", "CANCELLED"]
+
+# Output keys published by EmrOnEksStack
+VIRTUAL_CLUSTER_ID_OUTPUT_KEY = "EmrVirtualClusterId"
+EXECUTION_ROLE_ARN_OUTPUT_KEY = "EmrExecutionRoleArn"
+
+
+def get_emr_client(region_name=None, endpoint_url=None):
+    """
+    Return an emr-containers client. `endpoint_url` lets us point the tools at a local stand-in.
+    """
+    return boto3.client(
+        "emr-containers",
+        region_name=region_name,
+        endpoint_url=endpoint_url
+    )
+
+
+def get_stack_outputs(stack_name, region_name=None):
+    """
+    Read the CloudFormation outputs of a deployed stack as a dict
+    """
+    cfn_client = boto3.client("cloudformation", region_name=region_name)
+    resp = cfn_client.describe_stacks(StackName=stack_name)
+    return {
+        o["OutputKey"]: o["OutputValue"] for o in resp["Stacks"][0].get("Outputs", [])
+    }
+
+
+def get_virtual_cluster_from_stack(stack_name, region_name=None):
+    """
+    Resolve the virtual cluster id & execution role from the outputs of EmrOnEksStack
+    """
+    outputs = get_stack_outputs(stack_name, region_name)
+    return (
+        outputs[VIRTUAL_CLUSTER_ID_OUTPUT_KEY],
+        outputs[EXECUTION_ROLE_ARN_OUTPUT_KEY]
+    )
+
+
+def build_start_job_run_request(
+    virtual_cluster_id,
+    execution_role_arn,
+    release_label,
+    name,
+    entry_point,
+    entry_point_arguments=None,
+    spark_submit_parameters=None,
+    configuration_overrides=None,
+    tags=None
+):
+    """
+    Build the keyword arguments for `start_job_run`
+    """
+    job_driver = {
+        "sparkSubmitJobDriver": {
+            "entryPoint": entry_point
+        }
+    }
+    if entry_point_arguments:
+        job_driver["sparkSubmitJobDriver"]["entryPointArguments"] = list(
+            entry_point_arguments)
+    if spark_submit_parameters:
+        job_driver["sparkSubmitJobDriver"]["sparkSubmitParameters"] = spark_submit_parameters
+
+    req = {
+        "virtualClusterId": virtual_cluster_id,
+        "name": name,
+        "executionRoleArn": execution_role_arn,
+        "releaseLabel": release_label,
+        "jobDriver": job_driver,
+        "tags": {"owner": GlobalArgs.OWNER, **(tags or {})}
+    }
+    if configuration_overrides:
+        req["configurationOverrides"] = configuration_overrides
+    return req
+
+
+def load_job_template(uri, s3_client=None):
+    """
+    Load a job run template(`configurationOverrides` & co) uploaded by EmrOnEksStack, from `s3://` or a local path
+    """
+    if uri.startswith("s3://"):
+        bkt, _, key = uri[len("s3://"):].partition("/")
+        s3_client = s3_client or boto3.client("s3")
+        return json.loads(s3_client.get_object(Bucket=bkt, Key=key)["Body"].read())
+    with open(uri) as f:
+        return json.load(f)
+
+
+def job_run_duration(job_run):
+    """
+    Seconds between the creation & the end of a finished job run, as returned by `describe_job_run`
+    """
+    if not job_run.get("finishedAt"):
+        return None
+    return (job_run["finishedAt"] - job_run["createdAt"]).total_seconds()
@@ -0,0 +1,101 @@
+import yaml
+
+
+# Used when no fleet spec is given, keeps the stack names of the single cluster setup
+DEFAULT_FLEET_MEMBER = {
+    "name": "11",
+    "account": None,
+    "region": None,
+    "artifacts_bkt_stack_name": "emr-artifacts-bkt-stack",
+}
+
+
+class FleetSpecError(ValueError):
+    pass
+
+
+def load_fleet_spec(app):
+    """
+    Read the fleet spec from the `fleet` context or from the yaml file in the `fleet_spec` context.
+    Without either, the fleet is the single, environment agnostic, default member.
+    """
+    spec = app.node.try_get_context("fleet")
+    spec_path = app.node.try_get_context("fleet_spec")
+    if spec_path:
+        with open(spec_path) as f:
+            spec = yaml.safe_load(f)
+    if not spec:
+        return {"members": [dict(DEFAULT_FLEET_MEMBER)], "datasets": {}}
+
+    members = spec.get("members", [])
+    if not members:
+        raise FleetSpecError("Fleet spec needs at least one member")
+    names = [m.get("name") for m in members]
+    if None in names or len(set(names)) != len(names):
+        raise FleetSpecError("Every fleet member needs a unique `name`")
+    for m in members:
+        if not m.get("region"):
+            raise FleetSpecError(f"Fleet member '{m['name']}' needs a `region`")
+    return {"members": members, "datasets": spec.get("datasets", {})}
+
+
+def shared_assets_stack_name(account=None, region=None):
+    """
+    One shared assets stack per environment, shared by the members in the same account/region
+    """
+    env_suffix = "-".join(k for k in (account, region) if k)
+    return f"eks-shared-assets-stack{'-' + env_suffix if env_suffix else ''}"
+
+
+def stack_names(member):
+    """
+    Stack names of one fleet member
+    """
+    u = member["name"]
+    return {
+        "shared_assets": shared_assets_stack_name(member.get("account"), member.get("region")),
+        "vpc": f"eks-cluster-vpc-stack{u}",
+        "eks_cluster": f"eks-cluster-stack{u}",
+        "ssm_daemonset": f"ssm-agent-installer-daemonset-stack{u}",
+        "metrics_server": f"k8s-metrics-server-stack{u}",
+        "node_termination_handler": f"node-termination-handler-stack{u}",
+        "alluxio_cache": f"alluxio-cache-stack{u}",
+        "log_shipping": f"spark-log-shipping-stack{u}",
+        "artifacts_bkt": member.get("artifacts_bkt_stack_name", f"emr-artifacts-bkt-stack{u}"),
+        "emr_on_eks": f"emr-on-eks-stack{u}",
+    }
+
+
+def _geography(region):
+    # us-east-1 -> us, eu-west-1 -> eu
+    return region.split("-")[0] if region else None
+
+
+def nearest_member(members, region):
+    """
+    Member in the same region, else in the same geography, else the first member
+    """
+    for m in members:
+        if m.get("region") == region:
+            return m
+    for m in members:
+        if _geography(m.get("region")) == _geography(region):
+            return m
+    return members[0]
+
+
+def build_routing_table(fleet):
+    """
+    Map every dataset to the EMR stack(and its virtual cluster) nearest to the data
+    """
+    routing = {}
+    for dataset, ds in fleet["datasets"].items():
+        m = nearest_member(fleet["members"], ds.get("region"))
+        routing[dataset] = {
+            "fleet_member": m["name"],
+            "account": m.get("account"),
+            "region": m.get("region"),
+            "emr_stack": stack_names(m)["emr_on_eks"],
+            "artifacts_bkt_stack": stack_names(m)["artifacts_bkt"],
+        }
+    return routing
@@ -0,0 +1,138 @@
+"""
+API Priority & Fairness(APF) manifests for the EMR namespaces.
+
+Every EMR namespace gets two priority levels on the API server:
+
+- `<namespace>-emr-controller`: requests of the `emr-containers` user in the namespace, so
+  job submissions & driver pod creation keep their seats while the jobs are running
+- `<namespace>-spark`: requests of the service accounts of the namespace(Spark drivers &
+  executors). The flows are split by user & fair queued, so the pod lists of a driver with
+  thousands of executors can not starve the other drivers, & a burst is queued instead of
+  spreading over the seats of the rest of the cluster.
+
+Both flow schemas match before the built in `service-accounts`/`global-default` schemas.
+"""
+
+
+FLOW_CONTROL_API_GROUP = "flowcontrol.apiserver.k8s.io"
+# EKS 1.20 serves v1beta1, the API server preferred version is used by the load test
+DEFAULT_FLOW_CONTROL_API_VERSION = f"{FLOW_CONTROL_API_GROUP}/v1beta1"
+
+EMR_CONTROLLER_USER = "emr-containers"
+
+# Concurrency shares of the limited priority levels of the API server, for reference:
+# workload-high 40, workload-low 100, global-default 20
+EMR_CONTROLLER_SHARES = 40
+SPARK_SHARES = 30
+
+# Lower matches first, the built in `service-accounts` schema is at 9000
+EMR_CONTROLLER_PRECEDENCE = 800
+SPARK_PRECEDENCE = 900
+
+
+def _shares_field(api_version):
+    # Renamed in v1beta3
+    if api_version.endswith(("/v1beta1", "/v1beta2")):
+        return "assuredConcurrencyShares"
+    return "nominalConcurrencyShares"
+
+
+def priority_level_manifest(name, shares, queues=64, hand_size=6, queue_length_limit=50, api_version=DEFAULT_FLOW_CONTROL_API_VERSION):
+    """
+    Limited priority level, requests over its seats wait in `queues` fair queues
+    """
+    return {
+        "apiVersion": api_version,
+        "kind": "PriorityLevelConfiguration",
+        "metadata": {"name": name},
+        "spec": {
+            "type": "Limited",
+            "limited": {
+                _shares_field(api_version): shares,
+                "limitResponse": {
+                    "type": "Queue",
+                    "queuing": {
+                        "queues": queues,
+                        "handSize": hand_size,
+                        "queueLengthLimit": queue_length_limit
+                    }
+                }
+            }
+        }
+    }
+
+
+def flow_schema_manifest(name, priority_level, subjects, namespace, matching_precedence, distinguisher="ByUser", api_version=DEFAULT_FLOW_CONTROL_API_VERSION):
+    """
+    Flow schema sending all the namespaced requests of the `subjects` in `namespace` to `priority_level`
+    """
+    return {
+        "apiVersion": api_version,
+        "kind": "FlowSchema",
+        "metadata": {"name": name},
+        "spec": {
+            "priorityLevelConfiguration": {"name": priority_level},
+            "matchingPrecedence": matching_precedence,
+            "distinguisherMethod": {"type": distinguisher},
+            "rules": [
+                {
+                    "subjects": subjects,
+                    "resourceRules": [
+                        {
+                            "verbs": ["*"],
+                            "apiGroups": ["*"],
+                            "resources": ["*"],
+                            "namespaces": [namespace]
+                        }
+                    ]
+                }
+            ]
+        }
+    }
+
+
+def namespace_flow_control_manifests(namespace, api_version=DEFAULT_FLOW_CONTROL_API_VERSION):
+    """
+    Priority levels & flow schemas of an EMR namespace
+    """
+    controller_level = f"{namespace}-emr-controller"
+    spark_level = f"{namespace}-spark"
+    return [
+        priority_level_manifest(
+            controller_level, EMR_CONTROLLER_SHARES, api_version=api_version),
+        priority_level_manifest(
+            spark_level, SPARK_SHARES, api_version=api_version),
+        flow_schema_manifest(
+            controller_level,
+            controller_level,
+            subjects=[{"kind": "User", "user": {"name": EMR_CONTROLLER_USER}}],
+            namespace=namespace,
+            matching_precedence=EMR_CONTROLLER_PRECEDENCE,
+            api_version=api_version
+        ),
+        flow_schema_manifest(
+            spark_level,
+            spark_level,
+            subjects=[{"kind": "ServiceAccount", "serviceAccount": {
+                "name": "*", "namespace": namespace}}],
+            namespace=namespace,
+            matching_precedence=SPARK_PRECEDENCE,
+            api_version=api_version
+        ),
+    ]
+
+
+def convert_api_version(manifest, api_version):
+    """
+    Flow control object for an API server serving another flowcontrol version, Ex: a newer `kind`
+    """
+    manifest = dict(manifest, apiVersion=api_version)
+    limited = manifest["spec"].get("limited")
+    if manifest["kind"] == "PriorityLevelConfiguration" and limited:
+        shares = limited.get("assuredConcurrencyShares",
+                             limited.get("nominalConcurrencyShares"))
+        limited = {k: v for k, v in limited.items() if k not in (
+            "assuredConcurrencyShares", "nominalConcurrencyShares")}
+        limited[_shares_field(api_version)] = shares
+        manifest["spec"] = dict(manifest["spec"], limited=limited)
+    return manifest
@@ -0,0 +1,53 @@
+"""
+IAM Roles for Service Accounts(IRSA) helpers.
+
+The cluster stack sets up its own OIDC provider, so instead of `cluster.add_service_account`
+(which would register a second provider for the same issuer) we build the role trust
+policy against the existing provider, the same way the EMR execution role does.
+"""
+
+from aws_cdk import aws_iam as _iam
+from aws_cdk import core as cdk
+
+
+def create_irsa_role(
+    scope: cdk.Construct,
+    id: str,
+    oidc_provider_arn: str,
+    oidc_issuer: str,
+    namespace: str,
+    sa_name: str
+):
+    # To make resolution of LHS during runtime, pre built the string.
+    oidc_condition_str = cdk.CfnJson(
+        scope,
+        f"{id}ConditionJson",
+        value={
+            f"{oidc_issuer}:sub": f"system:serviceaccount:{namespace}:{sa_name}",
+            f"{oidc_issuer}:aud": "sts.amazonaws.com"
+        }
+    )
+    return _iam.Role(
+        scope,
+        id,
+        assumed_by=_iam.FederatedPrincipal(
+            federated=f"{oidc_provider_arn}",
+            conditions={"StringEquals": oidc_condition_str},
+            assume_role_action="sts:AssumeRoleWithWebIdentity"
+        )
+    )
+
+
+def service_account_manifest(sa_name: str, namespace: str, role_arn: str, labels: dict = None):
+    return {
+        "apiVersion": "v1",
+        "kind": "ServiceAccount",
+        "metadata": {
+            "name": sa_name,
+            "namespace": namespace,
+            "labels": labels or {},
+            "annotations": {
+                "eks.amazonaws.com/role-arn": role_arn
+            }
+        }
+    }
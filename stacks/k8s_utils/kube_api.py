@@ -0,0 +1,199 @@
+"""
+Minimal Kubernetes API client for the tools in this repo.
+
+Talks plain REST through `requests`. The default endpoint is `kubectl proxy`, which takes
+care of authentication, Ex: `kubectl proxy --port 8001 &`. A bearer token & CA bundle can
+be given for direct access to the API server. `impersonate` sends the requests as another
+user, Ex: a service account, the caller needs the `impersonate` RBAC permission.
+"""
+
+import json
+
+import requests
+
+
+DEFAULT_API_URL = "http://127.0.0.1:8001"
+
+# Pods in these phases no longer hold node resources
+TERMINATED_POD_PHASES = ("Succeeded", "Failed")
+
+_MEMORY_SUFFIXES = {
+    "Ki": 2 ** 10, "Mi": 2 ** 20, "Gi": 2 ** 30, "Ti": 2 ** 40, "Pi": 2 ** 50, "Ei": 2 ** 60,
+    "k": 10 ** 3, "M": 10 ** 6, "G": 10 ** 9, "T": 10 ** 12, "P": 10 ** 15, "E": 10 ** 18,
+}
+
+
+def parse_cpu(quantity):
+    """
+    Kubernetes cpu quantity to cores, Ex: "250m" -> 0.25, "2" -> 2.0, "1500000n" -> 0.0015
+    """
+    if quantity is None:
+        return 0.0
+    q = str(quantity)
+    if q.endswith("n"):
+        return float(q[:-1]) / 10 ** 9
+    if q.endswith("u"):
+        return float(q[:-1]) / 10 ** 6
+    if q.endswith("m"):
+        return float(q[:-1]) / 1000
+    return float(q)
+
+
+def parse_memory(quantity):
+    """
+    Kubernetes memory quantity to bytes, Ex: "1Gi" -> 1073741824, "500M" -> 500000000
+    """
+    if quantity is None:
+        return 0.0
+    q = str(quantity)
+    for suffix in sorted(_MEMORY_SUFFIXES, key=len, reverse=True):
+        if q.endswith(suffix):
+            return float(q[:-len(suffix)]) * _MEMORY_SUFFIXES[suffix]
+    return float(q)
+
+
+def pod_requests(pod):
+    """
+    cpu(cores) & memory(bytes) requested by a pod. Init containers run one at a time,
+    so the pod needs the max of them or the sum of the app containers, whichever is larger.
+    """
+    spec = pod.get("spec", {})
+
+    def _sum(containers):
+        cpu = mem = 0.0
+        for c in containers:
+            req = c.get("resources", {}).get("requests", {})
+            cpu += parse_cpu(req.get("cpu"))
+            mem += parse_memory(req.get("memory"))
+        return cpu, mem
+
+    cpu, mem = _sum(spec.get("containers", []))
+    for c in spec.get("initContainers", []):
+        i_cpu, i_mem = _sum([c])
+        cpu, mem = max(cpu, i_cpu), max(mem, i_mem)
+    return cpu, mem
+
+
+class KubeApi():
+    def __init__(self, api_url=DEFAULT_API_URL, token=None, ca_bundle=None, timeout=30, impersonate=None):
+        self.api_url = api_url.rstrip("/")
+        self.session = requests.Session()
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        # The API server adds the service account groups for `system:serviceaccount:` users
+        if impersonate:
+            self.session.headers["Impersonate-User"] = impersonate
+        self.session.verify = ca_bundle if ca_bundle else True
+        self.timeout = timeout
+        self._resources = {}
+
+    def get(self, path, params=None):
+        resp = self.session.get(
+            f"{self.api_url}{path}", params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def post(self, path, body):
+        resp = self.session.post(
+            f"{self.api_url}{path}", json=body, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def put(self, path, body):
+        resp = self.session.put(
+            f"{self.api_url}{path}", json=body, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def delete(self, path, params=None):
+        resp = self.session.delete(
+            f"{self.api_url}{path}", params=params, timeout=self.timeout)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+
+    def resource_path(self, manifest):
+        """
+        Collection path of the object, with the resource name from the API discovery
+        """
+        api_version = manifest["apiVersion"]
+        base = f"/apis/{api_version}" if "/" in api_version else f"/api/{api_version}"
+        if base not in self._resources:
+            self._resources[base] = {
+                r["kind"]: r for r in self.get(base)["resources"] if "/" not in r["name"]}
+        resource = self._resources[base][manifest["kind"]]
+        if resource["namespaced"]:
+            base = f"{base}/namespaces/{manifest['metadata'].get('namespace', 'default')}"
+        return f"{base}/{resource['name']}"
+
+    def apply(self, manifest, field_manager="emr-on-eks-tools"):
+        """
+        Create or update the object, through server side apply
+        """
+        resp = self.session.patch(
+            f"{self.api_url}{self.resource_path(manifest)}/{manifest['metadata']['name']}",
+            params={"fieldManager": field_manager, "force": "true"},
+            data=json.dumps(manifest),
+            headers={"Content-Type": "application/apply-patch+yaml"},
+            timeout=self.timeout
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    def watch(self, path, params=None, timeout_seconds=60):
+        """
+        Yield the watch events(`{"type": ..., "object": ...}`) until the server ends the watch
+        """
+        params = dict(params or {}, watch="true", timeoutSeconds=timeout_seconds)
+        with self.session.get(f"{self.api_url}{path}", params=params, stream=True,
+                              timeout=(self.timeout, timeout_seconds + self.timeout)) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def list_all(self, path, params=None, page_size=500):
+        """
+        Follow the `continue` token, so large lists do not load the API server in one go
+        """
+        params = dict(params or {}, limit=page_size)
+        items = []
+        while True:
+            resp = self.get(path, params)
+            items.extend(resp.get("items", []))
+            _continue = resp.get("metadata", {}).get("continue")
+            if not _continue:
+                return items
+            params["continue"] = _continue
+
+    def list_pods(self, namespace=None, label_selector=None, field_selector=None):
+        path = f"/api/v1/namespaces/{namespace}/pods" if namespace else "/api/v1/pods"
+        params = {}
+        if label_selector:
+            params["labelSelector"] = label_selector
+        if field_selector:
+            params["fieldSelector"] = field_selector
+        return self.list_all(path, params)
+
+    def list_nodes(self, label_selector=None):
+        return self.list_all(
+            "/api/v1/nodes",
+            {"labelSelector": label_selector} if label_selector else None
+        )
+
+    def get_namespace(self, namespace):
+        return self.get(f"/api/v1/namespaces/{namespace}")
+
+    def list_pod_metrics(self, namespace=None):
+        """
+        Current cpu & memory usage of the pods, needs the metrics server.
+        Returns `None` when the metrics API is not available.
+        """
+        path = f"/apis/metrics.k8s.io/v1beta1/namespaces/{namespace}/pods" if namespace else "/apis/metrics.k8s.io/v1beta1/pods"
+        try:
+            return self.list_all(path)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in (404, 503):
+                return None
+            raise
@@ -0,0 +1,164 @@
+"""
+Spark pod templates for the jobs run on the EMR virtual cluster.
+
+EMR on EKS picks them up from S3 through
+`spark.kubernetes.driver.podTemplateFile` & `spark.kubernetes.executor.podTemplateFile`
+https://docs.aws.amazon.com/emr/latest/EMR-on-EKS-DevelopmentGuide/pod-templates.html
+"""
+
+
+# Label Spark puts on the driver pods it launches
+SPARK_DRIVER_ROLE_LABELS = {"spark-role": "driver"}
+
+# Driver pods carrying this label are scheduled on the Fargate profile of the EMR namespace
+FARGATE_DRIVER_LABELS = {"compute_provider": "fargate"}
+
+# Values of the `kubernetes.io/arch` node label
+NODE_ARCHS = ["amd64", "arm64"]
+
+# Taint of the Graviton node group, only the pods pinned to arm64 tolerate it. Keeps the
+# x86_64 only images(Ex: EMR releases before 6.6.0) of the other jobs off the ARM64 nodes.
+ARM64_NODE_TAINT = {"key": "cpu-arch", "value": "arm64", "effect": "NoSchedule"}
+
+# Group owning the volumes mounted into the executors
+SPARK_FS_GROUP = 65534
+
+# Seconds an executor gets to migrate its blocks, a spot notice leaves us ~120s
+EXECUTOR_DECOMMISSION_GRACE_PERIOD = 110
+
+# Name of the spark container in the driver & executor pods
+SPARK_DRIVER_CONTAINER = "spark-kubernetes-driver"
+SPARK_EXECUTOR_CONTAINER = "spark-kubernetes-executor"
+
+
+def arch_node_selector(arch):
+    if arch not in NODE_ARCHS:
+        raise ValueError(f"Unknown cpu architecture '{arch}', choose one of {NODE_ARCHS}")
+    return {"kubernetes.io/arch": arch}
+
+
+def arch_tolerations(arch):
+    """
+    Tolerations letting a pod pinned to `arch` on the tainted nodes of that arch
+    """
+    if arch != "arm64":
+        return []
+    return [{"operator": "Equal", **ARM64_NODE_TAINT}]
+
+
+def _pod_template(labels=None, node_selector=None, container_name=None, tolerations=None):
+    pod = {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {
+            "labels": {
+                "owner": "miztiik_automation",
+                **(labels or {})
+            }
+        },
+        "spec": {
+            "containers": [
+                {"name": container_name}
+            ]
+        }
+    }
+    if node_selector:
+        pod["spec"]["nodeSelector"] = dict(node_selector)
+    if tolerations:
+        pod["spec"]["tolerations"] = list(tolerations)
+    return pod
+
+
+def driver_pod_template(labels=None, node_selector=None, tolerations=None):
+    return _pod_template(
+        labels=labels,
+        node_selector=node_selector,
+        container_name=SPARK_DRIVER_CONTAINER,
+        tolerations=tolerations
+    )
+
+
+def fargate_driver_pod_template(labels=None):
+    """
+    Driver template matching the driver-only Fargate profile.
+    Fargate brings its own capacity, so there is no node selector.
+    """
+    return driver_pod_template(
+        labels={**FARGATE_DRIVER_LABELS, **(labels or {})}
+    )
+
+
+def executor_pod_template(labels=None, node_selector=None, fs_group=None, termination_grace_period=None, tolerations=None):
+    pod = _pod_template(
+        labels=labels,
+        node_selector=node_selector,
+        container_name=SPARK_EXECUTOR_CONTAINER,
+        tolerations=tolerations
+    )
+    # Lets the non root spark user write to the mounted spill volumes
+    if fs_group is not None:
+        pod["spec"]["securityContext"] = {"fsGroup": fs_group}
+    # Time the executor gets to decommission once its node is drained
+    if termination_grace_period is not None:
+        pod["spec"]["terminationGracePeriodSeconds"] = termination_grace_period
+    return pod
+
+
+def pod_template_spark_conf(driver_template_uri=None, executor_template_uri=None):
+    """
+    spark-defaults properties pointing the job at the pod templates
+    """
+    conf = {}
+    if driver_template_uri:
+        conf["spark.kubernetes.driver.podTemplateFile"] = driver_template_uri
+    if executor_template_uri:
+        conf["spark.kubernetes.executor.podTemplateFile"] = executor_template_uri
+    return conf
+
+
+def spill_pvc_spark_conf(storage_class, size_limit="100Gi", mount_path="/data/spill"):
+    """
+    spark-defaults properties giving every executor a dynamically provisioned PVC as local dir.
+    Spark uses volumes named `spark-local-dir-*` for shuffle & spill. Needs Spark 3.1+(EMR 6.3+)
+    """
+    vol = "spark.kubernetes.executor.volumes.persistentVolumeClaim.spark-local-dir-1"
+    return {
+        f"{vol}.options.claimName": "OnDemand",
+        f"{vol}.options.storageClass": storage_class,
+        f"{vol}.options.sizeLimit": size_limit,
+        f"{vol}.mount.path": mount_path,
+        f"{vol}.mount.readOnly": "false",
+    }
+
+
+def decommission_spark_conf(fallback_storage_uri=None):
+    """
+    spark-defaults properties for graceful executor decommissioning. On SIGTERM(node drain) the
+    executor stops taking tasks and migrates its shuffle & cached RDD blocks to the other
+    executors, or to the fallback storage, instead of the lost blocks being recomputed.
+    Needs Spark 3.1+(EMR 6.3+)
+    """
+    conf = {
+        "spark.decommission.enabled": "true",
+        "spark.storage.decommission.enabled": "true",
+        "spark.storage.decommission.shuffleBlocks.enabled": "true",
+        "spark.storage.decommission.rddBlocks.enabled": "true",
+    }
+    if fallback_storage_uri:
+        conf["spark.storage.decommission.fallbackStorage.path"] = fallback_storage_uri
+    return conf
+
+
+def kube_api_spark_conf(batch_size=10, batch_delay="2s", polling_interval="120s", max_pending_pods=150):
+    """
+    spark-defaults properties cutting the Kubernetes API calls of the drivers. Executors are
+    requested in larger batches spaced further apart, & the full executor pod list, a safety
+    net behind the pod watch, is polled less often. `maxPendingPods` needs Spark 3.2+(EMR 6.6+),
+    older releases ignore it.
+    """
+    return {
+        "spark.kubernetes.allocation.batch.size": str(batch_size),
+        "spark.kubernetes.allocation.batch.delay": batch_delay,
+        "spark.kubernetes.executor.apiPollingInterval": polling_interval,
+        "spark.kubernetes.allocation.maxPendingPods": str(max_pending_pods),
+    }
@@ -0,0 +1,473 @@
+"""
+Local stand-in for the `emr-containers` API, running the job runs as Spark on Kubernetes.
+
+Serves the job run & virtual cluster calls of the API(`StartJobRun`, `DescribeJobRun`,
+`ListJobRuns`, `CancelJobRun`, `ListVirtualClusters`, `DescribeVirtualCluster`), so boto3 &
+the tools of this repo work against it with `--endpoint-url`.
+
+A job run is started the way the EMR controller does it, as the `emr-containers` user of the
+RBAC that EmrOnEksStack creates: a driver service account & role, a ConfigMap with the pod
+templates, read from the(local) S3 uris of the job, & a Kubernetes Job running
+`spark-submit` in cluster mode with the `spark-defaults` of the job. The execution role is
+assumed through STS, its credentials are handed to the driver & executors, like IRSA does.
+The job run state follows the driver pod.
+
+The open source Spark image has no S3 connector, so other `s3://` confs are left out, &
+only the `spark-defaults` classification is used. The image is the open source release of
+the Spark version in the EMR release of the job run, not the EMR build of it.
+"""
+
+import datetime
+import json
+import logging
+import re
+import shlex
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from stacks.back_end.emr_on_eks_stack.emr_config_profiles import parse_release_label
+from stacks.emr_utils.emr_job_client import JOB_RUN_ACTIVE_STATES, JOB_RUN_TERMINAL_STATES
+from stacks.k8s_utils import flow_control
+from stacks.k8s_utils.pod_templates import SPARK_DRIVER_ROLE_LABELS
+
+
+logger = logging.getLogger("emr_containers_stub")
+
+# Spark minor version of the EMR releases
+# Ref: https://docs.aws.amazon.com/emr/latest/EMR-on-EKS-DevelopmentGuide/emr-eks-releases.html
+EMR_SPARK_VERSIONS = {
+    (6, 3): "3.1", (6, 4): "3.1", (6, 5): "3.1",
+    (6, 6): "3.2", (6, 7): "3.2",
+    (6, 8): "3.3", (6, 9): "3.3", (6, 10): "3.3", (6, 11): "3.3",
+    (6, 12): "3.4", (6, 13): "3.4", (6, 14): "3.4", (6, 15): "3.4",
+}
+# Open source images with PySpark, the last patch release of each minor version
+SPARK_IMAGES = {
+    "3.1": "apache/spark-py:v3.1.3",
+    "3.2": "apache/spark-py:v3.2.1",
+    "3.3": "apache/spark-py:v3.3.2",
+    "3.4": "apache/spark:3.4.1",
+}
+# Releases without an image, the Spark of the default config profile(EMR 6.6)
+DEFAULT_SPARK_IMAGE = SPARK_IMAGES["3.2"]
+POD_TEMPLATES_DIR = "/etc/emr/pod-templates"
+
+# Labels EMR on EKS puts on the Spark pods
+JOB_ID_LABEL = "emr-containers.amazonaws.com/job.id"
+VIRTUAL_CLUSTER_ID_LABEL = "emr-containers.amazonaws.com/virtual-cluster-id"
+
+_JOB_RUNS_RE = re.compile(r"^/virtualclusters/([^/]+)/jobruns(?:/([^/]+))?$")
+_VIRTUAL_CLUSTERS_RE = re.compile(r"^/virtualclusters(?:/([^/]+))?$")
+
+
+class StubError(Exception):
+    def __init__(self, status, error_type, message):
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+
+
+def _epoch(dt):
+    return dt.timestamp() if dt else None
+
+
+def spark_image_for_release(release_label):
+    """
+    Open source Spark image matching the Spark version of an EMR release label
+    """
+    major, minor, _ = parse_release_label(release_label)
+    spark_version = EMR_SPARK_VERSIONS.get((major, minor))
+    if spark_version not in SPARK_IMAGES:
+        logger.warning(
+            f"No open source Spark image for {release_label}, running it on {DEFAULT_SPARK_IMAGE}")
+        return DEFAULT_SPARK_IMAGE
+    return SPARK_IMAGES[spark_version]
+
+
+def _s3_uri(uri):
+    bkt, _, key = uri[len("s3://"):].partition("/")
+    return bkt, key
+
+
+class SparkJobLauncher():
+    """
+    Runs a job run on the cluster, with the permissions of the `emr-containers` user.
+    `spark_image` overrides the image picked from the release label of the job run.
+    """
+
+    def __init__(self, kube, namespace, s3_client, sts_client, spark_image=None, aws_endpoint_in_cluster=None):
+        self.kube = kube
+        self.namespace = namespace
+        self.s3_client = s3_client
+        self.sts_client = sts_client
+        self.spark_image = spark_image
+        self.aws_endpoint_in_cluster = aws_endpoint_in_cluster
+        if spark_image:
+            logger.warning(
+                f"Running every job run on {spark_image}, whatever the Spark version of its release label")
+
+    def job_run_image(self, job_run):
+        return self.spark_image or spark_image_for_release(job_run["releaseLabel"])
+
+    def service_account(self, execution_role_arn, account_id):
+        """
+        Driver service account & role, named like the ones the EMR controller creates,
+        so the trust policy condition of the execution role matches them
+        """
+        role_hash = uuid.uuid5(uuid.NAMESPACE_URL, execution_role_arn).hex[:12]
+        name = f"emr-containers-sa-spark-driver-{account_id}-{role_hash}"
+        self.kube.apply({
+            "apiVersion": "v1",
+            "kind": "ServiceAccount",
+            "metadata": {"name": name, "namespace": self.namespace,
+                         "annotations": {"eks.amazonaws.com/role-arn": execution_role_arn}}
+        })
+        self.kube.apply({
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "Role",
+            "metadata": {"name": name, "namespace": self.namespace},
+            "rules": [{
+                "apiGroups": [""],
+                "resources": ["pods", "services", "configmaps"],
+                "verbs": ["get", "list", "watch", "create", "delete", "deletecollection", "patch"]
+            }]
+        })
+        self.kube.apply({
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "RoleBinding",
+            "metadata": {"name": name, "namespace": self.namespace},
+            "subjects": [{"kind": "ServiceAccount", "name": name, "namespace": self.namespace}],
+            "roleRef": {"kind": "Role", "name": name, "apiGroup": "rbac.authorization.k8s.io"}
+        })
+        return name
+
+    def spark_conf(self, job_run, spark_image):
+        conf = {}
+        for c in job_run.get("configurationOverrides", {}).get("applicationConfiguration", []):
+            if c["classification"] == "spark-defaults":
+                conf.update(c.get("properties", {}))
+            else:
+                logger.info(
+                    f"{job_run['id']}: ignoring the {c['classification']} classification, EMR only")
+
+        pod_templates = {}
+        for side in ("driver", "executor"):
+            key = f"spark.kubernetes.{side}.podTemplateFile"
+            if conf.get(key, "").startswith("s3://"):
+                bkt, obj_key = _s3_uri(conf[key])
+                pod_templates[f"{side}.yaml"] = self.s3_client.get_object(
+                    Bucket=bkt, Key=obj_key)["Body"].read().decode("utf-8")
+                conf[key] = f"{POD_TEMPLATES_DIR}/{side}.yaml"
+        for k in [k for k, v in conf.items() if "s3://" in str(v)]:
+            logger.warning(f"{job_run['id']}: leaving out {k}, no S3 connector in {spark_image}")
+            conf.pop(k)
+        return conf, pod_templates
+
+    def credentials_conf(self, execution_role_arn, job_run_id):
+        creds = self.sts_client.assume_role(
+            RoleArn=execution_role_arn, RoleSessionName=f"emr-job-{job_run_id}")["Credentials"]
+        env = {
+            "AWS_ACCESS_KEY_ID": creds["AccessKeyId"],
+            "AWS_SECRET_ACCESS_KEY": creds["SecretAccessKey"],
+            "AWS_SESSION_TOKEN": creds["SessionToken"],
+        }
+        conf = {}
+        if self.aws_endpoint_in_cluster:
+            env["AWS_ENDPOINT_URL"] = self.aws_endpoint_in_cluster
+            conf["spark.hadoop.fs.s3a.endpoint"] = self.aws_endpoint_in_cluster
+            conf["spark.hadoop.fs.s3a.path.style.access"] = "true"
+        for k, v in env.items():
+            conf[f"spark.kubernetes.driverEnv.{k}"] = v
+            conf[f"spark.executorEnv.{k}"] = v
+        return conf
+
+    def start(self, job_run, account_id):
+        job_run_id = job_run["id"]
+        sa = self.service_account(job_run["executionRoleArn"], account_id)
+        spark_image = self.job_run_image(job_run)
+        logger.info(f"{job_run_id}: {job_run['releaseLabel']} on {spark_image}")
+        conf, pod_templates = self.spark_conf(job_run, spark_image)
+        conf.update(self.credentials_conf(job_run["executionRoleArn"], job_run_id))
+        conf.update({
+            "spark.kubernetes.namespace": self.namespace,
+            "spark.kubernetes.authenticate.driver.serviceAccountName": sa,
+            "spark.kubernetes.container.image": spark_image,
+            f"spark.kubernetes.driver.label.{JOB_ID_LABEL}": job_run_id,
+            f"spark.kubernetes.executor.label.{JOB_ID_LABEL}": job_run_id,
+            f"spark.kubernetes.driver.label.{VIRTUAL_CLUSTER_ID_LABEL}": job_run["virtualClusterId"],
+            f"spark.kubernetes.executor.label.{VIRTUAL_CLUSTER_ID_LABEL}": job_run["virtualClusterId"],
+        })
+
+        name = f"spark-submit-{job_run_id}"
+        self.kube.apply({
+            "apiVersion": "v1",
+            "kind": "ConfigMap",
+            "metadata": {"name": name, "namespace": self.namespace},
+            "data": pod_templates
+        })
+
+        driver = job_run["jobDriver"]["sparkSubmitJobDriver"]
+        command = ["/opt/spark/bin/spark-submit",
+                   "--master", "k8s://https://kubernetes.default.svc",
+                   "--deploy-mode", "cluster",
+                   "--name", job_run["name"] or job_run_id]
+        # Job level parameters win over the configuration overrides, like on EMR
+        for k, v in sorted(conf.items()):
+            command += ["--conf", f"{k}={v}"]
+        command += shlex.split(driver.get("sparkSubmitParameters", ""))
+        command += [driver["entryPoint"], *driver.get("entryPointArguments", [])]
+
+        self.kube.apply({
+            "apiVersion": "batch/v1",
+            "kind": "Job",
+            "metadata": {"name": name, "namespace": self.namespace,
+                         "labels": {JOB_ID_LABEL: job_run_id}},
+            "spec": {
+                "backoffLimit": 0,
+                "template": {
+                    "metadata": {"labels": {JOB_ID_LABEL: job_run_id}},
+                    "spec": {
+                        "serviceAccountName": sa,
+                        "restartPolicy": "Never",
+                        "containers": [{
+                            "name": "spark-submit",
+                            "image": spark_image,
+                            "command": command,
+                            "volumeMounts": [{"name": "pod-templates", "mountPath": POD_TEMPLATES_DIR}]
+                        }],
+                        "volumes": [{"name": "pod-templates", "configMap": {"name": name}}]
+                    }
+                }
+            }
+        })
+
+    def state(self, job_run):
+        """
+        (state, state details) of a started job run, from its driver pod & spark-submit Job
+        """
+        job_run_id = job_run["id"]
+        selector = ",".join(
+            [f"{JOB_ID_LABEL}={job_run_id}", *(f"{k}={v}" for k, v in SPARK_DRIVER_ROLE_LABELS.items())])
+        drivers = self.kube.list_pods(self.namespace, label_selector=selector)
+        if drivers:
+            phase = drivers[0].get("status", {}).get("phase")
+            if phase == "Succeeded":
+                return "COMPLETED", None
+            if phase == "Failed":
+                return "FAILED", f"Driver pod {drivers[0]['metadata']['name']} failed"
+            if phase == "Running":
+                return "RUNNING", None
+            return "SUBMITTED", None
+        job = self.kube.get(
+            f"/apis/batch/v1/namespaces/{self.namespace}/jobs/spark-submit-{job_run_id}")
+        if job.get("status", {}).get("failed"):
+            return "FAILED", "spark-submit failed before starting the driver"
+        return "SUBMITTED", None
+
+    def cancel(self, job_run):
+        job_run_id = job_run["id"]
+        self.kube.delete(f"/apis/batch/v1/namespaces/{self.namespace}/jobs/spark-submit-{job_run_id}",
+                         {"propagationPolicy": "Background"})
+        self.kube.delete(f"/api/v1/namespaces/{self.namespace}/pods",
+                         {"labelSelector": f"{JOB_ID_LABEL}={job_run_id}"})
+
+
+class EmrContainersStub():
+    def __init__(self, launcher, virtual_cluster_id, account_id, region, poll_interval=2):
+        self.launcher = launcher
+        self.virtual_cluster = {
+            "id": virtual_cluster_id,
+            "name": f"local-{virtual_cluster_id}",
+            "arn": f"arn:aws:emr-containers:{region}:{account_id}:/virtualclusters/{virtual_cluster_id}",
+            "state": "RUNNING",
+            "containerProvider": {
+                "type": "EKS",
+                "id": "kind",
+                "info": {"eksInfo": {"namespace": launcher.namespace}}
+            },
+            "createdAt": time.time(),
+        }
+        self.account_id = account_id
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.job_runs = {}
+        self.client_tokens = {}
+
+    def _check_virtual_cluster(self, virtual_cluster_id):
+        if virtual_cluster_id != self.virtual_cluster["id"]:
+            raise StubError(404, "ResourceNotFoundException",
+                            f"Virtual cluster {virtual_cluster_id} doesn't exist.")
+
+    def _job_run(self, virtual_cluster_id, job_run_id):
+        self._check_virtual_cluster(virtual_cluster_id)
+        if job_run_id not in self.job_runs:
+            raise StubError(404, "ResourceNotFoundException",
+                            f"Job run {job_run_id} doesn't exist.")
+        return self.job_runs[job_run_id]
+
+    def _public(self, job_run):
+        return {k: (_epoch(v) if isinstance(v, datetime.datetime) else v)
+                for k, v in job_run.items() if v is not None}
+
+    def start_job_run(self, virtual_cluster_id, body):
+        self._check_virtual_cluster(virtual_cluster_id)
+        for field in ("executionRoleArn", "releaseLabel", "jobDriver"):
+            if field not in body:
+                raise StubError(400, "ValidationException", f"{field} is required")
+        with self.lock:
+            # Same client token, same job run
+            if body.get("clientToken") in self.client_tokens:
+                job_run = self.job_runs[self.client_tokens[body["clientToken"]]]
+            else:
+                job_run_id = uuid.uuid4().hex[:19]
+                job_run = {
+                    "id": job_run_id,
+                    "name": body.get("name"),
+                    "virtualClusterId": virtual_cluster_id,
+                    "arn": f"{self.virtual_cluster['arn']}/jobruns/{job_run_id}",
+                    "state": "PENDING",
+                    "clientToken": body.get("clientToken"),
+                    "executionRoleArn": body["executionRoleArn"],
+                    "releaseLabel": body["releaseLabel"],
+                    "configurationOverrides": body.get("configurationOverrides"),
+                    "jobDriver": body["jobDriver"],
+                    "createdAt": datetime.datetime.now(datetime.timezone.utc),
+                    "createdBy": "local-harness",
+                    "tags": body.get("tags"),
+                }
+                self.job_runs[job_run_id] = job_run
+                if body.get("clientToken"):
+                    self.client_tokens[body["clientToken"]] = job_run_id
+        return {k: job_run[k] for k in ("id", "name", "arn", "virtualClusterId")}
+
+    def describe_job_run(self, virtual_cluster_id, job_run_id):
+        return {"jobRun": self._public(self._job_run(virtual_cluster_id, job_run_id))}
+
+    def list_job_runs(self, virtual_cluster_id, query):
+        self._check_virtual_cluster(virtual_cluster_id)
+        states = query.get("states")
+        created_after = query.get("createdAfter", [None])[0]
+        created_before = query.get("createdBefore", [None])[0]
+        job_runs = []
+        for job_run in sorted(self.job_runs.values(), key=lambda j: j["createdAt"], reverse=True):
+            if states and job_run["state"] not in states:
+                continue
+            if query.get("name") and job_run["name"] != query["name"][0]:
+                continue
+            if created_after and job_run["createdAt"] < datetime.datetime.fromisoformat(created_after.replace("Z", "+00:00")):
+                continue
+            if created_before and job_run["createdAt"] > datetime.datetime.fromisoformat(created_before.replace("Z", "+00:00")):
+                continue
+            job_runs.append(self._public(job_run))
+        return {"jobRuns": job_runs}
+
+    def cancel_job_run(self, virtual_cluster_id, job_run_id):
+        job_run = self._job_run(virtual_cluster_id, job_run_id)
+        if job_run["state"] in JOB_RUN_TERMINAL_STATES:
+            raise StubError(400, "ValidationException",
+                            f"Job run {job_run_id} is already {job_run['state']}")
+        self.launcher.cancel(job_run)
+        self._finish(job_run, "CANCELLED", "Cancelled by the user")
+        return {"id": job_run_id, "virtualClusterId": virtual_cluster_id}
+
+    def _finish(self, job_run, state, details=None):
+        job_run["state"] = state
+        job_run["stateDetails"] = details
+        if state == "FAILED":
+            job_run["failureReason"] = "USER_ERROR"
+        job_run["finishedAt"] = datetime.datetime.now(datetime.timezone.utc)
+        logger.info(f"Job run {job_run['id']} {state}")
+
+    def tick(self):
+        """
+        Start the pending job runs & follow the state of the active ones
+        """
+        for job_run in list(self.job_runs.values()):
+            if job_run["state"] not in JOB_RUN_ACTIVE_STATES:
+                continue
+            try:
+                if job_run["state"] == "PENDING":
+                    self.launcher.start(job_run, self.account_id)
+                    job_run["state"] = "SUBMITTED"
+                    logger.info(f"Job run {job_run['id']} SUBMITTED")
+                    continue
+                state, details = self.launcher.state(job_run)
+                if state in JOB_RUN_TERMINAL_STATES:
+                    self._finish(job_run, state, details)
+                elif state != job_run["state"]:
+                    job_run["state"] = state
+                    logger.info(f"Job run {job_run['id']} {state}")
+            except requests.HTTPError as e:
+                # Ex: the generated RBAC does not let `emr-containers` do what EMR needs
+                self._finish(job_run, "FAILED", f"Kubernetes API: {e}")
+
+    def run(self, stop):
+        while not stop.wait(self.poll_interval):
+            self.tick()
+
+    def handle(self, method, path, query, body):
+        m = _JOB_RUNS_RE.match(path)
+        if m:
+            virtual_cluster_id, job_run_id = m.groups()
+            if method == "POST" and not job_run_id:
+                return self.start_job_run(virtual_cluster_id, body)
+            if method == "GET" and job_run_id:
+                return self.describe_job_run(virtual_cluster_id, job_run_id)
+            if method == "GET":
+                return self.list_job_runs(virtual_cluster_id, query)
+            if method == "DELETE" and job_run_id:
+                return self.cancel_job_run(virtual_cluster_id, job_run_id)
+        m = _VIRTUAL_CLUSTERS_RE.match(path)
+        if m and method == "GET":
+            if m.group(1):
+                self._check_virtual_cluster(m.group(1))
+                return {"virtualCluster": self.virtual_cluster}
+            return {"virtualClusters": [self.virtual_cluster]}
+        raise StubError(404, "ResourceNotFoundException", f"{method} {path} is not stubbed")
+
+
+def serve(stub, host, port):
+    """
+    Serve the stub over HTTP until interrupted
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            logger.debug(fmt % args)
+
+        def _handle(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            try:
+                status, resp = 200, stub.handle(
+                    self.command, url.path, parse_qs(url.query), body)
+            except StubError as e:
+                status, resp = e.status, {"message": str(e)}
+                self.error_type = e.error_type
+            data = json.dumps(resp).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if status >= 400:
+                self.send_header("x-amzn-ErrorType", self.error_type)
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_DELETE = _handle
+
+    stop = threading.Event()
+    threading.Thread(target=stub.run, args=(stop,), daemon=True).start()
+    server = ThreadingHTTPServer((host, port), Handler)
+    logger.info(
+        f"emr-containers stub on http://{host}:{port}, virtual cluster {stub.virtual_cluster['id']} "
+        f"on namespace {stub.launcher.namespace}, as the {flow_control.EMR_CONTROLLER_USER} user")
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        server.server_close()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Local end to end harness: the Kubernetes side of the stacks on a `kind` cluster, with local
+stand-ins for the AWS APIs. A change to the manifests, pod templates or Spark confs of the
+stacks can be checked in minutes, without a deployment to an AWS account.
+
+- `up` creates the kind cluster(`kind_config.yaml`) & points kubectl at it
+- `apply` renders the manifests of the synthesized EmrOnEksStack, EksSsmDaemonSetStack &
+  EksMetricsServerStack from `cdk.out` & applies them to the cluster
+- `stubs` serves S3 & STS(moto), loaded with the objects the stacks upload(pod & job
+  templates), & the emr-containers stub, which runs the job runs as Spark on Kubernetes
+  through the generated RBAC
+- `smoke` runs a Spark job with the default job template through the emr-containers stub
+- `down` deletes the kind cluster
+
+Usage:
+    pip install "moto[server]"
+    cdk synth -c metrics_server=true \
+        -c stacks=emr-on-eks-stack11,ssm-agent-installer-daemonset-stack11,k8s-metrics-server-stack11
+
+    python -m stacks.local_harness.local_harness up
+    kubectl proxy --port 8001 &
+    python -m stacks.local_harness.local_harness apply
+    python -m stacks.local_harness.local_harness stubs &
+    python -m stacks.local_harness.local_harness smoke
+    python -m stacks.local_harness.local_harness down
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import time
+
+import boto3
+import requests
+import yaml
+
+from stacks.emr_utils.emr_job_client import (
+    JOB_RUN_TERMINAL_STATES,
+    build_start_job_run_request,
+    get_emr_client,
+    job_run_duration,
+    load_job_template,
+)
+from stacks.fleet.fleet_spec import DEFAULT_FLEET_MEMBER, stack_names
+from stacks.k8s_utils import flow_control
+from stacks.k8s_utils.kube_api import DEFAULT_API_URL, KubeApi
+from stacks.local_harness import render
+from stacks.local_harness.emr_containers_stub import (
+    EmrContainersStub,
+    SparkJobLauncher,
+    serve,
+)
+
+
+logger = logging.getLogger("local_harness")
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+KIND_CONFIG = os.path.join(HARNESS_DIR, "kind_config.yaml")
+RENDER_DIR = os.path.join("build", "local_harness")
+S3_OBJECTS_FILE = "s3_objects.json"
+
+_names = stack_names(DEFAULT_FLEET_MEMBER)
+DEFAULT_STACKS = [_names["emr_on_eks"],
+                  _names["ssm_daemonset"], _names["metrics_server"]]
+
+# Namespace of the EMR virtual cluster, `EmrOnEksStack.EMR_01_NS_NAME`
+DEFAULT_NAMESPACE = "spark-ns"
+DEFAULT_VIRTUAL_CLUSTER_ID = "local-virtual-cluster"
+DEFAULT_EXECUTION_ROLE_ARN = f"arn:aws:iam::{render.LOCAL_ACCOUNT_ID}:role/local-emr-execution-role"
+DEFAULT_RELEASE_LABEL = "emr-6.6.0-latest"
+
+SMOKE_ENTRY_POINT = "local:///opt/spark/examples/src/main/python/pi.py"
+SMOKE_SPARK_SUBMIT_PARAMETERS = "--conf spark.executor.instances=2 --conf spark.executor.memory=1G --conf spark.executor.cores=1 --conf spark.driver.cores=1"
+
+
+def kind_cluster_name():
+    with open(KIND_CONFIG) as f:
+        return yaml.safe_load(f)["name"]
+
+
+def for_kind(manifest, flow_control_version):
+    """
+    The few changes a manifest needs to run on kind
+    """
+    if manifest["apiVersion"].startswith(f"{flow_control.FLOW_CONTROL_API_GROUP}/") and manifest["apiVersion"] != flow_control_version:
+        return flow_control.convert_api_version(manifest, flow_control_version)
+    # The kubelets of kind serve self signed certificates
+    if manifest["kind"] == "Deployment" and manifest["metadata"]["name"] == "metrics-server":
+        manifest = json.loads(json.dumps(manifest))
+        container = manifest["spec"]["template"]["spec"]["containers"][0]
+        if "--kubelet-insecure-tls" not in container.get("args", []):
+            container["args"] = container.get("args", []) + ["--kubelet-insecure-tls"]
+    return manifest
+
+
+def cmd_up(args):
+    name = kind_cluster_name()
+    clusters = subprocess.run(["kind", "get", "clusters"], check=True,
+                              capture_output=True, text=True).stdout.split()
+    if name in clusters:
+        logger.info(f"kind cluster {name} already exists")
+        return
+    subprocess.run(["kind", "create", "cluster", "--config", KIND_CONFIG], check=True)
+
+
+def cmd_down(args):
+    subprocess.run(["kind", "delete", "cluster", "--name", kind_cluster_name()], check=True)
+
+
+def cmd_apply(args):
+    templates = render.stack_templates(args.cdk_out)
+    kube = KubeApi(args.kube_api_url, args.kube_token, args.kube_ca_bundle)
+    flow_control_version = kube.get(
+        f"/apis/{flow_control.FLOW_CONTROL_API_GROUP}")["preferredVersion"]["groupVersion"]
+    os.makedirs(args.render_dir, exist_ok=True)
+
+    s3_objects = []
+    for stack in args.stacks:
+        if stack not in templates:
+            raise SystemExit(
+                f"{stack} is not in {args.cdk_out}, synthesize it first, Ex: cdk synth -c stacks={stack}")
+        template = render.load_template(templates[stack])
+        manifests = [for_kind(m, flow_control_version)
+                     for m in render.stack_manifests(template)]
+        s3_objects.extend(render.stack_s3_objects(template))
+        with open(os.path.join(args.render_dir, f"{stack}.yaml"), "w") as f:
+            yaml.safe_dump_all(manifests, f, default_flow_style=False)
+        for m in manifests:
+            try:
+                kube.apply(m, field_manager="local-harness")
+            except requests.HTTPError as e:
+                raise SystemExit(
+                    f"{stack}: {m['kind']} {m['metadata']['name']} failed: {e.response.text}")
+        logger.info(f"Applied {len(manifests)} objects of {stack}")
+
+    with open(os.path.join(args.render_dir, S3_OBJECTS_FILE), "w") as f:
+        json.dump(s3_objects, f, indent=2)
+    logger.info(
+        f"Rendered {len(s3_objects)} S3 objects for the stubs, into {args.render_dir}")
+
+
+def _aws_client(service, endpoint_url, region):
+    return boto3.client(service, endpoint_url=endpoint_url, region_name=region)
+
+
+def cmd_stubs(args):
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise SystemExit('The S3 & STS stand-ins need moto, pip install "moto[server]"')
+    # moto takes any credentials
+    for k in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(k, "local-harness")
+
+    moto = ThreadedMotoServer(ip_address=args.host, port=args.aws_port)
+    moto.start()
+    aws_endpoint_url = f"http://127.0.0.1:{args.aws_port}"
+    s3_client = _aws_client("s3", aws_endpoint_url, args.region)
+
+    with open(os.path.join(args.render_dir, S3_OBJECTS_FILE)) as f:
+        s3_objects = json.load(f)
+    for bkt in sorted({o["Bucket"] for o in s3_objects}):
+        s3_client.create_bucket(Bucket=bkt)
+    for o in s3_objects:
+        s3_client.put_object(Bucket=o["Bucket"], Key=o["Key"], Body=o["Body"].encode("utf-8"))
+    logger.info(
+        f"S3 & STS on {aws_endpoint_url}, loaded {len(s3_objects)} objects of the stacks")
+
+    launcher = SparkJobLauncher(
+        KubeApi(args.kube_api_url, args.kube_token, args.kube_ca_bundle,
+                impersonate=flow_control.EMR_CONTROLLER_USER),
+        namespace=args.namespace,
+        s3_client=s3_client,
+        sts_client=_aws_client("sts", aws_endpoint_url, args.region),
+        spark_image=args.spark_image,
+        aws_endpoint_in_cluster=args.aws_endpoint_in_cluster
+    )
+    stub = EmrContainersStub(
+        launcher, args.virtual_cluster_id, render.LOCAL_ACCOUNT_ID, args.region)
+    try:
+        serve(stub, args.host, args.emr_port)
+    finally:
+        moto.stop()
+
+
+def default_job_template_uri(render_dir):
+    with open(os.path.join(render_dir, S3_OBJECTS_FILE)) as f:
+        s3_objects = json.load(f)
+    for o in s3_objects:
+        if o["Key"].endswith("job_templates/default.json"):
+            return f"s3://{o['Bucket']}/{o['Key']}"
+    raise SystemExit("No default job template in the rendered S3 objects")
+
+
+def cmd_smoke(args):
+    aws_endpoint_url = f"http://127.0.0.1:{args.aws_port}"
+    for k in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(k, "local-harness")
+    job_template = load_job_template(
+        args.job_template or default_job_template_uri(args.render_dir),
+        _aws_client("s3", aws_endpoint_url, args.region))
+
+    emr_client = get_emr_client(args.region, f"http://127.0.0.1:{args.emr_port}")
+    req = build_start_job_run_request(
+        virtual_cluster_id=args.virtual_cluster_id,
+        execution_role_arn=DEFAULT_EXECUTION_ROLE_ARN,
+        release_label=job_template.get("releaseLabel", DEFAULT_RELEASE_LABEL),
+        name="local-smoke",
+        entry_point=args.entry_point,
+        entry_point_arguments=args.entry_point_arguments,
+        spark_submit_parameters=args.spark_submit_parameters,
+        configuration_overrides=job_template["configurationOverrides"],
+        tags={"harness": "local"}
+    )
+    job_run_id = emr_client.start_job_run(**req)["id"]
+    logger.info(f"Submitted smoke job run {job_run_id}")
+
+    deadline = time.monotonic() + args.timeout
+    while True:
+        job_run = emr_client.describe_job_run(
+            id=job_run_id, virtualClusterId=args.virtual_cluster_id)["jobRun"]
+        if job_run["state"] in JOB_RUN_TERMINAL_STATES:
+            break
+        if time.monotonic() > deadline:
+            emr_client.cancel_job_run(id=job_run_id, virtualClusterId=args.virtual_cluster_id)
+            raise SystemExit(f"Smoke job run {job_run_id} did not finish in {args.timeout}s")
+        time.sleep(args.poll_interval)
+    if job_run["state"] != "COMPLETED":
+        raise SystemExit(
+            f"Smoke job run {job_run_id} ended as {job_run['state']}: {job_run.get('stateDetails', '')}")
+    logger.info(f"Smoke job run {job_run_id} completed in {job_run_duration(job_run):.0f}s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run the Kubernetes side of the stacks on kind, with local AWS stand-ins")
+    parser.add_argument("--render-dir", default=RENDER_DIR)
+    parser.add_argument("--region", default=render.LOCAL_REGION)
+    parser.add_argument("--aws-port", type=int, default=5000,
+                        help="Port of the S3 & STS stand-ins")
+    parser.add_argument("--emr-port", type=int, default=8090,
+                        help="Port of the emr-containers stub")
+    parser.add_argument("--virtual-cluster-id", default=DEFAULT_VIRTUAL_CLUSTER_ID)
+    parser.add_argument("--kube-api-url", default=DEFAULT_API_URL,
+                        help="Kubernetes API, defaults to `kubectl proxy`")
+    parser.add_argument("--kube-token")
+    parser.add_argument("--kube-ca-bundle")
+    parser.add_argument("--log-level", default="INFO")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("up", help="Create the kind cluster").set_defaults(func=cmd_up)
+    sub.add_parser("down", help="Delete the kind cluster").set_defaults(func=cmd_down)
+
+    apply = sub.add_parser(
+        "apply", help="Render the manifests of the synthesized stacks & apply them")
+    apply.add_argument("--cdk-out", default="cdk.out")
+    apply.add_argument("--stacks", nargs="+", default=DEFAULT_STACKS)
+    apply.set_defaults(func=cmd_apply)
+
+    stubs = sub.add_parser(
+        "stubs", help="Serve the S3, STS & emr-containers stand-ins")
+    stubs.add_argument("--host", default="0.0.0.0")
+    stubs.add_argument("--namespace", default=DEFAULT_NAMESPACE)
+    stubs.add_argument("--spark-image",
+                       help="Run every job run on this image, instead of the one matching its release label")
+    stubs.add_argument("--aws-endpoint-in-cluster",
+                       help="S3 & STS stand-ins as seen from the pods, Ex: http://172.18.0.1:5000")
+    stubs.set_defaults(func=cmd_stubs)
+
+    smoke = sub.add_parser(
+        "smoke", help="Run a Spark job with the default job template")
+    smoke.add_argument("--job-template",
+                       help="s3:// uri(on the stand-in) or local path, defaults to the default job template of the stacks")
+    smoke.add_argument("--entry-point", default=SMOKE_ENTRY_POINT)
+    smoke.add_argument("--entry-point-arguments", nargs="*", default=["10"])
+    smoke.add_argument("--spark-submit-parameters",
+                       default=SMOKE_SPARK_SUBMIT_PARAMETERS)
+    smoke.add_argument("--timeout", type=int, default=600)
+    smoke.add_argument("--poll-interval", type=int, default=5)
+    smoke.set_defaults(func=cmd_smoke)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Kubernetes manifests & S3 objects of the synthesized stacks, for the local harness.
+
+Reads the CloudFormation templates in `cdk.out`. The `KubernetesManifest` custom resources
+give the manifests, the `AwsCustomResource` S3 `putObject` calls give the objects the
+stacks upload(pod & job templates). The intrinsic functions are resolved locally: pseudo
+parameters get the local account/region, the other references(Ex: roles, buckets exported
+by another stack) a stable `local-<hash>` placeholder, the same one everywhere it is used.
+So the bucket of a job template & the `s3://` uris of its pod templates still match.
+"""
+
+import hashlib
+import json
+import os
+
+
+KUBERNETES_RESOURCE_TYPE = "Custom::AWSCDK-EKS-KubernetesResource"
+AWS_SDK_RESOURCE_TYPE = "Custom::AWS"
+
+# moto's default account
+LOCAL_ACCOUNT_ID = "123456789012"
+LOCAL_REGION = "us-east-1"
+
+PSEUDO_PARAMETERS = {
+    "AWS::AccountId": LOCAL_ACCOUNT_ID,
+    "AWS::Region": LOCAL_REGION,
+    "AWS::Partition": "aws",
+    "AWS::URLSuffix": "amazonaws.com",
+    "AWS::NoValue": None,
+}
+
+# Apply order, so namespaces & RBAC exist before what uses them
+KIND_ORDER = [
+    "Namespace",
+    "CustomResourceDefinition",
+    "PriorityLevelConfiguration",
+    "FlowSchema",
+    "ServiceAccount",
+    "ClusterRole",
+    "Role",
+    "ClusterRoleBinding",
+    "RoleBinding",
+    "ConfigMap",
+    "Secret",
+    "StorageClass",
+    "Service",
+]
+
+
+def placeholder(token):
+    """
+    Stable, S3 bucket & DNS-1123 safe, stand-in for an unresolvable reference
+    """
+    return "local-" + hashlib.sha1(json.dumps(token, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def resolve(value):
+    """
+    Resolve the intrinsic functions of a template value
+    """
+    if isinstance(value, list):
+        return [resolve(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        fn, arg = next(iter(value.items()))
+        if fn == "Ref":
+            return PSEUDO_PARAMETERS[arg] if arg in PSEUDO_PARAMETERS else placeholder(value)
+        if fn in ("Fn::GetAtt", "Fn::ImportValue"):
+            return placeholder(value)
+        if fn == "Fn::Join":
+            sep, parts = arg
+            return resolve(sep).join(str(resolve(p)) for p in resolve(parts))
+        if fn == "Fn::Select":
+            index, items = arg
+            return resolve(items)[int(resolve(index))]
+        if fn == "Fn::Split":
+            sep, source = arg
+            return str(resolve(source)).split(resolve(sep))
+        if fn == "Fn::Sub":
+            template, variables = (arg, {}) if isinstance(arg, str) else arg
+            for name, v in variables.items():
+                template = template.replace(f"${{{name}}}", str(resolve(v)))
+            for name, v in PSEUDO_PARAMETERS.items():
+                template = template.replace(f"${{{name}}}", str(v))
+            return template
+    return {k: resolve(v) for k, v in value.items()}
+
+
+def stack_templates(cdk_out):
+    """
+    Stack name: template path, from the cloud assembly manifest
+    """
+    with open(os.path.join(cdk_out, "manifest.json")) as f:
+        assembly = json.load(f)
+    templates = {}
+    for artifact_id, artifact in assembly.get("artifacts", {}).items():
+        if artifact.get("type") != "aws:cloudformation:stack":
+            continue
+        props = artifact.get("properties", {})
+        templates[props.get("stackName", artifact_id)] = os.path.join(
+            cdk_out, props["templateFile"])
+    return templates
+
+
+def load_template(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _resources(template, resource_type):
+    return [r["Properties"] for r in template.get("Resources", {}).values() if r.get("Type") == resource_type]
+
+
+def _kind_rank(manifest):
+    kind = manifest.get("kind")
+    return KIND_ORDER.index(kind) if kind in KIND_ORDER else len(KIND_ORDER)
+
+
+def stack_manifests(template):
+    """
+    Kubernetes objects of the stack, in apply order
+    """
+    manifests = []
+    for props in _resources(template, KUBERNETES_RESOURCE_TYPE):
+        manifest = resolve(props.get("Manifest"))
+        if isinstance(manifest, str):
+            manifest = json.loads(manifest)
+        manifests.extend(m for m in manifest if m)
+    return sorted(manifests, key=_kind_rank)
+
+
+def stack_s3_objects(template):
+    """
+    `{"Bucket", "Key", "Body"}` of the S3 putObject calls of the stack
+    """
+    objects = []
+    for props in _resources(template, AWS_SDK_RESOURCE_TYPE):
+        call = resolve(props.get("Create"))
+        if isinstance(call, str):
+            call = json.loads(call)
+        if call and call.get("service") == "S3" and call.get("action") == "putObject":
+            params = call["parameters"]
+            objects.append({k: params[k] for k in ("Bucket", "Key", "Body")})
+    return objects
@@ -0,0 +1,232 @@
+import datetime
+import time
+
+import pytest
+
+from stacks.emr_utils.cost_report.cost_report import (
+    JOB_ID_LABEL,
+    SPARK_ROLE_LABEL,
+    CostStore,
+    PriceTable,
+    collect_pods,
+    job_report,
+    sync_job_runs,
+    tenant_report,
+)
+
+PRICES = PriceTable({
+    "default_spot_discount": 0.5,
+    "instances": {
+        "m5.xlarge": {"on_demand": 0.2},
+        "m6g.xlarge": {"on_demand": 0.16, "spot": 0.05},
+    },
+    "fargate": {"vcpu_hour": 0.04, "gb_hour": 0.004},
+})
+
+# 2026-10-01T12:00:00Z
+NOW = 1790856000.0
+
+
+class FakeEmrClient():
+    """
+    Stand-in for the emr-containers client, `list_job_runs` pages through the job runs
+    created after `createdAfter` like the real API does
+    """
+
+    def __init__(self, job_runs=()):
+        self.job_runs = {jr["id"]: dict(jr) for jr in job_runs}
+        self.created_after = []
+
+    def get_paginator(self, operation):
+        assert operation == "list_job_runs"
+        return self
+
+    def paginate(self, virtualClusterId, createdAfter):
+        since = createdAfter.replace(tzinfo=datetime.timezone.utc).timestamp()
+        self.created_after.append(since)
+        runs = [jr for jr in self.job_runs.values() if jr["createdAt"] >= since]
+        return [{"jobRuns": runs[i:i + 2]} for i in range(0, len(runs), 2)]
+
+
+class FakeKube():
+    """
+    Stand-in for the Kubernetes API of one namespace, with or without the metrics server
+    """
+
+    def __init__(self, nodes, pods, metrics=None, team="red-shirts"):
+        self.nodes = nodes
+        self.pods = pods
+        self.metrics = metrics
+        self.team = team
+
+    def get_namespace(self, namespace):
+        return {"metadata": {"name": namespace, "labels": {"team": self.team}}}
+
+    def list_nodes(self):
+        return self.nodes
+
+    def list_pod_metrics(self, namespace):
+        return self.metrics
+
+    def list_pods(self, namespace, label_selector=None):
+        assert label_selector == JOB_ID_LABEL
+        return self.pods
+
+
+def _job_run(id, created_at, state="RUNNING", finished_at=None):
+    return {"id": id, "name": f"job-{id}", "state": state, "createdAt": created_at, "finishedAt": finished_at}
+
+
+def _node(name, instance_type="m5.xlarge", capacity_type="ON_DEMAND", cpu="4", memory="16Gi", **labels):
+    if capacity_type:
+        labels["eks.amazonaws.com/capacityType"] = capacity_type
+    return {
+        "metadata": {"name": name, "labels": {"node.kubernetes.io/instance-type": instance_type, **labels}},
+        "status": {"allocatable": {"cpu": cpu, "memory": memory}},
+    }
+
+
+def _pod(name, node_name, job_id="jr-1", role="executor", cpu="1", memory="2Gi", started=NOW - 600):
+    return {
+        "metadata": {
+            "uid": f"uid-{name}",
+            "name": name,
+            "labels": {JOB_ID_LABEL: job_id, SPARK_ROLE_LABEL: role},
+        },
+        "spec": {
+            "nodeName": node_name,
+            "containers": [{"resources": {"requests": {"cpu": cpu, "memory": memory}}}],
+        },
+        "status": {
+            "phase": "Running",
+            "startTime": datetime.datetime.utcfromtimestamp(started).isoformat() + "Z",
+        },
+    }
+
+
+def _usage(name, cpu, memory):
+    return {"metadata": {"name": name}, "containers": [{"usage": {"cpu": cpu, "memory": memory}}]}
+
+
+def _pod_costs(store):
+    return {r["name"]: r["cost"] for r in store.conn.execute("SELECT name, cost FROM pods")}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CostStore(str(tmp_path / "cost_report.db"))
+
+
+def test_job_run_finishing_between_two_syncs_is_updated(store):
+    started = float(int(time.time()) - 3600)
+    emr_client = FakeEmrClient([_job_run("jr-1", started), _job_run("jr-2", started + 60, "COMPLETED", started + 600)])
+    sync_job_runs(store, emr_client, "vc-1")
+
+    emr_client.job_runs["jr-1"].update(state="COMPLETED", finishedAt=time.time())
+    sync_job_runs(store, emr_client, "vc-1")
+
+    # The second sync pages again from the unfinished job run, not from the watermark
+    assert emr_client.created_after[1] == started
+    states = dict(store.conn.execute("SELECT id, state FROM job_runs").fetchall())
+    assert states == {"jr-1": "COMPLETED", "jr-2": "COMPLETED"}
+
+
+def test_sync_resumes_from_the_watermark_once_every_run_finished(store):
+    started = time.time() - 3600
+    emr_client = FakeEmrClient([_job_run("jr-1", started, "COMPLETED", started + 600)])
+    before = time.time()
+    sync_job_runs(store, emr_client, "vc-1")
+    sync_job_runs(store, emr_client, "vc-1")
+
+    assert emr_client.created_after[1] >= before
+    assert store.conn.execute("SELECT COUNT(*) FROM job_runs").fetchone()[0] == 1
+
+
+def test_collect_rerun_does_not_double_count(store):
+    kube = FakeKube([_node("n1")], [_pod("exec-1", "n1")])
+
+    collect_pods(store, kube, PRICES, "spark-ns", now=NOW)
+    collect_pods(store, kube, PRICES, "spark-ns", now=NOW)
+
+    # 10 minutes of a quarter(1 of 4 vCPU) of a $0.2/h node
+    assert _pod_costs(store) == {"exec-1": pytest.approx(0.25 * 0.2 / 6)}
+    [tenant] = tenant_report(store, "2026-10-01")
+    assert tenant["tenant"] == "red-shirts"
+    assert tenant["req_cpu_h"] == pytest.approx(1 / 6)
+    assert tenant["cost"] == pytest.approx(0.25 * 0.2 / 6)
+
+
+def test_collect_adds_the_time_since_the_previous_sample(store):
+    kube = FakeKube([_node("n1")], [_pod("exec-1", "n1")], metrics=[_usage("exec-1", "500m", "1Gi")])
+
+    collect_pods(store, kube, PRICES, "spark-ns", now=NOW)
+    collect_pods(store, kube, PRICES, "spark-ns", now=NOW + 300)
+    # Nothing sampled in between, only `max_gap` is credited
+    collect_pods(store, kube, PRICES, "spark-ns", max_gap=900, now=NOW + 3600)
+
+    pod = dict(store.conn.execute("SELECT * FROM pods").fetchone())
+    assert pod["req_cpu_s"] == pytest.approx(600 + 300 + 900)
+    assert pod["used_cpu_s"] == pytest.approx(0.5 * 1800)
+    [tenant] = tenant_report(store, "2026-10-01")
+    assert tenant["req_cpu_h"] == pytest.approx(0.5)
+    assert tenant["cpu_efficiency"] == pytest.approx(0.5)
+    assert tenant["mem_efficiency"] == pytest.approx(0.5)
+
+
+def test_spot_and_fargate_pricing(store):
+    kube = FakeKube(
+        nodes=[
+            _node("spot-discount", capacity_type="SPOT"),
+            _node("spot-priced", instance_type="m6g.xlarge", capacity_type="SPOT"),
+            _node("on-demand"),
+            _node("fargate-ip-10-0-0-1", instance_type=None, capacity_type=None,
+                  **{"eks.amazonaws.com/compute-type": "fargate"}),
+        ],
+        pods=[
+            _pod("exec-spot-discount", "spot-discount"),
+            # Memory is the larger share, 8 of 16 GiB
+            _pod("exec-spot-priced", "spot-priced", memory="8Gi"),
+            _pod("exec-on-demand", "on-demand"),
+            _pod("driver-fargate", "fargate-ip-10-0-0-1", role="driver", cpu="2", memory="4Gi"),
+        ],
+    )
+
+    collect_pods(store, kube, PRICES, "spark-ns", now=NOW)
+
+    assert _pod_costs(store) == {
+        "exec-spot-discount": pytest.approx(0.25 * 0.2 * 0.5 / 6),
+        "exec-spot-priced": pytest.approx(0.5 * 0.05 / 6),
+        "exec-on-demand": pytest.approx(0.25 * 0.2 / 6),
+        "driver-fargate": pytest.approx((2 * 0.04 + 4 * 0.004) / 6),
+    }
+    capacity_types = dict(store.conn.execute("SELECT name, capacity_type FROM pods").fetchall())
+    assert capacity_types["exec-spot-priced"] == "SPOT"
+    assert capacity_types["driver-fargate"] == "FARGATE"
+
+
+def test_node_without_a_capacity_type_is_not_priced_on_demand(store):
+    kube = FakeKube([_node("self-managed", capacity_type=None)], [_pod("exec-1", "self-managed")])
+
+    collect_pods(store, kube, PRICES, "spark-ns", now=NOW)
+
+    pod = dict(store.conn.execute("SELECT * FROM pods").fetchone())
+    assert (pod["capacity_type"], pod["cost"]) == (None, 0.0)
+    assert pod["req_cpu_s"] == pytest.approx(600)
+
+
+def test_job_report_flags_over_provisioned_executors(store):
+    kube = FakeKube(
+        [_node("n1")],
+        [_pod("exec-1", "n1", memory="8Gi"), _pod("driver", "n1", role="driver")],
+        metrics=[_usage("exec-1", "900m", "2Gi"), _usage("driver", "1", "2Gi")],
+    )
+    emr_client = FakeEmrClient([_job_run("jr-1", time.time() - 3600)])
+    sync_job_runs(store, emr_client, "vc-1")
+
+    collect_pods(store, kube, PRICES, "spark-ns", now=NOW)
+
+    [job] = job_report(store, NOW - 3600)
+    assert (job["job_id"], job["name"], job["executors"]) == ("jr-1", "job-jr-1", 1)
+    assert job["mem_efficiency"] == pytest.approx(0.25)
+    assert job["over_provisioned"]
+    assert job["suggested_executor_memory_gib"] == 2.4
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from stacks.emr_utils.dag_runner.dag_runner import (
+    FAILED,
+    PENDING,
+    RUNNING,
+    SUCCEEDED,
+    UPSTREAM_FAILED,
+    CheckpointStore,
+    DagRunner,
+    DagValidationError,
+)
+
+
+class FakeEmrClient():
+    """
+    Stand-in for the emr-containers client. Every job run reports RUNNING for
+    `running_polls` describe calls, then the next outcome scripted for its job.
+    """
+
+    def __init__(self, dag_name, outcomes=None, running_polls=1):
+        self.dag_name = dag_name
+        self.outcomes = {k: list(v) for k, v in (outcomes or {}).items()}
+        self.running_polls = running_polls
+        self.events = []
+        self.requests = []
+        self.active = {}
+        self.max_active = {}
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def _job(self, run_name):
+        return run_name[len(self.dag_name) + 1:]
+
+    def start_job_run(self, **req):
+        with self._lock:
+            self.requests.append(req)
+            run_id = f"jr-{len(self._runs) + 1}"
+            job, tenant = self._job(req["name"]), req["tags"]["tenant"]
+            outcome = (self.outcomes.get(job) or ["COMPLETED"]).pop(0)
+            self._runs[run_id] = {"job": job, "tenant": tenant, "outcome": outcome, "polls": 0}
+            self.events.append(("start", job))
+            self.active[tenant] = self.active.get(tenant, 0) + 1
+            self.max_active[tenant] = max(self.max_active.get(tenant, 0), self.active[tenant])
+        return {"id": run_id}
+
+    def describe_job_run(self, id, virtualClusterId):
+        with self._lock:
+            run = self._runs[id]
+            run["polls"] += 1
+            if run["polls"] <= self.running_polls:
+                return {"jobRun": {"id": id, "state": "RUNNING"}}
+            if "done" not in run:
+                run["done"] = True
+                self.events.append(("end", run["job"]))
+                self.active[run["tenant"]] -= 1
+            return {"jobRun": {"id": id, "state": run["outcome"]}}
+
+    def starts(self, job=None):
+        return [j for e, j in self.events if e == "start" and job in (None, j)]
+
+
+def _job(name, depends_on=(), **opts):
+    return {"name": name, "entry_point": f"s3://bkt/{name}.py", "depends_on": list(depends_on), **opts}
+
+
+def _run(dag, client, checkpoint_store=None):
+    runner = DagRunner(
+        dag,
+        emr_client=client,
+        virtual_cluster_id="vc-1",
+        execution_role_arn="arn:aws:iam::123456789012:role/emr",
+        checkpoint_store=checkpoint_store,
+        poll_interval=0,
+        retry_backoff=0
+    )
+    return runner, asyncio.run(runner.run())
+
+
+def test_submits_a_node_once_its_dependencies_succeeded():
+    dag = {
+        "dag_name": "daily",
+        "concurrency": {"default": 4},
+        "jobs": [_job("extract"), _job("dims"), _job("load", ["extract", "dims"])],
+    }
+    client = FakeEmrClient("daily", running_polls=2)
+
+    _, result = _run(dag, client)
+
+    assert result == {"extract": SUCCEEDED, "dims": SUCCEEDED, "load": SUCCEEDED}
+    events = client.events
+    # Independent roots run side by side, the join waits for both
+    assert events.index(("start", "dims")) < events.index(("end", "extract"))
+    assert events.index(("start", "load")) > events.index(("end", "extract"))
+    assert events.index(("start", "load")) > events.index(("end", "dims"))
+
+
+def test_retries_a_failed_job_up_to_max_attempts():
+    dag = {
+        "dag_name": "daily",
+        "jobs": [_job("flaky", max_attempts=3), _job("broken", max_attempts=2)],
+    }
+    client = FakeEmrClient("daily", outcomes={
+        "flaky": ["FAILED", "CANCELLED", "COMPLETED"],
+        "broken": ["FAILED", "FAILED", "COMPLETED"],
+    })
+
+    runner, result = _run(dag, client)
+
+    assert result == {"flaky": SUCCEEDED, "broken": FAILED}
+    assert len(client.starts("flaky")) == 3
+    assert len(client.starts("broken")) == 2
+    assert runner.state["nodes"]["broken"]["attempts"] == 2
+
+
+def test_failure_marks_every_downstream_node_upstream_failed():
+    dag = {
+        "dag_name": "daily",
+        "defaults": {"max_attempts": 1},
+        "jobs": [
+            _job("extract"),
+            _job("transform", ["extract"]),
+            _job("load", ["transform"]),
+            _job("side"),
+        ],
+    }
+    client = FakeEmrClient("daily", outcomes={"extract": ["FAILED"]})
+
+    _, result = _run(dag, client)
+
+    assert result == {
+        "extract": FAILED,
+        "transform": UPSTREAM_FAILED,
+        "load": UPSTREAM_FAILED,
+        "side": SUCCEEDED,
+    }
+    assert client.starts("transform") == client.starts("load") == []
+
+
+def test_tenant_concurrency_limits():
+    dag = {
+        "dag_name": "daily",
+        "concurrency": {"default": 2, "red-shirts": 1},
+        "jobs": (
+            [_job(f"red{i}", tenant="red-shirts") for i in range(4)]
+            + [_job(f"blue{i}", tenant="blue-shirts") for i in range(4)]
+        ),
+    }
+    client = FakeEmrClient("daily", running_polls=3)
+
+    _, result = _run(dag, client)
+
+    assert set(result.values()) == {SUCCEEDED}
+    assert client.max_active == {"red-shirts": 1, "blue-shirts": 2}
+
+
+def test_resume_from_checkpoint(tmp_path):
+    checkpoint = CheckpointStore(str(tmp_path / "daily.json"))
+    checkpoint.save({
+        "dag_name": "daily",
+        "nodes": {
+            "extract": {"state": SUCCEEDED, "attempts": 1, "job_run_id": "jr-old-1"},
+            "transform": {"state": FAILED, "attempts": 3, "job_run_id": "jr-old-2"},
+            "load": {"state": UPSTREAM_FAILED, "attempts": 0, "job_run_id": None},
+            "report": {"state": RUNNING, "attempts": 1, "job_run_id": "jr-1"},
+        }
+    })
+    dag = {
+        "dag_name": "daily",
+        "jobs": [
+            _job("extract"),
+            _job("transform", ["extract"], max_attempts=3),
+            _job("load", ["transform"]),
+            _job("report"),
+        ],
+    }
+    client = FakeEmrClient("daily")
+    # The job run `report` was waiting on when the previous run stopped
+    client._runs["jr-1"] = {"job": "report", "tenant": "default", "outcome": "COMPLETED", "polls": 0}
+
+    runner = DagRunner(dag, client, "vc-1", "arn:aws:iam::123456789012:role/emr",
+                       checkpoint_store=checkpoint, poll_interval=0, retry_backoff=0)
+    # Failures get a fresh attempt budget, the rest is kept as is
+    nodes = runner.state["nodes"]
+    assert nodes["extract"]["state"] == SUCCEEDED
+    assert (nodes["transform"]["state"], nodes["transform"]["attempts"]) == (PENDING, 0)
+    assert (nodes["load"]["state"], nodes["load"]["attempts"]) == (PENDING, 0)
+    assert nodes["report"]["job_run_id"] == "jr-1"
+
+    result = asyncio.run(runner.run())
+
+    assert set(result.values()) == {SUCCEEDED}
+    assert client.starts() == ["transform", "load"]
+    with open(tmp_path / "daily.json") as f:
+        assert json.load(f)["nodes"]["transform"]["attempts"] == 1
+
+
+def test_checkpoint_of_another_dag_is_ignored(tmp_path):
+    checkpoint = CheckpointStore(str(tmp_path / "cp.json"))
+    checkpoint.save({"dag_name": "weekly", "nodes": {"extract": {"state": SUCCEEDED, "attempts": 1}}})
+
+    runner = DagRunner({"dag_name": "daily", "jobs": [_job("extract")]},
+                       FakeEmrClient("daily"), "vc-1", "arn", checkpoint_store=checkpoint)
+
+    assert runner.state["nodes"]["extract"]["state"] == PENDING
+
+
+def test_release_label_and_overrides_come_from_the_job_template():
+    template = {
+        "releaseLabel": "emr-6.6.0-latest",
+        "configurationOverrides": {"applicationConfiguration": [{"classification": "spark-defaults"}]},
+    }
+    dag = {"dag_name": "daily", "jobs": [_job("extract"), _job("legacy", release_label="emr-6.3.0-latest")]}
+    client = FakeEmrClient("daily")
+
+    runner = DagRunner(dag, client, "vc-1", "arn", poll_interval=0, job_template=template)
+    asyncio.run(runner.run())
+
+    reqs = {client._job(r["name"]): r for r in client.requests}
+    assert reqs["extract"]["releaseLabel"] == "emr-6.6.0-latest"
+    assert reqs["extract"]["configurationOverrides"] == template["configurationOverrides"]
+    assert reqs["legacy"]["releaseLabel"] == "emr-6.3.0-latest"
+    # A release pinned by the DAG wins over the template
+    assert DagRunner({**dag, "release_label": "emr-6.5.0-latest"}, client, "vc-1", "arn",
+                     job_template=template).release_label == "emr-6.5.0-latest"
+
+
+@pytest.mark.parametrize("jobs", [
+    [_job("a", ["missing"])],
+    [_job("a", ["b"]), _job("b", ["a"])],
+    [_job("a"), _job("a")],
+])
+def test_invalid_dags_are_rejected(jobs):
+    with pytest.raises(DagValidationError):
+        DagRunner({"dag_name": "bad", "jobs": jobs}, FakeEmrClient("bad"), "vc-1", "arn")
@@ -0,0 +1,235 @@
+import uuid
+
+from botocore.exceptions import ClientError
+
+from stacks.emr_utils.admission_governor.governor import (
+    ADMITTED,
+    QUEUED,
+    REJECTED,
+    Governor,
+    JobQueue,
+    capacity_snapshot,
+)
+
+GiB = 2 ** 30
+
+
+class FakeKube():
+    """
+    Stand-in for the Kubernetes API, serves the node & pod lists it is given
+    """
+
+    def __init__(self, nodes, pods=()):
+        self.nodes = list(nodes)
+        self.pods = list(pods)
+
+    def list_nodes(self):
+        return self.nodes
+
+    def list_pods(self):
+        return self.pods
+
+
+class FakeEmrClient():
+    """
+    Stand-in for the emr-containers client. `start_job_run` raises the scripted errors first,
+    a client token seen before gets its job run back instead of a new one.
+    """
+
+    def __init__(self, active_job_runs=0, errors=()):
+        self.active_job_runs = active_job_runs
+        self.errors = list(errors)
+        self.requests = []
+        self.job_runs = {}
+
+    def get_paginator(self, operation):
+        assert operation == "list_job_runs"
+        return self
+
+    def paginate(self, virtualClusterId, states):
+        runs = [{"id": f"jr-active-{i}"} for i in range(self.active_job_runs)]
+        return [{"jobRuns": runs[:1]}, {"jobRuns": runs[1:]}]
+
+    def start_job_run(self, **req):
+        self.requests.append(req)
+        if self.errors:
+            code = self.errors.pop(0)
+            raise ClientError({"Error": {"Code": code, "Message": code}}, "StartJobRun")
+        token = req["clientToken"]
+        if token not in self.job_runs:
+            self.job_runs[token] = f"jr-{len(self.job_runs) + 1}"
+        return {"id": self.job_runs[token]}
+
+
+def _node(name, cpu="8", memory="32Gi", ready="True", **labels):
+    return {
+        "metadata": {"name": name, "labels": labels},
+        "spec": {},
+        "status": {
+            "allocatable": {"cpu": cpu, "memory": memory},
+            "conditions": [{"type": "Ready", "status": ready}],
+        },
+    }
+
+
+def _pod(namespace, node_name=None, cpu="1", memory="4Gi", phase="Running"):
+    return {
+        "metadata": {"namespace": namespace},
+        "spec": {
+            "nodeName": node_name,
+            "containers": [{"resources": {"requests": {"cpu": cpu, "memory": memory}}}],
+        },
+        "status": {"phase": phase},
+    }
+
+
+def _ns_cfg(**overrides):
+    return {
+        "virtual_cluster_id": "vc-1",
+        "execution_role_arn": "arn:aws:iam::123456789012:role/emr",
+        "job_footprint": {"cpu": 3.0, "memory": 8.0 * GiB},
+        "max_concurrent_jobs": 10,
+        "min_concurrent_jobs": 1,
+        "max_pending_pods": 10,
+        **overrides,
+    }
+
+
+def _governor(queue, emr_client, kube, **ns_cfg):
+    return Governor({"namespaces": {"spark-ns": _ns_cfg(**ns_cfg)}}, queue, emr_client, kube)
+
+
+def _entries(queue, state):
+    rows = queue.conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def test_queue_survives_a_restart_in_priority_then_fifo_order(tmp_path):
+    db = str(tmp_path / "governor.db")
+    queue = JobQueue(db)
+    for name, priority in (("low", 0), ("high-1", 5), ("mid", 1), ("high-2", 5)):
+        queue.enqueue("spark-ns", {"name": name}, priority)
+    queue.enqueue("other-ns", {"name": "other"})
+
+    queue = JobQueue(db)
+
+    assert [e["request"]["name"] for e in queue.head("spark-ns", 10)] == ["high-1", "high-2", "mid", "low"]
+    assert queue.depth() == {"spark-ns": 4, "other-ns": 1}
+
+
+def test_capacity_snapshot_counts_only_schedulable_nodes():
+    kube = FakeKube(
+        nodes=[
+            _node("ready"),
+            _node("not-ready", ready="False"),
+            _node("fargate", **{"eks.amazonaws.com/compute-type": "fargate"}),
+        ],
+        pods=[
+            _pod("spark-ns", "ready", cpu="2", memory="8Gi"),
+            _pod("spark-ns", "fargate", cpu="4"),
+            _pod("spark-ns", "ready", cpu="4", phase="Succeeded"),
+            _pod("spark-ns", phase="Pending"),
+        ],
+    )
+
+    snapshot = capacity_snapshot(kube)
+
+    assert snapshot["free_cpu"] == 6.0
+    assert snapshot["free_memory"] == 24.0 * GiB
+    assert snapshot["pending_pods"] == {"spark-ns": 1}
+
+
+def test_admits_only_what_the_free_capacity_holds(tmp_path):
+    queue = JobQueue(str(tmp_path / "governor.db"))
+    for i in range(5):
+        queue.enqueue("spark-ns", {"name": f"job-{i}"})
+    # 8 free cores fit two jobs of 3 cores
+    emr_client = FakeEmrClient()
+    governor = _governor(queue, emr_client, FakeKube([_node("n1", cpu="12")], [_pod("spark-ns", "n1", cpu="4")]))
+
+    assert governor.tick() == {"spark-ns": 2}
+    assert [r["name"] for r in emr_client.requests] == ["job-0", "job-1"]
+    assert emr_client.requests[0]["virtualClusterId"] == "vc-1"
+    assert emr_client.requests[0]["executionRoleArn"] == "arn:aws:iam::123456789012:role/emr"
+    assert [e["job_run_id"] for e in _entries(queue, ADMITTED)] == ["jr-1", "jr-2"]
+    assert queue.depth() == {"spark-ns": 3}
+
+
+def test_pending_pods_hold_back_admission(tmp_path):
+    queue = JobQueue(str(tmp_path / "governor.db"))
+    queue.enqueue("spark-ns", {"name": "job"})
+    kube = FakeKube([_node("n1", cpu="64", memory="256Gi")], [_pod("spark-ns", phase="Pending")] * 3)
+
+    assert _governor(queue, FakeEmrClient(), kube, max_pending_pods=2).tick() == {"spark-ns": 0}
+
+
+def test_min_concurrent_jobs_are_admitted_without_free_capacity(tmp_path):
+    queue = JobQueue(str(tmp_path / "governor.db"))
+    for i in range(3):
+        queue.enqueue("spark-ns", {"name": f"job-{i}"})
+    # No nodes yet, the autoscaler needs pending pods to scale up for
+    governor = _governor(queue, FakeEmrClient(), FakeKube([]), min_concurrent_jobs=2)
+
+    assert governor.tick() == {"spark-ns": 2}
+
+
+def test_active_job_runs_count_against_the_concurrency_cap(tmp_path):
+    queue = JobQueue(str(tmp_path / "governor.db"))
+    for i in range(3):
+        queue.enqueue("spark-ns", {"name": f"job-{i}"})
+    kube = FakeKube([_node("n1", cpu="64", memory="256Gi")])
+
+    governor = _governor(queue, FakeEmrClient(active_job_runs=3), kube, max_concurrent_jobs=4)
+
+    assert governor.tick() == {"spark-ns": 1}
+
+
+def test_retry_after_a_throttling_error_reuses_the_client_token(tmp_path):
+    db = str(tmp_path / "governor.db")
+    queue = JobQueue(db)
+    queue.enqueue("spark-ns", {"name": "job"})
+    emr_client = FakeEmrClient(errors=["ThrottlingException"])
+    kube = FakeKube([_node("n1")])
+
+    assert _governor(queue, emr_client, kube).tick() == {"spark-ns": 0}
+    # The next round runs in a new process
+    assert _governor(JobQueue(db), emr_client, kube).tick() == {"spark-ns": 1}
+
+    first, retry = emr_client.requests
+    assert first["clientToken"] == retry["clientToken"]
+    assert uuid.UUID(first["clientToken"])
+
+
+def test_crash_before_the_bookkeeping_does_not_submit_twice(tmp_path):
+    queue = JobQueue(str(tmp_path / "governor.db"))
+    entry_id = queue.enqueue("spark-ns", {"name": "job"})
+    emr_client = FakeEmrClient()
+    # Submitted, but the governor stopped before marking the entry admitted
+    entry = queue.head("spark-ns", 1)[0]
+    emr_client.start_job_run(**entry["request"], clientToken=entry["client_token"])
+
+    _governor(queue, emr_client, FakeKube([_node("n1")])).tick()
+
+    assert list(emr_client.job_runs.values()) == ["jr-1"]
+    assert [(e["id"], e["job_run_id"]) for e in _entries(queue, ADMITTED)] == [(entry_id, "jr-1")]
+
+
+def test_every_entry_gets_its_own_client_token(tmp_path):
+    queue = JobQueue(str(tmp_path / "governor.db"))
+    for i in range(3):
+        queue.enqueue("spark-ns", {"name": f"job-{i}"})
+
+    assert len({e["client_token"] for e in queue.head("spark-ns", 3)}) == 3
+
+
+def test_permanent_errors_reject_the_entry_and_move_on(tmp_path):
+    queue = JobQueue(str(tmp_path / "governor.db"))
+    queue.enqueue("spark-ns", {"name": "bad"}, priority=1)
+    queue.enqueue("spark-ns", {"name": "good"})
+    emr_client = FakeEmrClient(errors=["ValidationException"])
+
+    assert _governor(queue, emr_client, FakeKube([_node("n1")])).tick() == {"spark-ns": 1}
+
+    rejected = _entries(queue, REJECTED)
+    assert [(e["request"], "ValidationException" in e["error"]) for e in rejected] == [('{"name": "bad"}', True)]
+    assert _entries(queue, QUEUED) == []
@@ -0,0 +1,64 @@
+import re
+
+import pytest
+
+from stacks.back_end.eks_cluster_stacks.node_profiles import get_node_profile, node_user_data, nodegroup_node_labels
+from stacks.k8s_utils.pod_templates import ARM64_NODE_TAINT
+
+
+def _kubelet_args(user_data):
+    args = re.search(r"--kubelet-extra-args '([^']*)'", user_data).group(1).split()
+    return dict(a[2:].split("=", 1) for a in args)
+
+
+def _user_data(**kwargs):
+    return node_user_data(
+        get_node_profile("spark_tuned"),
+        cluster_name="c_11_event_processor",
+        cluster_endpoint="https://example.eks.amazonaws.com",
+        cluster_ca="Q0E=",
+        **kwargs
+    )
+
+
+def _node_labels(args):
+    return dict(kv.split("=", 1) for kv in args["node-labels"].split(","))
+
+
+def test_spot_user_data_labels_the_capacity_type_and_node_group():
+    args = _kubelet_args(_user_data(
+        node_labels=nodegroup_node_labels(
+            {"app": "miztiik_spot_ng", "lifecycle": "spot"}, "spot_n_g_1_c_11", "SPOT")
+    ))
+
+    assert _node_labels(args) == {
+        "app": "miztiik_spot_ng",
+        "lifecycle": "spot",
+        "eks.amazonaws.com/nodegroup": "spot_n_g_1_c_11",
+        "eks.amazonaws.com/capacityType": "SPOT",
+    }
+    assert "register-with-taints" not in args
+
+
+def test_graviton_user_data_registers_the_arm64_taint():
+    args = _kubelet_args(_user_data(
+        node_labels=nodegroup_node_labels(
+            {"app": "miztiik_graviton_ng", "compute_provider": "ec2"}, "graviton_n_g_1_c_11", "ON_DEMAND"),
+        node_taints=[ARM64_NODE_TAINT]
+    ))
+
+    assert args["register-with-taints"] == "cpu-arch=arm64:NoSchedule"
+    assert _node_labels(args)["eks.amazonaws.com/capacityType"] == "ON_DEMAND"
+    assert _node_labels(args)["eks.amazonaws.com/nodegroup"] == "graviton_n_g_1_c_11"
+
+
+def test_untainted_user_data_registers_no_taints():
+    args = _kubelet_args(_user_data(node_labels={"app": "miztiik_on_demand_ng"}))
+
+    assert "register-with-taints" not in args
+    assert args["cpu-manager-policy"] == "static"
+
+
+def test_unknown_capacity_type_is_rejected():
+    with pytest.raises(ValueError):
+        nodegroup_node_labels({}, "ng", "spot")
@@ -0,0 +1,122 @@
+import functools
+import json
+import os
+import runpy
+
+import pytest
+
+assertions = pytest.importorskip("aws_cdk.assertions")
+
+from aws_cdk import core as cdk
+
+from stacks.cdk_utils.template_budgets import (
+    SNAPSHOTS_DIR,
+    check_stack,
+    load_budgets,
+    load_stack_templates,
+    snapshot_drift,
+    stack_budget,
+    template_stats,
+)
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Context `cdk synth` adds for the app, the nested stacks are found through the asset metadata
+CLI_CONTEXT = {
+    "aws:cdk:enable-path-metadata": True,
+    "aws:cdk:enable-asset-metadata": True,
+}
+
+# Every optional stack, on top of the `cdk.json` context. The metrics server stack is left
+# out, it downloads its manifest at synth.
+ALL_FEATURES_CONTEXT = {
+    "spark_drivers_on_fargate": True,
+    "ebs_csi": True,
+    "executor_spill_pvc": True,
+    "graviton_nodes": 2,
+    "spot_nodes": 2,
+    "node_profile": "spark_tuned",
+    "node_termination_handler": True,
+    "alluxio_cache": True,
+    "log_shipping": True,
+    "api_flow_control": True,
+}
+
+
+def _synth(tmp_path_factory, **context_overrides):
+    """
+    `(app, cdk_out_dir)` of the app synthesized in-process with the `cdk.json` context
+    """
+    cdk_out_dir = str(tmp_path_factory.mktemp("cdk.out"))
+    with open(os.path.join(REPO_ROOT, "cdk.json")) as f:
+        context = {**json.load(f)["context"], **context_overrides, **CLI_CONTEXT}
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(REPO_ROOT)
+        # The jsii runtime is already running, it would not see CDK_CONTEXT_JSON & CDK_OUTDIR
+        mp.setattr(cdk, "App", functools.partial(cdk.App, context=context, outdir=cdk_out_dir))
+        app = runpy.run_path(os.path.join(REPO_ROOT, "app.py"))["app"]
+    return app, cdk_out_dir
+
+
+def _stack_templates(app, cdk_out_dir):
+    """
+    `{stack_name: (Template, template file)}` of the stacks in the cloud assembly
+    """
+    return {
+        name: (assertions.Template.from_stack(app.node.find_child(name)), template_file)
+        for name, template_file in load_stack_templates(cdk_out_dir).items()
+    }
+
+
+@pytest.fixture(scope="module")
+def cloud_assembly(tmp_path_factory):
+    """
+    The `cdk.json` context, the one the snapshots are recorded with
+    """
+    return _synth(tmp_path_factory)
+
+
+@pytest.fixture(scope="module")
+def stack_templates(cloud_assembly):
+    return _stack_templates(*cloud_assembly)
+
+
+@pytest.fixture(scope="module")
+def all_features_assembly(tmp_path_factory):
+    return _synth(tmp_path_factory, **ALL_FEATURES_CONTEXT)
+
+
+@pytest.mark.parametrize("assembly", ["cloud_assembly", "all_features_assembly"])
+def test_stacks_are_within_their_budgets(request, assembly):
+    app, cdk_out_dir = request.getfixturevalue(assembly)
+    stack_templates = _stack_templates(app, cdk_out_dir)
+    budgets = load_budgets()
+
+    errors = []
+    for name, (template, template_file) in sorted(stack_templates.items()):
+        stats = template_stats(template_file, cdk_out_dir, template=template.to_json())
+        errors += check_stack(name, stats, stack_budget(budgets, name))
+
+    assert errors == []
+
+
+def test_shared_assets_stack_has_no_custom_resources(stack_templates):
+    template, _ = stack_templates["eks-shared-assets-stack"]
+
+    template.resource_count_is("AWS::Lambda::Function", 0)
+    resources = template.to_json().get("Resources", {}).values()
+    assert [r["Type"] for r in resources if r["Type"].startswith("Custom::")] == []
+
+
+def test_templates_match_their_snapshots(stack_templates):
+    snapshots_dir = os.path.join(REPO_ROOT, SNAPSHOTS_DIR)
+
+    missing = sorted(n for n in stack_templates
+                     if not os.path.isfile(os.path.join(snapshots_dir, f"{n}.json")))
+    assert missing == [], "Record them with `python -m stacks.cdk_utils.template_budgets --update-snapshots`"
+
+    drift = []
+    for name, (_, template_file) in sorted(stack_templates.items()):
+        drift += snapshot_drift(name, template_file, snapshots_dir)
+    assert drift == []